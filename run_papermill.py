@@ -66,7 +66,7 @@ pm.execute_notebook(
     f"{experiment_dir}/apriori_strict_results.ipynb",  # Lưu riêng vào thư mục experiment
     parameters=dict(
         BASKET_BOOL_PATH="data/processed/basket_bool.parquet",
-        RULES_OUTPUT_PATH=f"{experiment_dir}/rules_strict.csv",  # Lưu rules theo experiment
+        RULES_OUTPUT_PATH=f"{experiment_dir}/rules_strict.parquet",  # Lưu rules theo experiment
 
         # Tham số Apriori
         MIN_SUPPORT=0.005,
@@ -113,7 +113,13 @@ print("Đã chạy xong pipeline")
 # Đọc rules đã tạo
 try:
     import pandas as pd
-    rules_df = pd.read_csv(f"{experiment_dir}/rules_strict.csv")
+    # Item là cột list<string>: ghép thành chuỗi để in, không cần parse frozenset
+    rules_df = pd.read_parquet(
+        f"{experiment_dir}/rules_strict.parquet",
+        columns=["antecedents", "consequents", "support", "confidence", "lift"],
+    )
+    rules_df["antecedents_str"] = rules_df["antecedents"].apply(lambda items: ", ".join(sorted(items)))
+    rules_df["consequents_str"] = rules_df["consequents"].apply(lambda items: ", ".join(sorted(items)))
     
     print(f"\n📊 KẾT QUẢ THÍ NGHIỆM: {experiment_params['description']}")
     print(f"📅 Thời gian: {experiment_params['timestamp']}")
@@ -170,7 +176,7 @@ try:
             json.dump(summary, f, indent=2)
             
         print(f"\n📁 Kết quả đã được lưu tại: {experiment_dir}/")
-        print(f"   • rules_strict.csv - Toàn bộ rules")
+        print(f"   • rules_strict.parquet - Toàn bộ rules")
         print(f"   • experiment_config.json - Cấu hình thí nghiệm")
         print(f"   • experiment_summary.json - Tóm tắt kết quả")
         print(f"   • apriori_strict_results.ipynb - Notebook kết quả")
@@ -182,7 +188,7 @@ try:
             json.dump(summary, f, indent=2)
             
 except FileNotFoundError:
-    print(f"\n❌ Không tìm thấy file rules tại: {experiment_dir}/rules_strict.csv")
+    print(f"\n❌ Không tìm thấy file rules tại: {experiment_dir}/rules_strict.parquet")
 except Exception as e:
     print(f"\n❌ Lỗi khi đọc kết quả: {str(e)}")
 
@@ -6,14 +6,18 @@ import seaborn as sns
 import os
 import time
 import warnings
-from apriori_library import BasketPreparer, AssociationRulesMiner, FPGrowthMiner, WeightedAssociationMiner
+from apriori_library import DataCleaner, BasketPreparer, AssociationRulesMiner, FPGrowthMiner, WeightedAssociationMiner, BitsetBasket, FrequentItemsetCache, MiningPlanner, iter_rules
 from mlxtend.frequent_patterns import fpgrowth, association_rules
 
 warnings.filterwarnings('ignore')
 
-def solve_topic_2(input_csv, save_dir="reports/topic_2"):
+def solve_topic_2(input_csv, save_dir="reports/topic_2", cache_dir=None):
     """
     Hàm chính thực hiện chủ đề 2: So sánh Apriori vs FP-Growth và phân tích luật có trọng số.
+
+    input_csv có thể là file CSV đã làm sạch hoặc thư mục Parquet dataset.
+    Itemsets FP-Growth được lưu vào cache_dir (mặc định: save_dir/.cache/itemsets)
+    để các bước sau và các lần chạy sau dùng lại.
     """
     print("🚀 Đang khởi động phân tích Chủ đề 2...")
     print("=" * 60)
@@ -21,7 +25,13 @@ def solve_topic_2(input_csv, save_dir="reports/topic_2"):
     # ====================== 1. CHUẨN BỊ DỮ LIỆU ======================
     print("📂 1. Đang tải và chuẩn bị dữ liệu...")
     try:
-        df_raw = pd.read_csv(input_csv, low_memory=False)
+        if os.path.isdir(input_csv):
+            # Parquet dataset (save_cleaned_data(file_format="parquet_dataset")): chỉ đọc các cột cần dùng
+            df_raw = DataCleaner.read_cleaned_data(
+                input_csv, columns=["InvoiceNo", "Description", "Quantity", "UnitPrice"]
+            )
+        else:
+            df_raw = pd.read_csv(input_csv, low_memory=False)
     except FileNotFoundError:
         print(f"❌ Không tìm thấy file: {input_csv}")
         print("⚠️  Vui lòng kiểm tra đường dẫn file.")
@@ -48,23 +58,13 @@ def solve_topic_2(input_csv, save_dir="reports/topic_2"):
     # Tính weights vector
     weights_v = basket_bool.index.map(invoice_weights).fillna(0).values
     
-    # Phân tích từng sản phẩm
-    hub_list = []
-    for prod in basket_bool.columns:
-        mask = basket_bool[prod].values == 1
-        freq = mask.mean()  # Tần suất (Support thường)
-        if mask.any():
-            val = weights_v[mask].sum() / total_revenue  # Weighted support
-        else:
-            val = 0.0
-        
-        hub_list.append({
-            'Product': prod, 
-            'Frequency': freq, 
-            'Value': val
-        })
-    
-    df_hub = pd.DataFrame(hub_list)
+    # Phân tích từng sản phẩm: bitset mỗi sản phẩm -> tần suất & tổng trọng số (vector hoá)
+    bitset = BitsetBasket.from_basket(basket_bool)
+    df_hub = pd.DataFrame({
+        'Product': basket_bool.columns,
+        'Frequency': bitset.item_supports(),  # Tần suất (Support thường)
+        'Value': bitset.item_weighted_sums(weights_v) / total_revenue,  # Weighted support
+    })
     
     # ====================== 3. TRỰC QUAN HÓA HUB SẢN PHẨM ======================
     print("\n🎨 3. Đang tạo biểu đồ Hub sản phẩm...")
@@ -124,66 +124,73 @@ def solve_topic_2(input_csv, save_dir="reports/topic_2"):
     # ====================== 4. THỬ NGHIỆM SO SÁNH THUẬT TOÁN (ĐƠN GIẢN) ======================
     print("\n🔬 4. Đang thực nghiệm so sánh Apriori vs FP-Growth...")
     
+    # Cache itemsets: thí nghiệm vẫn đo thời gian khai phá thật, nhưng lưu kết quả lại
+    itemset_cache = FrequentItemsetCache(cache_dir or os.path.join(save_dir, ".cache", "itemsets"))
+    basket_fingerprint = itemset_cache.fingerprint(basket_bool)
+    
+    # Ước lượng ứng viên/bộ nhớ/thời gian trước khi chạy mỗi thuật toán
+    planner = MiningPlanner(basket_bool, max_memory_mb=2048, max_seconds=600)
+    
     # Chỉ chạy với 2 giá trị min_support để tránh lỗi
     support_values = [0.05, 0.03]
     min_confidence = 0.3
     
     experiment_results = []
     
+    def count_rules(freq_items):
+        # Cùng một bộ sinh luật cho cả hai thuật toán: đếm theo từng batch,
+        # ngưỡng confidence/lift áp dụng ngay khi sinh
+        if len(freq_items) == 0:
+            return 0
+        return sum(
+            len(batch)
+            for batch in iter_rules(freq_items, min_confidence=min_confidence, min_lift=1.0)
+        )
+    
     for min_sup in support_values:
         print(f"   • Đang chạy với min_support = {min_sup:.3f}...")
+        estimates = planner.plan(min_support=min_sup)["estimates"]
         
         # FP-Growth
         try:
             fp_start = time.time()
             fp_miner = FPGrowthMiner(basket_bool)
             freq_items_fp = fp_miner.run(min_support=min_sup, use_colnames=True)
-            
-            if len(freq_items_fp) > 0:
-                rules_fp = association_rules(freq_items_fp, metric="confidence", 
-                                            min_threshold=min_confidence)
-                rules_fp = rules_fp[rules_fp['lift'] >= 1.0]
-            else:
-                rules_fp = pd.DataFrame()
-            
+            n_rules_fp = count_rules(freq_items_fp)
             fp_time = time.time() - fp_start
+            itemset_cache.put(basket_fingerprint, min_sup, freq_items_fp)
             
         except Exception as e:
             print(f"     - FP-Growth lỗi: {str(e)[:50]}...")
             fp_time = 0
-            rules_fp = pd.DataFrame()
+            n_rules_fp = 0
         
-        # Apriori (chỉ chạy với min_sup >= 0.03)
-        if min_sup >= 0.03:
+        # Apriori (chỉ chạy khi ước lượng nằm trong ngân sách bộ nhớ/thời gian)
+        if estimates.loc["apriori", "within_budget"]:
             try:
                 ap_start = time.time()
                 ap_miner = AssociationRulesMiner(basket_bool)
                 freq_items_ap = ap_miner.mine_frequent_itemsets(min_support=min_sup, 
                                                               use_colnames=True)
-                
-                if len(freq_items_ap) > 0:
-                    rules_ap = ap_miner.generate_rules(metric="confidence", 
-                                                      min_threshold=min_confidence)
-                    rules_ap = rules_ap[rules_ap['lift'] >= 1.0]
-                else:
-                    rules_ap = pd.DataFrame()
-                
+                n_rules_ap = count_rules(freq_items_ap)
                 ap_time = time.time() - ap_start
                 
             except Exception as e:
                 print(f"     - Apriori lỗi: {str(e)[:50]}...")
                 ap_time = 0
-                rules_ap = pd.DataFrame()
+                n_rules_ap = 0
         else:
+            print(f"     - Bỏ qua Apriori: ước lượng ~{estimates.loc['apriori', 'memory_mb']:,.0f} MB, "
+                  f"~{estimates.loc['apriori', 'seconds']:,.0f} s vượt ngân sách")
             ap_time = 0
-            rules_ap = pd.DataFrame()
+            n_rules_ap = 0
         
         experiment_results.append({
             'min_support': min_sup,
             'FP_Time': fp_time,
             'AP_Time': ap_time,
-            'FP_Rules': len(rules_fp),
-            'AP_Rules': len(rules_ap),
+            'FP_Rules': n_rules_fp,
+            'AP_Rules': n_rules_ap,
         })
     
     df_results = pd.DataFrame(experiment_results)
@@ -195,7 +202,7 @@ def solve_topic_2(input_csv, save_dir="reports/topic_2"):
     target_min_support = 0.03
     
     try:
-        fp_miner = FPGrowthMiner(basket_bool)
+        fp_miner = FPGrowthMiner(basket_bool, cache=itemset_cache)
         freq_items = fp_miner.run(min_support=target_min_support, use_colnames=True)
         
         if len(freq_items) > 0:
@@ -206,7 +213,7 @@ def solve_topic_2(input_csv, save_dir="reports/topic_2"):
             # Tính toán các metrics có trọng số
             w_miner = WeightedAssociationMiner()
             rules_weighted = w_miner.compute_weighted_metrics(rules.copy(), 
-                                                             basket_bool, df_raw)
+                                                             bitset, df_raw)
             
             # Thêm cột đọc được
             rules_weighted['antecedents_str'] = rules_weighted['antecedents'].apply(
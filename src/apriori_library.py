@@ -7,17 +7,80 @@ and association rule analysis for shopping cart.
 """
 
 import datetime as dt
+import hashlib
+import heapq
+import itertools
+import json
 import os
+import re
+import shutil
+import time
+import warnings
+import weakref
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from pandas._libs.sparse import IntIndex
 import seaborn as sns
+from scipy import sparse as sp
 from scipy import stats
-from mlxtend.frequent_patterns import apriori, association_rules, fpgrowth
+from mlxtend.frequent_patterns import apriori, association_rules, fpgrowth, fpmax
 from sklearn.preprocessing import StandardScaler
 import plotly.express as px
 import networkx as nx
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+
+def _memory_mb(df: pd.DataFrame) -> float:
+    """Return the deep memory usage of a dataframe in MB."""
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def _sparse_bool_frame(matrix, index, columns) -> pd.DataFrame:
+    """
+    Sparse boolean DataFrame of a scipy matrix, one SparseDtype(bool, False) column per item.
+
+    DataFrame.sparse.from_spmatrix() uses fill value 0 for a bool matrix,
+    which pandas 2.x warns about on every call.
+    """
+    matrix = sp.csc_matrix(matrix, dtype=bool)
+    matrix.sort_indices()
+    dtype = pd.SparseDtype(bool, False)
+    n_rows = matrix.shape[0]
+    arrays = {
+        j: pd.arrays.SparseArray(
+            matrix.data[start:end],
+            sparse_index=IntIndex(n_rows, matrix.indices[start:end]),
+            dtype=dtype,
+        )
+        for j, (start, end) in enumerate(zip(matrix.indptr[:-1], matrix.indptr[1:]))
+    }
+    frame = pd.DataFrame(arrays, index=index, copy=False)
+    frame.columns = columns
+    return frame
+
+
+def _check_pruned_support(basket, min_support: float):
+    """
+    Warn when mining a pruned basket below the support it was pruned for.
+
+    BasketPreparer.encode_basket(min_support=..., top_k=...) records the
+    highest support among dropped items in attrs['max_pruned_support'];
+    results are exact only for min_support above that value.
+    """
+    attrs = getattr(basket, "attrs", {}) or {}
+    max_pruned = attrs.get("max_pruned_support")
+    if max_pruned is not None and min_support <= max_pruned:
+        warnings.warn(
+            f"Basket đã bỏ các item có support tới {max_pruned:.5f}; "
+            f"kết quả với min_support={min_support} có thể thiếu itemset.",
+            stacklevel=3,
+        )
 
 
 # =========================================================
@@ -32,81 +95,350 @@ class DataCleaner:
     data analysis for online retail datasets.
     """
 
-    def __init__(self, data_path):
+    def __init__(self, data_path, compact: bool = False, cache_dir: str = None,
+                 use_cache: bool = True, country: str = "United Kingdom"):
         """
         Initialize the DataCleaner with data path.
 
         Args:
             data_path (str): Path to the raw data file
+            compact (bool): If True, loaded frames use compact dtypes
+                (see compact_frame())
+            cache_dir (str, optional): Directory for the ingest cache.
+                Defaults to a '.cache' folder next to the raw file.
+            use_cache (bool): Reuse the typed columnar copy of the raw file
+                in load_data() while the file is unchanged
+            country (str, optional): Country kept by clean_data(); None keeps
+                every country (the result is still stored in df_uk)
         """
         self.data_path = data_path
+        self.country = country
+        self.compact = compact
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir or os.path.join(
+            os.path.dirname(os.path.abspath(data_path)), ".cache"
+        )
         self.df = None
         self.df_uk = None
         self.rfm_data = None
+        self.rfm_state = None
+
+    # Kiểu dữ liệu khi đọc file gốc
+    RAW_DTYPES = dict(
+        InvoiceNo=str,
+        StockCode=str,
+        Description=str,
+        Quantity=np.int64,
+        UnitPrice=np.float64,
+        CustomerID=str,
+        Country=str,
+    )
 
     def load_data(self):
         """
         Load and display basic information about the dataset.
 
+        When use_cache is enabled, the parsed frame is stored as an
+        uncompressed Feather file and memory-mapped on later calls instead
+        of re-parsing the CSV (see _read_cache()).
+
         Returns:
             pd.DataFrame: Loaded dataframe
         """
-        dtype = dict(
-            InvoiceNo=str,
-            StockCode=str,
-            Description=str,
-            Quantity=np.int64,
-            UnitPrice=np.float64,
-            CustomerID=str,
-            Country=str,
-        )
+        self.df = self._read_cache() if self.use_cache else None
 
-        self.df = pd.read_csv(
-            self.data_path,
-            encoding="ISO-8859-1",
-            parse_dates=["InvoiceDate"],
-            dtype=dtype,
+        if self.df is None:
+            self.df = pd.read_csv(
+                self.data_path,
+                encoding="ISO-8859-1",
+                parse_dates=["InvoiceDate"],
+                dtype=self.RAW_DTYPES,
+            )
+
+            # Chuyển CustomerID thành format 6 ký tự
+            self.df["CustomerID"] = self._format_customer_id(self.df["CustomerID"])
+
+            if self.use_cache:
+                self._write_cache(self.df)
+
+        print(f"Kích thước dữ liệu: {self.df.shape}")
+        print(f"Số bản ghi: {len(self.df):,}")
+
+        if self.compact:
+            self.df = self._compact_with_report(self.df)
+
+        return self.df
+
+    def _cache_paths(self):
+        """Return (data_path, manifest_path) of the ingest cache for this raw file."""
+        source = os.path.abspath(self.data_path)
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+        stem = os.path.join(
+            self.cache_dir, f"{os.path.splitext(os.path.basename(source))[0]}-{key}"
         )
+        return f"{stem}.feather", f"{stem}.json"
 
-        # Chuyển CustomerID thành format 6 ký tự
-        self.df["CustomerID"] = (
-            self.df["CustomerID"]
+    @staticmethod
+    def _file_sha256(path: str, block_size: int = 1 << 20) -> str:
+        """Compute the SHA-256 of a file, reading it block by block."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _read_cache(self):
+        """
+        Load the cached copy of the raw file if it is still valid.
+
+        The cache is keyed by path, size, mtime and content hash. A size
+        change invalidates it immediately; if only the mtime changed, the
+        content hash decides (and the manifest is refreshed on a match).
+
+        Returns:
+            pd.DataFrame or None: Cached dataframe, or None on a cache miss
+        """
+        cache_path, manifest_path = self._cache_paths()
+        if not (os.path.exists(cache_path) and os.path.exists(manifest_path)):
+            return None
+
+        try:
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None  # Manifest hỏng (ví dụ lần chạy trước bị ngắt): coi như cache miss
+        stat = os.stat(self.data_path)
+
+        if manifest.get("source") != os.path.abspath(self.data_path):
+            return None
+        if manifest.get("size") != stat.st_size:
+            return None
+        if manifest.get("mtime_ns") != stat.st_mtime_ns:
+            if manifest.get("sha256") != self._file_sha256(self.data_path):
+                return None
+            manifest["mtime_ns"] = stat.st_mtime_ns
+            self._write_manifest(manifest_path, manifest)
+
+        table = feather.read_table(cache_path, memory_map=True)
+        print(f"Đọc từ cache: {cache_path}")
+        return table.to_pandas()
+
+    def _write_cache(self, df: pd.DataFrame):
+        """Write the parsed raw dataframe and its fingerprint to the ingest cache."""
+        cache_path, manifest_path = self._cache_paths()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stat = os.stat(self.data_path)
+
+        # Ghi ra file tạm rồi đổi tên để không để lại cache dở dang
+        tmp_path = f"{cache_path}.tmp"
+        df.reset_index(drop=True).to_feather(tmp_path, compression="uncompressed")
+        os.replace(tmp_path, cache_path)
+
+        manifest = {
+            "source": os.path.abspath(self.data_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": self._file_sha256(self.data_path),
+        }
+        self._write_manifest(manifest_path, manifest)
+
+    @staticmethod
+    def _write_manifest(manifest_path: str, manifest: dict):
+        """Write the cache manifest atomically (temp file + os.replace)."""
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    # Các cột chuỗi được mã hoá dạng category (từ điển + mã số nguyên)
+    CATEGORICAL_COLUMNS = ["InvoiceNo", "StockCode", "Description", "CustomerID", "Country"]
+
+    @classmethod
+    def compact_frame(cls, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Convert a transaction dataframe to compact dtypes.
+
+        String columns (InvoiceNo, StockCode, Description, CustomerID, Country)
+        become categoricals, i.e. integer codes plus a dictionary of values.
+        Quantity is downcast to the smallest integer type. UnitPrice stays
+        float64: narrowing it would change TotalPrice and Monetary (2.55
+        would become 2.5499999523).
+
+        Args:
+            df (pd.DataFrame): Transaction dataframe
+
+        Returns:
+            pd.DataFrame: Compact copy of the dataframe
+        """
+        df = df.copy()
+        for col in cls.CATEGORICAL_COLUMNS:
+            if col in df.columns:
+                if isinstance(df[col].dtype, pd.CategoricalDtype):
+                    df[col] = df[col].cat.remove_unused_categories()
+                else:
+                    df[col] = df[col].astype("category")
+
+        if "Quantity" in df.columns:
+            df["Quantity"] = pd.to_numeric(df["Quantity"], downcast="integer")
+        return df
+
+    def _compact_with_report(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Apply compact_frame() and print memory usage before and after."""
+        before = _memory_mb(df)
+        df = self.compact_frame(df)
+        after = _memory_mb(df)
+        print(f"Bộ nhớ: {before:,.1f} MB → {after:,.1f} MB "
+              f"(giảm {before / max(after, 1e-9):.1f} lần)")
+        return df
+
+    @staticmethod
+    def _total_price(df: pd.DataFrame) -> pd.Series:
+        """Quantity * UnitPrice in float64 (Quantity may be a downcast integer)."""
+        return df["Quantity"] * df["UnitPrice"].astype(np.float64)
+
+    @staticmethod
+    def _is_cancelled(invoice_no: pd.Series) -> pd.Series:
+        """
+        Flag cancelled invoices (InvoiceNo starting with 'C').
+
+        For categorical columns only the dictionary is checked, so the
+        codes never have to be expanded back to strings.
+        """
+        if isinstance(invoice_no.dtype, pd.CategoricalDtype):
+            flags = invoice_no.cat.categories.astype(str).str.startswith("C")
+            flags = np.append(np.asarray(flags, dtype=bool), False)  # code -1 = NaN
+            return pd.Series(flags[invoice_no.cat.codes.to_numpy()], index=invoice_no.index)
+        return invoice_no.astype(str).str.startswith("C")
+
+    @staticmethod
+    def _format_customer_id(customer_id: pd.Series) -> pd.Series:
+        """
+        Normalize CustomerID to a zero-padded 6-character string.
+
+        Args:
+            customer_id (pd.Series): Raw CustomerID column
+
+        Returns:
+            pd.Series: Formatted CustomerID column
+        """
+        return (
+            customer_id
             .astype(str)
             .str.replace(".0", "", regex=False)
             .str.zfill(6)
         )
 
-        print(f"Kích thước dữ liệu: {self.df.shape}")
-        print(f"Số bản ghi: {len(self.df):,}")
+    @staticmethod
+    def _filter_valid_rows(df: pd.DataFrame, country: str = "United Kingdom") -> pd.DataFrame:
+        """
+        Keep valid rows of a dataframe whose cancelled invoices are already removed.
 
-        return self.df
+        Args:
+            df (pd.DataFrame): Transaction rows without cancelled invoices
+            country (str, optional): Country to keep (None keeps all countries)
 
-    def clean_data(self):
+        Returns:
+            pd.DataFrame: Filtered rows (a copy)
+        """
+        # Chỉ tập trung vào khách hàng của country được chọn
+        if country is None:
+            df = df.copy()
+        else:
+            df = df[df["Country"] == country].copy()
+
+        # Loại bỏ các sản phẩm có quantity hoặc price không hợp lệ
+        df = df[(df["Quantity"] > 0) & (df["UnitPrice"] > 0)]
+
+        # Bỏ description NA
+        df = df.dropna(subset=["Description"])
+
+        return df
+
+    def load_and_clean_chunked(self, chunksize: int = 100_000, max_memory_mb: float = None):
         """
-        Clean the dataset by removing invalid records and focusing on UK customers.
+        Stream the raw CSV in chunks and keep only rows that survive cleaning.
+
+        Each chunk goes through the same filters as clean_data() (cancelled
+        invoices, country, quantity/price, missing description), so the full
+        raw file is never held in memory. The result equals the df_uk produced
+        by load_data() + clean_data(), index included.
+
+        Args:
+            chunksize (int): Number of raw rows read per chunk
+            max_memory_mb (float, optional): Ceiling for the memory held by
+                surviving rows. A MemoryError is raised when it is exceeded.
 
         Returns:
             pd.DataFrame: Cleaned UK dataset
         """
+        reader = pd.read_csv(
+            self.data_path,
+            encoding="ISO-8859-1",
+            parse_dates=["InvoiceDate"],
+            dtype=self.RAW_DTYPES,
+            chunksize=chunksize,
+        )
+
+        parts = []
+        n_rows = 0
+        kept_bytes = 0
+        for chunk in reader:
+            n_rows += len(chunk)
+            chunk["CustomerID"] = self._format_customer_id(chunk["CustomerID"])
+            chunk["TotalPrice"] = self._total_price(chunk)
+
+            # Loại bỏ các hóa đơn bị hủy (bắt đầu bằng 'C')
+            chunk = chunk[~self._is_cancelled(chunk["InvoiceNo"])]
+            chunk = self._filter_valid_rows(chunk, self.country)
+
+            if len(chunk) == 0 and parts:
+                continue
+            parts.append(chunk)
+
+            kept_bytes += chunk.memory_usage(deep=True).sum()
+            if max_memory_mb is not None and kept_bytes > max_memory_mb * 1024 ** 2:
+                raise MemoryError(
+                    f"Dữ liệu sau khi lọc vượt quá {max_memory_mb} MB "
+                    f"(đã đọc {n_rows:,} dòng)."
+                )
+
+        if not parts:
+            raise ValueError(f"File dữ liệu rỗng: {self.data_path}")
+
+        self.df = None
+        self.df_uk = pd.concat(parts) if len(parts) > 1 else parts[0]
+        if self.compact:
+            self.df_uk = self._compact_with_report(self.df_uk)
+
+        print(f"Số bản ghi đã đọc: {n_rows:,}")
+        print(f"Số bản ghi giữ lại: {len(self.df_uk):,} "
+              f"({kept_bytes / 1024 ** 2:.1f} MB)")
+
+        return self.df_uk
+
+    def clean_data(self):
+        """
+        Clean the dataset by removing invalid records and focusing on customers
+        of the selected country (United Kingdom by default).
+
+        Returns:
+            pd.DataFrame: Cleaned dataset of the selected country
+        """
         if self.df is None:
             raise ValueError("Data not loaded. Please call load_data() first.")
         
         # Thêm cột TotalPrice
-        self.df["TotalPrice"] = self.df["Quantity"] * self.df["UnitPrice"]
+        self.df["TotalPrice"] = self._total_price(self.df)
 
         # Loại bỏ các hóa đơn bị hủy (bắt đầu bằng 'C')
-        self.df = self.df[~self.df["InvoiceNo"].astype(str).str.startswith("C")]
-
-        # Chỉ tập trung vào khách hàng UK
-        self.df_uk = self.df[self.df["Country"] == "United Kingdom"].copy()
+        self.df = self.df[~self._is_cancelled(self.df["InvoiceNo"])]
 
-        # Loại bỏ các sản phẩm có quantity hoặc price không hợp lệ
-        self.df_uk = self.df_uk[
-            (self.df_uk["Quantity"] > 0) & (self.df_uk["UnitPrice"] > 0)
-        ]
+        # Lọc country, quantity/price và description NA
+        self.df_uk = self._filter_valid_rows(self.df, self.country)
 
-        # Bỏ description NA
-        self.df_uk = self.df_uk.dropna(subset=["Description"])
+        # Bỏ các giá trị category không còn xuất hiện sau khi lọc
+        if self.compact:
+            self.df_uk = self.compact_frame(self.df_uk)
 
         return self.df_uk
 
@@ -127,7 +459,7 @@ class DataCleaner:
         if self.df_uk is None:
             raise ValueError("Cleaned UK data not available. Call clean_data() first.")
 
-        self.df_uk["TotalPrice"] = self.df_uk["Quantity"] * self.df_uk["UnitPrice"]
+        self.df_uk["TotalPrice"] = self._total_price(self.df_uk)
         return self.df_uk
 
     def compute_rfm(self, snapshot_date=None):
@@ -145,55 +477,343 @@ class DataCleaner:
         if self.df_uk is None:
             raise ValueError("Cleaned UK data not available. Call clean_data() first.")
 
-        df = self.df_uk.copy()
+        # Tính RFM bằng trạng thái tích luỹ (vector hoá, không copy df_uk)
+        self.rfm_state = IncrementalRFM()
+        self.rfm_state.update(self.df_uk)
 
-        # Đảm bảo có TotalPrice
-        if "TotalPrice" not in df.columns:
-            df["TotalPrice"] = df["Quantity"] * df["UnitPrice"]
+        self.rfm_data = self.rfm_state.compute(snapshot_date)
+        return self.rfm_data
 
-        # Xác định snapshot_date
-        if snapshot_date is None:
-            snapshot_date = df["InvoiceDate"].max() + pd.Timedelta(days=1)
+    def save_cleaned_data(
+        self,
+        output_dir="../data/processed",
+        file_format: str = "csv",
+        partition_by_country: bool = False,
+    ):
+        """
+        Save cleaned data to specified directory.
+
+        Args:
+            output_dir (str): Output directory path
+            file_format (str): 'csv' (cleaned_uk_data.csv), 'parquet'
+                (cleaned_uk_data.parquet, keeps compact dtypes on reload) or
+                'parquet_dataset' (cleaned_uk_data/ partitioned by YearMonth,
+                readable with read_cleaned_data())
+            partition_by_country (bool): For 'parquet_dataset', also
+                partition by Country
+        """
+        if self.df_uk is None:
+            raise ValueError("Cleaned UK data not available. Call clean_data() first.")
+
+        os.makedirs(output_dir, exist_ok=True)
+        if file_format == "csv":
+            output_path = f"{output_dir}/cleaned_uk_data.csv"
+            self.df_uk.to_csv(output_path, index=False)
+        elif file_format == "parquet":
+            output_path = f"{output_dir}/cleaned_uk_data.parquet"
+            self.df_uk.to_parquet(output_path, index=False)
+        elif file_format == "parquet_dataset":
+            output_path = f"{output_dir}/cleaned_uk_data"
+            self._write_partitioned(self.df_uk, output_path, partition_by_country)
         else:
-            # Cho phép truyền vào dạng string 'YYYY-MM-DD'
-            if isinstance(snapshot_date, str):
-                snapshot_date = pd.to_datetime(snapshot_date)
+            raise ValueError(f"file_format không hợp lệ: {file_format}")
+        print(f"Đã lưu dữ liệu đã làm sạch: {output_path}")
 
-        # Tính RFM
-        rfm = df.groupby("CustomerID").agg(
-            {
-                "InvoiceDate": lambda x: (snapshot_date - x.max()).days,  # Recency
-                "InvoiceNo": "nunique",  # Frequency
-                "TotalPrice": "sum",     # Monetary
-            }
+    # Số dòng tối đa mỗi row group khi ghi Parquet dataset
+    ROWS_PER_GROUP = 64_000
+    # Khoá metadata lưu thứ tự cột gốc của dataset
+    COLUMNS_METADATA_KEY = b"cleaned_columns"
+
+    @classmethod
+    def _partitioning(cls, partition_by_country: bool):
+        """Hive partitioning schema used by the cleaned Parquet dataset."""
+        fields = [("YearMonth", pa.string())]
+        if partition_by_country:
+            fields.append(("Country", pa.string()))
+        return ds.partitioning(pa.schema(fields), flavor="hive")
+
+    @classmethod
+    def _write_partitioned(cls, df: pd.DataFrame, output_path: str, partition_by_country: bool):
+        """
+        Write a Parquet dataset partitioned by YearMonth (and optionally Country).
+
+        Rows are sorted by InvoiceDate so that row-group statistics on
+        InvoiceDate are tight and date filters can skip whole row groups.
+        The column order of df is stored in the schema metadata, since
+        partition keys are read back as the last columns.
+        """
+        df = df.sort_values("InvoiceDate", kind="stable")
+        year_month = df["InvoiceDate"].dt.strftime("%Y-%m")
+        table = pa.Table.from_pandas(df.assign(YearMonth=year_month), preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            cls.COLUMNS_METADATA_KEY: json.dumps([str(name) for name in df.columns]),
+        })
+        if partition_by_country:
+            table = table.set_column(
+                table.schema.get_field_index("Country"),
+                "Country",
+                table.column("Country").cast(pa.string()),
+            )
+
+        # Ghi đè toàn bộ dataset cũ (có thể có cách chia partition khác)
+        if os.path.isdir(output_path):
+            shutil.rmtree(output_path)
+
+        ds.write_dataset(
+            table,
+            output_path,
+            format="parquet",
+            partitioning=cls._partitioning(partition_by_country),
+            max_rows_per_group=cls.ROWS_PER_GROUP,
+            min_rows_per_group=min(cls.ROWS_PER_GROUP, 8_192),
         )
 
-        rfm.rename(
-            columns={
-                "InvoiceDate": "Recency",
-                "InvoiceNo": "Frequency",
-                "TotalPrice": "Monetary",
-            },
-            inplace=True,
+    @classmethod
+    def read_cleaned_data(
+        cls,
+        path: str,
+        start_date=None,
+        end_date=None,
+        countries=None,
+        columns=None,
+    ) -> pd.DataFrame:
+        """
+        Read a cleaned Parquet dataset written with file_format='parquet_dataset'.
+
+        Filters are pushed down to the Parquet scan: the date range prunes
+        YearMonth partitions and InvoiceDate row groups, countries prune
+        Country partitions (or row groups), and only the requested columns
+        are read.
+
+        Args:
+            path (str): Dataset directory (e.g. data/processed/cleaned_uk_data)
+            start_date (datetime or str, optional): Keep InvoiceDate >= start_date
+            end_date (datetime or str, optional): Keep InvoiceDate < end_date
+            countries (list, optional): Keep only these countries
+            columns (list, optional): Columns to read (default: all, in the
+                order they were saved)
+
+        Returns:
+            pd.DataFrame: Selected rows and columns
+        """
+        partition_by_country = os.path.isdir(path) and any(
+            name.startswith("Country=")
+            for sub in os.listdir(path)
+            if os.path.isdir(os.path.join(path, sub))
+            for name in os.listdir(os.path.join(path, sub))
+        )
+        dataset = ds.dataset(
+            path, format="parquet", partitioning=cls._partitioning(partition_by_country)
         )
 
-        self.rfm_data = rfm.reset_index()
-        return self.rfm_data
+        conditions = []
+        if start_date is not None:
+            start_date = pd.Timestamp(start_date)
+            conditions.append(ds.field("YearMonth") >= start_date.strftime("%Y-%m"))
+            conditions.append(ds.field("InvoiceDate") >= start_date)
+        if end_date is not None:
+            end_date = pd.Timestamp(end_date)
+            conditions.append(ds.field("YearMonth") <= end_date.strftime("%Y-%m"))
+            conditions.append(ds.field("InvoiceDate") < end_date)
+        if countries is not None:
+            conditions.append(ds.field("Country").isin(list(countries)))
+
+        row_filter = None
+        for condition in conditions:
+            row_filter = condition if row_filter is None else row_filter & condition
+
+        if columns is None:
+            saved = (dataset.schema.metadata or {}).get(cls.COLUMNS_METADATA_KEY)
+            if saved is not None:
+                columns = json.loads(saved)
+            else:
+                # Dataset ghi trước khi có metadata: thứ tự theo schema của file
+                columns = [name for name in dataset.schema.names if name != "YearMonth"]
+
+        table = dataset.to_table(columns=list(columns), filter=row_filter)
+        return table.to_pandas()
+
+class IncrementalRFM:
+    """
+    Per-customer RFM state that can be updated batch by batch.
+
+    The state keeps, for every customer, the last purchase date, the number
+    of distinct invoices and the monetary sum. New transaction batches are
+    folded in without touching earlier rows, and Recency is derived for any
+    snapshot date from the state alone (O(customers)).
+
+    Batches are expected in date order, so an invoice split across two
+    batches is always on the customer's last purchase date. Only the
+    invoices on that date are remembered for de-duplication, which keeps
+    the state O(customers).
+    """
 
-    def save_cleaned_data(self, output_dir="../data/processed"):
+    def __init__(
+        self,
+        customer_col: str = "CustomerID",
+        invoice_col: str = "InvoiceNo",
+        date_col: str = "InvoiceDate",
+    ):
         """
-        Save cleaned data to specified directory.
+        Initialize an empty RFM state.
 
         Args:
-            output_dir (str): Output directory path
+            customer_col (str): Column name for customer id
+            invoice_col (str): Column name for invoice number
+            date_col (str): Column name for invoice date
         """
-        if self.df_uk is None:
-            raise ValueError("Cleaned UK data not available. Call clean_data() first.")
+        self.customer_col = customer_col
+        self.invoice_col = invoice_col
+        self.date_col = date_col
+        self.state = None          # index: customer, cột: LastPurchase, Frequency, Monetary
+        self.max_date = None
+        self._boundary = None  # hoá đơn (customer, invoice, date) ở ngày mua cuối của mỗi khách
+
+    def update(self, df: pd.DataFrame):
+        """
+        Fold a batch of cleaned transaction rows into the state.
+
+        An invoice already counted for a customer on their last purchase
+        date (an invoice split across two batches) is not counted again.
+
+        Args:
+            df (pd.DataFrame): Transaction rows with customer, invoice, date
+                and Quantity/UnitPrice (or TotalPrice) columns
 
+        Returns:
+            IncrementalRFM: self
+        """
+        if df.empty:
+            return self
+
+        if "TotalPrice" in df.columns:
+            total_price = df["TotalPrice"]
+        else:
+            total_price = DataCleaner._total_price(df)
+
+        customers = df[self.customer_col].astype(object)
+        batch = pd.DataFrame({
+            "LastPurchase": df[self.date_col].groupby(customers).max(),
+            "Monetary": total_price.groupby(customers).sum(),
+        })
+
+        # Frequency: bỏ các hoá đơn đã đếm ở ngày mua cuối của batch trước
+        pairs = pd.DataFrame({
+            "customer": customers,
+            "invoice": df[self.invoice_col].astype(object),
+            "date": df[self.date_col],
+        }).drop_duplicates(["customer", "invoice"])
+        if self._boundary is None:
+            is_new = np.ones(len(pairs), dtype=bool)
+        else:
+            keys = pd.MultiIndex.from_frame(pairs[["customer", "invoice"]])
+            seen = pd.MultiIndex.from_frame(self._boundary[["customer", "invoice"]])
+            is_new = ~keys.isin(seen)
+        batch["Frequency"] = (
+            pairs.loc[is_new, "customer"].value_counts()
+            .reindex(batch.index, fill_value=0)
+            .astype(np.int64)
+        )
+
+        if self.state is None:
+            self.state = batch[["LastPurchase", "Frequency", "Monetary"]]
+        else:
+            self.state = pd.concat([self.state, batch]).groupby(level=0).agg(
+                {"LastPurchase": "max", "Frequency": "sum", "Monetary": "sum"}
+            )
+        self.state.index.name = self.customer_col
+
+        # Chỉ giữ các hoá đơn ở ngày mua cuối (mới) của mỗi khách
+        boundary = pairs if self._boundary is None else pd.concat([self._boundary, pairs])
+        last = self.state["LastPurchase"].reindex(boundary["customer"]).to_numpy()
+        self._boundary = (
+            boundary[boundary["date"].to_numpy() == last]
+            .drop_duplicates(["customer", "invoice"])
+            .reset_index(drop=True)
+        )
+
+        batch_max = df[self.date_col].max()
+        self.max_date = batch_max if self.max_date is None else max(self.max_date, batch_max)
+        return self
+
+    def compute(self, snapshot_date=None) -> pd.DataFrame:
+        """
+        Derive the RFM table from the current state.
+
+        Args:
+            snapshot_date (datetime or str, optional):
+                Reference date for Recency calculation.
+                - If None: use max(InvoiceDate) + 1 day.
+
+        Returns:
+            pd.DataFrame: RFM dataframe with columns [CustomerID, Recency, Frequency, Monetary]
+        """
+        if self.state is None:
+            raise ValueError("RFM state is empty. Call update() first.")
+
+        # Xác định snapshot_date
+        if snapshot_date is None:
+            snapshot_date = self.max_date + pd.Timedelta(days=1)
+        elif isinstance(snapshot_date, str):
+            # Cho phép truyền vào dạng string 'YYYY-MM-DD'
+            snapshot_date = pd.to_datetime(snapshot_date)
+
+        rfm = pd.DataFrame({
+            "Recency": (snapshot_date - self.state["LastPurchase"]).dt.days,
+            "Frequency": self.state["Frequency"],
+            "Monetary": self.state["Monetary"],
+        })
+        return rfm.reset_index()
+
+    def save(self, output_dir: str):
+        """
+        Persist the RFM state to a directory (Parquet files + metadata).
+
+        Args:
+            output_dir (str): Output directory path
+        """
         os.makedirs(output_dir, exist_ok=True)
-        output_path = f"{output_dir}/cleaned_uk_data.csv"
-        self.df_uk.to_csv(output_path, index=False)
-        print(f"Đã lưu dữ liệu đã làm sạch: {output_path}")
+        self.state.reset_index().to_parquet(f"{output_dir}/rfm_state.parquet", index=False)
+        # Giữ nguyên kiểu của customer/invoice để so khớp đúng sau load()
+        self._boundary.to_parquet(f"{output_dir}/rfm_invoices.parquet", index=False)
+        with open(f"{output_dir}/rfm_meta.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "customer_col": self.customer_col,
+                    "invoice_col": self.invoice_col,
+                    "date_col": self.date_col,
+                    "max_date": str(self.max_date),
+                },
+                f,
+                indent=2,
+            )
+        print(f"Đã lưu trạng thái RFM: {output_dir}")
+
+    @classmethod
+    def load(cls, input_dir: str) -> "IncrementalRFM":
+        """
+        Load an RFM state saved with save().
+
+        Args:
+            input_dir (str): Directory written by save()
+
+        Returns:
+            IncrementalRFM: Restored state
+        """
+        with open(f"{input_dir}/rfm_meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        rfm = cls(meta["customer_col"], meta["invoice_col"], meta["date_col"])
+        rfm.state = pd.read_parquet(f"{input_dir}/rfm_state.parquet").set_index(
+            meta["customer_col"]
+        )
+        boundary = pd.read_parquet(f"{input_dir}/rfm_invoices.parquet")
+        boundary["customer"] = boundary["customer"].astype(object)
+        boundary["invoice"] = boundary["invoice"].astype(object)
+        rfm._boundary = boundary
+        rfm.max_date = pd.Timestamp(meta["max_date"])
+        return rfm
 
 
 # =========================================================
@@ -214,6 +834,7 @@ class BasketPreparer:
         invoice_col: str = "InvoiceNo",
         item_col: str = "Description",
         quantity_col: str = "Quantity",
+        sparse: bool = False,
     ):
         """
         Initialize the BasketPreparer with cleaned dataframe.
@@ -223,13 +844,24 @@ class BasketPreparer:
             invoice_col (str): Column name for invoice number
             item_col (str): Column name for item description
             quantity_col (str): Column name for item quantity
+            sparse (bool): Build the basket as a scipy CSR matrix wrapped in a
+                pandas sparse DataFrame instead of a dense one
         """
         self.df = df
         self.invoice_col = invoice_col
         self.item_col = item_col
         self.quantity_col = quantity_col
+        self.sparse = sparse
         self.basket = None
         self.basket_bool = None
+        self.pruned_items = None
+        self.pruning_info = None
+
+        # Dạng sparse: ma trận CSR (invoice x item) và từ điển item/invoice
+        self.basket_matrix = None
+        self.basket_bool_matrix = None
+        self.items = None
+        self.invoices = None
 
     def create_basket(self):
         """
@@ -242,12 +874,15 @@ class BasketPreparer:
         if self.item_col not in self.df.columns:
             raise ValueError(f"Column '{self.item_col}' not found in dataframe")
         
+        if self.sparse:
+            return self._create_sparse_basket()
+
         # Loại bỏ các giá trị Description trống
         df_clean = self.df[self.df[self.item_col].notna()].copy()
         
         # Tạo basket
         basket = (
-            df_clean.groupby([self.invoice_col, self.item_col])[self.quantity_col]
+            df_clean.groupby([self.invoice_col, self.item_col], observed=True)[self.quantity_col]
             .sum()
             .unstack()
             .fillna(0)
@@ -256,18 +891,61 @@ class BasketPreparer:
         self.basket = basket
         return self.basket
 
-    def encode_basket(self, threshold: int = 1):
+    def _create_sparse_basket(self):
+        """
+        Build the invoice x item quantity matrix directly in CSR form.
+
+        Invoice and item keys are factorized (sorted, as groupby would) and
+        duplicate (invoice, item) pairs are summed by scipy, so the dense
+        matrix is never materialized.
+
+        Returns:
+            pd.DataFrame: Sparse basket dataframe (float quantities, fill 0)
+        """
+        df_clean = self.df[self.df[self.item_col].notna()]
+
+        invoice_codes, invoices = pd.factorize(df_clean[self.invoice_col], sort=True)
+        item_codes, items = pd.factorize(df_clean[self.item_col], sort=True)
+
+        matrix = sp.csr_matrix(
+            (
+                df_clean[self.quantity_col].to_numpy(dtype=np.float64),
+                (invoice_codes, item_codes),
+            ),
+            shape=(len(invoices), len(items)),
+        )
+        matrix.sum_duplicates()
+
+        self.basket_matrix = matrix
+        self.invoices = pd.Index(np.asarray(invoices), name=self.invoice_col)
+        self.items = pd.Index(np.asarray(items), name=self.item_col)
+        self.basket = pd.DataFrame.sparse.from_spmatrix(
+            matrix, index=self.invoices, columns=self.items
+        )
+        return self.basket
+
+    def encode_basket(self, threshold: int = 1, min_support: float = None, top_k: int = None):
         """
         Encode the basket dataframe into boolean format.
 
         Args:
             threshold (int): Minimum quantity to consider an item as present
+            min_support (float, optional): Keep only items whose own support
+                reaches min_support (they are the only ones that can appear in
+                a frequent itemset at that threshold)
+            top_k (int, optional): Keep only the top_k most frequent items
 
         Returns:
             pd.DataFrame: Boolean encoded basket dataframe
         """
+        if min_support is not None or top_k is not None:
+            return self._encode_pruned_basket(threshold, min_support, top_k)
+
         if self.basket is None:
             self.create_basket()  # TỰ ĐỘNG TẠO BASKET NẾU CHƯA TỒN TẠI
+
+        if self.basket_matrix is not None:
+            return self._encode_sparse_basket(threshold)
             
         # Sửa lỗi FutureWarning: dùng map thay cho applymap
         basket_bool = self.basket.map(lambda x: 1 if x >= threshold else 0)
@@ -275,6 +953,115 @@ class BasketPreparer:
         self.basket_bool = basket_bool
         return self.basket_bool
 
+    def _encode_sparse_basket(self, threshold: int):
+        """
+        Encode the sparse basket without densifying it.
+
+        Args:
+            threshold (int): Minimum quantity to consider an item as present
+
+        Returns:
+            pd.DataFrame: Sparse boolean basket dataframe (Sparse[bool, False])
+        """
+        if threshold <= 0:
+            # Ô trống (0) sẽ thành True -> không còn thưa
+            raise ValueError("Sparse basket requires threshold > 0.")
+
+        matrix = self.basket_matrix.copy()
+        matrix.data = matrix.data >= threshold
+        matrix.eliminate_zeros()
+
+        self.basket_bool_matrix = matrix.astype(bool)
+        self.basket_bool = _sparse_bool_frame(
+            self.basket_bool_matrix, index=self.invoices, columns=self.items
+        )
+        return self.basket_bool
+
+    def _encode_pruned_basket(self, threshold: int, min_support: float, top_k: int):
+        """
+        Encode only the items that can be frequent, without building the full basket.
+
+        Item frequencies are counted in one pass over the (invoice, item)
+        quantity sums; the encoded matrix is then built for the surviving
+        items only. Every invoice keeps its row, so supports are still
+        relative to all invoices. Dropped items are stored in
+        self.pruned_items and the highest dropped support in
+        basket_bool.attrs['max_pruned_support'].
+
+        Returns:
+            pd.DataFrame: Boolean encoded basket restricted to surviving items
+        """
+        df_clean = self.df[self.df[self.item_col].notna()]
+        pair_qty = df_clean.groupby(
+            [self.invoice_col, self.item_col], observed=True
+        )[self.quantity_col].sum()
+
+        invoice_codes, invoices = pd.factorize(
+            pair_qty.index.get_level_values(0), sort=True
+        )
+        item_codes, items = pd.factorize(pair_qty.index.get_level_values(1), sort=True)
+        n_invoices = len(invoices)
+
+        # Đếm số hoá đơn chứa mỗi item (1 lượt)
+        present = pair_qty.to_numpy() >= threshold
+        item_counts = np.bincount(item_codes[present], minlength=len(items))
+
+        keep = np.ones(len(items), dtype=bool)
+        if min_support is not None:
+            keep &= item_counts / n_invoices >= min_support
+        if top_k is not None:
+            order = np.lexsort((np.arange(len(items)), -item_counts))
+            in_top = np.zeros(len(items), dtype=bool)
+            in_top[order[:top_k]] = True
+            keep &= in_top
+
+        new_codes = np.full(len(items), -1, dtype=np.int64)
+        new_codes[keep] = np.arange(int(keep.sum()))
+        selected = present & keep[item_codes]
+
+        matrix = sp.csr_matrix(
+            (
+                np.ones(int(selected.sum()), dtype=bool),
+                (invoice_codes[selected], new_codes[item_codes[selected]]),
+            ),
+            shape=(n_invoices, int(keep.sum())),
+        )
+
+        self.invoices = pd.Index(np.asarray(invoices), name=self.invoice_col)
+        self.items = pd.Index(np.asarray(items)[keep], name=self.item_col)
+        self.pruned_items = pd.Series(
+            item_counts[~keep], index=pd.Index(np.asarray(items)[~keep], name=self.item_col),
+            name="count",
+        ).sort_values(ascending=False)
+        max_pruned_support = (
+            float(self.pruned_items.iloc[0] / n_invoices) if len(self.pruned_items) else None
+        )
+        self.pruning_info = {
+            "threshold": threshold,
+            "min_support": min_support,
+            "top_k": top_k,
+            "n_items_before": len(items),
+            "n_items_after": int(keep.sum()),
+            "max_pruned_support": max_pruned_support,
+        }
+
+        if self.sparse:
+            self.basket_bool_matrix = matrix
+            basket_bool = _sparse_bool_frame(
+                matrix, index=self.invoices, columns=self.items
+            )
+        else:
+            basket_bool = pd.DataFrame(
+                matrix.toarray(), index=self.invoices, columns=self.items
+            )
+        basket_bool.attrs["max_pruned_support"] = max_pruned_support
+
+        print(f"Giữ {keep.sum():,}/{len(items):,} sản phẩm "
+              f"(bỏ {len(self.pruned_items):,} sản phẩm, support lớn nhất bị bỏ: "
+              f"{max_pruned_support or 0:.5f})")
+        self.basket_bool = basket_bool
+        return self.basket_bool
+
     def save_basket_bool(self, output_path: str):
         """
         Save the boolean encoded basket dataframe to a Parquet file.
@@ -286,16 +1073,510 @@ class BasketPreparer:
             self.encode_basket()  # Tự động encode nếu chưa có
         
         basket_bool_to_save = self.basket_bool.reset_index()
+        if self.basket_bool_matrix is not None:
+            # Parquet không hỗ trợ cột sparse: lưu dạng bool thường (1 byte/ô)
+            basket_bool_to_save = basket_bool_to_save.astype(
+                {col: bool for col in self.basket_bool.columns}
+            )
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         basket_bool_to_save.to_parquet(output_path, index=False)
         print(f"Đã lưu basket boolean: {output_path}")
 
+    def save_basket_compact(self, output_dir: str):
+        """
+        Save the boolean basket in the compact CSR format (see CompactBasket).
 
-# =========================================================
-# 3. APRIORI ASSOCIATION RULES MINER
-# =========================================================
+        Args:
+            output_dir (str): Output directory
+        """
+        if self.basket_bool is None:
+            self.encode_basket()  # Tự động encode nếu chưa có
 
-class AssociationRulesMiner:
+        if self.basket_bool_matrix is not None:
+            compact = CompactBasket.from_matrix(self.basket_bool_matrix, self.items, self.invoices)
+        else:
+            compact = CompactBasket.from_basket(self.basket_bool)
+        compact.save(output_dir)
+        return compact
+
+    def append_basket_compact(self, output_dir: str, threshold: int = 1) -> dict:
+        """
+        Append the transactions of self.df to a basket saved with save_basket_compact().
+
+        self.df should hold only the new transaction rows (e.g. one night of
+        invoices); see CompactBasket.append() for details.
+
+        Args:
+            output_dir (str): Directory of the stored compact basket
+            threshold (int): Minimum quantity to consider an item as present
+
+        Returns:
+            dict: Append summary
+        """
+        return CompactBasket.append(
+            output_dir,
+            self.df,
+            invoice_col=self.invoice_col,
+            item_col=self.item_col,
+            quantity_col=self.quantity_col,
+            threshold=threshold,
+        )
+
+
+class CompactBasket:
+    """
+    Compact transaction-list (CSR) basket with an item dictionary.
+
+    Each transaction is stored as a slice of sorted int32 item ids
+    (indices[indptr[t]:indptr[t + 1]]). On disk the arrays are raw binary
+    files described by meta.json, so load() memory-maps them with zero
+    copy and several miner processes can share one basket through the OS
+    page cache instead of each holding a private DataFrame.
+    """
+
+    FORMAT = "csr-basket"
+    VERSION = 1
+
+    def __init__(self, indptr, indices, items, invoices, item_counts=None):
+        """
+        Initialize from CSR arrays.
+
+        Args:
+            indptr (np.ndarray): Row pointers, length n_transactions + 1
+            indices (np.ndarray): int32 item ids of every transaction
+            items (list-like): Item dictionary (id -> item name)
+            invoices (list-like): Invoice index (row -> invoice label)
+            item_counts (np.ndarray, optional): Cached transactions per item
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.items = pd.Index(items)
+        self.invoices = pd.Index(invoices)
+        self._item_counts = item_counts
+
+    @property
+    def n_transactions(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def n_items(self) -> int:
+        return len(self.items)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.indices)
+
+    @property
+    def item_counts(self) -> np.ndarray:
+        """Number of transactions containing each item."""
+        if self._item_counts is None:
+            self._item_counts = np.bincount(self.indices, minlength=self.n_items).astype(np.int64)
+        return self._item_counts
+
+    # ---------- build ----------
+
+    @classmethod
+    def from_matrix(cls, matrix, items, invoices) -> "CompactBasket":
+        """
+        Build from a (transactions x items) scipy sparse matrix.
+
+        Args:
+            matrix: scipy sparse matrix, nonzero = item present
+            items (list-like): Item names (one per column)
+            invoices (list-like): Invoice labels (one per row)
+
+        Returns:
+            CompactBasket
+        """
+        csr = sp.csr_matrix(matrix, dtype=bool)
+        csr.eliminate_zeros()
+        csr.sort_indices()
+        indptr_dtype = np.int32 if csr.nnz < np.iinfo(np.int32).max else np.int64
+        return cls(
+            csr.indptr.astype(indptr_dtype),
+            csr.indices.astype(np.int32),
+            items,
+            invoices,
+        )
+
+    @classmethod
+    def from_basket(cls, basket_bool: pd.DataFrame) -> "CompactBasket":
+        """
+        Build from a boolean basket dataframe (dense or sparse).
+
+        Args:
+            basket_bool (pd.DataFrame): Boolean encoded basket (invoice x item)
+
+        Returns:
+            CompactBasket
+        """
+        is_sparse = len(basket_bool.columns) > 0 and all(
+            isinstance(dtype, pd.SparseDtype) for dtype in basket_bool.dtypes
+        )
+        if is_sparse:
+            matrix = basket_bool.sparse.to_coo()
+        else:
+            matrix = sp.csr_matrix(basket_bool.to_numpy(dtype=bool))
+        return cls.from_matrix(matrix, basket_bool.columns, basket_bool.index)
+
+    # ---------- convert ----------
+
+    def to_csr(self) -> sp.csr_matrix:
+        """CSR matrix view over the stored arrays (no copy of indptr/indices)."""
+        data = np.ones(self.nnz, dtype=bool)
+        return sp.csr_matrix(
+            (data, self.indices, self.indptr),
+            shape=(self.n_transactions, self.n_items),
+            copy=False,
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """Sparse boolean DataFrame accepted by the mlxtend-based miners."""
+        return _sparse_bool_frame(
+            self.to_csr(), index=self.invoices, columns=self.items
+        )
+
+    def to_bitset(self) -> "BitsetBasket":
+        """Vertical bitset representation (see BitsetBasket)."""
+        return BitsetBasket.from_matrix(self.to_csr(), self.items, self.invoices)
+
+    # ---------- save / load ----------
+
+    @staticmethod
+    def _write_lines(path: str, values, mode: str = "w"):
+        """Write one JSON value per line."""
+        with open(path, mode, encoding="utf-8") as f:
+            for value in values:
+                f.write(json.dumps(value, ensure_ascii=False, default=str) + "\n")
+
+    @staticmethod
+    def _read_lines(path: str, limit: int = None) -> list:
+        """Read a file written by _write_lines() (only the first limit lines if given)."""
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in itertools.islice(f, limit)]
+
+    @staticmethod
+    def _read_array(path: str, dtype, length: int, mmap: bool) -> np.ndarray:
+        """Read a raw binary array, memory-mapped when requested."""
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        if mmap:
+            return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
+        return np.fromfile(path, dtype=dtype, count=length)
+
+    def _meta(self) -> dict:
+        invoice_keys = [str(invoice) for invoice in self.invoices]
+        return {
+            "format": self.FORMAT,
+            "version": self.VERSION,
+            "n_transactions": self.n_transactions,
+            "n_items": self.n_items,
+            "nnz": self.nnz,
+            "indptr_dtype": np.dtype(self.indptr.dtype).name,
+            "indices_dtype": np.dtype(self.indices.dtype).name,
+            "indptr_file": "indptr.bin",
+            "item_counts_file": "item_counts.bin",
+            "invoice_ranges": [
+                {"start": 0, "stop": self.n_transactions, "offset": 0,
+                 "min": min(invoice_keys), "max": max(invoice_keys)}
+            ] if invoice_keys else [],
+        }
+
+    @staticmethod
+    def _write_meta(output_dir: str, meta: dict):
+        """Write meta.json atomically: it is the commit point of save() and append()."""
+        tmp_path = f"{output_dir}/meta.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, f"{output_dir}/meta.json")
+
+    @classmethod
+    def _read_meta(cls, input_dir: str) -> dict:
+        """Read meta.json and check the format."""
+        with open(f"{input_dir}/meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != cls.FORMAT:
+            raise ValueError(f"Không phải basket dạng CSR: {input_dir}")
+        return meta
+
+    def save(self, output_dir: str):
+        """
+        Save the basket as raw binary arrays plus item/invoice dictionaries.
+
+        Files: meta.json, indptr.bin, indices.bin, item_counts.bin,
+        items.jsonl and invoices.jsonl.
+
+        Args:
+            output_dir (str): Output directory
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        np.ascontiguousarray(self.indptr).tofile(f"{output_dir}/indptr.bin")
+        np.ascontiguousarray(self.indices).tofile(f"{output_dir}/indices.bin")
+        self.item_counts.tofile(f"{output_dir}/item_counts.bin")
+        self._write_lines(f"{output_dir}/items.jsonl", self.items)
+        self._write_lines(f"{output_dir}/invoices.jsonl", self.invoices)
+        meta = self._meta()
+        meta.update(
+            items_bytes=os.path.getsize(f"{output_dir}/items.jsonl"),
+            invoices_bytes=os.path.getsize(f"{output_dir}/invoices.jsonl"),
+        )
+        self._write_meta(output_dir, meta)
+        print(f"Đã lưu basket dạng CSR: {output_dir} "
+              f"({self.n_transactions:,} hoá đơn, {self.n_items:,} sản phẩm)")
+
+    @classmethod
+    def _committed_sizes(cls, input_dir: str, meta: dict) -> dict:
+        """
+        Byte size of every append-only file as of the last committed meta.json.
+
+        Baskets saved before these fields existed take the current file
+        sizes (and get their invoice range from one full read).
+        """
+        if "invoices_bytes" not in meta:
+            meta["items_bytes"] = os.path.getsize(f"{input_dir}/items.jsonl")
+            meta["invoices_bytes"] = os.path.getsize(f"{input_dir}/invoices.jsonl")
+        if "invoice_ranges" not in meta:
+            keys = [str(inv) for inv in cls._read_lines(f"{input_dir}/invoices.jsonl")]
+            meta["invoice_ranges"] = [
+                {"start": 0, "stop": len(keys), "offset": 0, "min": min(keys), "max": max(keys)}
+            ] if keys else []
+        indptr_file = meta.get("indptr_file", "indptr.bin")
+        return {
+            indptr_file: (meta["n_transactions"] + 1) * np.dtype(meta["indptr_dtype"]).itemsize,
+            "indices.bin": meta["nnz"] * np.dtype(meta["indices_dtype"]).itemsize,
+            "items.jsonl": meta["items_bytes"],
+            "invoices.jsonl": meta["invoices_bytes"],
+        }
+
+    @staticmethod
+    def _truncate(path: str, size: int):
+        """Cut a file back to size bytes (drop a partial append)."""
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    @classmethod
+    def _stored_duplicates(cls, input_dir: str, meta: dict, invoices) -> list:
+        """
+        Invoices of the delta that are already stored.
+
+        Each append records the min/max invoice of its rows; only ranges
+        that may contain a delta invoice are read back, so appending
+        invoices newer than the history reads nothing.
+        """
+        keys = np.sort(np.array([str(inv) for inv in invoices], dtype=object))
+        if len(keys) == 0:
+            return []
+        stored = set()
+        with open(f"{input_dir}/invoices.jsonl", "rb") as f:
+            for rng in meta["invoice_ranges"]:
+                lo = np.searchsorted(keys, rng["min"], side="left")
+                hi = np.searchsorted(keys, rng["max"], side="right")
+                if lo >= hi:
+                    continue
+                f.seek(rng["offset"])
+                for line in itertools.islice(f, rng["stop"] - rng["start"]):
+                    stored.add(str(json.loads(line)))
+        return [inv for inv in invoices if str(inv) in stored]
+
+    @classmethod
+    def append(
+        cls,
+        input_dir: str,
+        df_new: pd.DataFrame,
+        invoice_col: str = "InvoiceNo",
+        item_col: str = "Description",
+        quantity_col: str = "Quantity",
+        threshold: int = 1,
+    ) -> dict:
+        """
+        Append new invoices to a stored basket without rebuilding it.
+
+        Only the new rows are grouped and encoded. Unseen products extend
+        the item dictionary, the new transactions are appended to
+        indices.bin / indptr.bin / invoices.jsonl, and the item counts are
+        updated with the counts of the delta. Invoices already stored are
+        rejected (they would be counted twice); only the stored invoice
+        ranges that overlap the delta are read for that check.
+
+        meta.json is replaced last and atomically. Bytes appended after the
+        last committed meta.json (a failed or interrupted append) are cut
+        off before anything is written, so a retry starts from a clean state.
+
+        Args:
+            input_dir (str): Directory written by save()
+            df_new (pd.DataFrame): New transaction rows
+            invoice_col (str): Column name for invoice number
+            item_col (str): Column name for item description
+            quantity_col (str): Column name for item quantity
+            threshold (int): Minimum quantity to consider an item as present
+
+        Returns:
+            dict: Summary (new invoices, new items, appended entries)
+        """
+        meta = cls._read_meta(input_dir)
+        sizes = cls._committed_sizes(input_dir, meta)
+        for name, size in sizes.items():
+            cls._truncate(f"{input_dir}/{name}", size)
+
+        df_new = df_new[df_new[item_col].notna()]
+        pair_qty = (
+            df_new.groupby([invoice_col, item_col], observed=True)[quantity_col]
+            .sum()
+            .reset_index()
+        )
+        invoice_codes, new_invoices = pd.factorize(pair_qty[invoice_col].astype(object), sort=True)
+
+        duplicated = cls._stored_duplicates(input_dir, meta, new_invoices)
+        if duplicated:
+            raise ValueError(f"Hoá đơn đã có trong basket: {duplicated[:5]}")
+
+        # Mở rộng từ điển item cho các sản phẩm mới
+        items = cls._read_lines(f"{input_dir}/items.jsonl", meta["n_items"])
+        item_ids = {item: i for i, item in enumerate(items)}
+        present = (pair_qty[quantity_col] >= threshold).to_numpy()
+        new_items = sorted(
+            set(pair_qty.loc[present, item_col].astype(object)) - item_ids.keys(), key=str
+        )
+        for item in new_items:
+            item_ids[item] = len(item_ids)
+
+        # CSR của phần dữ liệu mới
+        delta = sp.csr_matrix(
+            (
+                np.ones(int(present.sum()), dtype=bool),
+                (
+                    invoice_codes[present],
+                    pair_qty.loc[present, item_col].astype(object).map(item_ids).to_numpy(),
+                ),
+            ),
+            shape=(len(new_invoices), len(item_ids)),
+        )
+        delta.sort_indices()
+
+        n_items = len(item_ids)
+        nnz = meta["nnz"] + delta.nnz
+        indptr_tail = delta.indptr[1:].astype(np.int64) + meta["nnz"]
+        indptr_file = meta.get("indptr_file", "indptr.bin")
+        old_counts_file = meta.get("item_counts_file", "item_counts.bin")
+        generation = meta.get("generation", 0) + 1
+        counts_file = f"item_counts-{generation}.bin"
+        invoice_keys = [str(inv) for inv in new_invoices]
+
+        try:
+            if meta["indptr_dtype"] == "int32" and nnz >= np.iinfo(np.int32).max:
+                # Vượt giới hạn int32: ghi indptr int64 ra file mới (hiếm khi xảy ra)
+                old_indptr = np.fromfile(
+                    f"{input_dir}/{indptr_file}", dtype=np.int32, count=meta["n_transactions"] + 1
+                ).astype(np.int64)
+                indptr_file = "indptr64.bin"
+                np.concatenate([old_indptr, indptr_tail]).tofile(f"{input_dir}/{indptr_file}")
+                meta["indptr_dtype"] = "int64"
+            else:
+                with open(f"{input_dir}/{indptr_file}", "ab") as f:
+                    indptr_tail.astype(meta["indptr_dtype"]).tofile(f)
+
+            with open(f"{input_dir}/indices.bin", "ab") as f:
+                delta.indices.astype(meta["indices_dtype"]).tofile(f)
+
+            # Count mới ghi ra file mới; meta.json chỉ trỏ sang khi đã commit
+            item_counts = np.zeros(n_items, dtype=np.int64)
+            item_counts[: meta["n_items"]] = np.fromfile(
+                f"{input_dir}/{old_counts_file}", dtype=np.int64, count=meta["n_items"]
+            )
+            item_counts += np.bincount(delta.indices, minlength=n_items)
+            item_counts.tofile(f"{input_dir}/{counts_file}")
+
+            cls._write_lines(f"{input_dir}/items.jsonl", new_items, mode="a")
+            cls._write_lines(f"{input_dir}/invoices.jsonl", new_invoices, mode="a")
+
+            new_meta = dict(meta)
+            new_meta.update(
+                n_transactions=meta["n_transactions"] + len(new_invoices),
+                n_items=n_items,
+                nnz=nnz,
+                generation=generation,
+                indptr_file=indptr_file,
+                item_counts_file=counts_file,
+                items_bytes=os.path.getsize(f"{input_dir}/items.jsonl"),
+                invoices_bytes=os.path.getsize(f"{input_dir}/invoices.jsonl"),
+            )
+            if invoice_keys:
+                new_meta["invoice_ranges"] = meta["invoice_ranges"] + [{
+                    "start": meta["n_transactions"],
+                    "stop": new_meta["n_transactions"],
+                    "offset": meta["invoices_bytes"],
+                    "min": min(invoice_keys),
+                    "max": max(invoice_keys),
+                }]
+            cls._write_meta(input_dir, new_meta)
+        except BaseException:
+            # Trả các file về trạng thái của meta.json cũ
+            for name, size in sizes.items():
+                cls._truncate(f"{input_dir}/{name}", size)
+            for name in {counts_file, indptr_file} - {old_counts_file, meta.get("indptr_file", "indptr.bin")}:
+                if os.path.exists(f"{input_dir}/{name}"):
+                    os.remove(f"{input_dir}/{name}")
+            raise
+
+        if os.path.exists(f"{input_dir}/{old_counts_file}"):
+            os.remove(f"{input_dir}/{old_counts_file}")
+        if indptr_file != meta.get("indptr_file", "indptr.bin"):
+            os.remove(f"{input_dir}/{meta.get('indptr_file', 'indptr.bin')}")
+        meta = new_meta
+
+        summary = {
+            "new_invoices": len(new_invoices),
+            "new_items": len(new_items),
+            "appended_entries": int(delta.nnz),
+            "n_transactions": meta["n_transactions"],
+            "n_items": n_items,
+        }
+        print(f"Đã thêm {len(new_invoices):,} hoá đơn, {len(new_items):,} sản phẩm mới "
+              f"vào basket: {input_dir}")
+        return summary
+
+    @classmethod
+    def load(cls, input_dir: str, mmap: bool = True) -> "CompactBasket":
+        """
+        Load a basket written by save().
+
+        Only the rows committed in meta.json are read, so bytes left by an
+        interrupted append() are ignored.
+
+        Args:
+            input_dir (str): Directory written by save()
+            mmap (bool): Memory-map indptr/indices (read-only, zero copy)
+
+        Returns:
+            CompactBasket
+        """
+        meta = cls._read_meta(input_dir)
+        indptr = cls._read_array(
+            f"{input_dir}/{meta.get('indptr_file', 'indptr.bin')}",
+            meta["indptr_dtype"], meta["n_transactions"] + 1, mmap,
+        )
+        indices = cls._read_array(
+            f"{input_dir}/indices.bin", meta["indices_dtype"], meta["nnz"], mmap
+        )
+        item_counts = cls._read_array(
+            f"{input_dir}/{meta.get('item_counts_file', 'item_counts.bin')}",
+            np.int64, meta["n_items"], mmap=False,
+        )
+        return cls(
+            indptr,
+            indices,
+            cls._read_lines(f"{input_dir}/items.jsonl", meta["n_items"]),
+            cls._read_lines(f"{input_dir}/invoices.jsonl", meta["n_transactions"]),
+            item_counts,
+        )
+
+
+# =========================================================
+# 3. APRIORI ASSOCIATION RULES MINER
+# =========================================================
+
+class AssociationRulesMiner:
     """
     A class for mining association rules using the Apriori algorithm.
 
@@ -303,38 +1584,168 @@ class AssociationRulesMiner:
     association rules based on specified metrics.
     """
 
-    def __init__(self, basket_bool: pd.DataFrame):
+    def __init__(self, basket_bool: pd.DataFrame, cache: "FrequentItemsetCache" = None):
         """
         Initialize the AssociationRulesMiner with basket data.
 
         Args:
             basket_bool (pd.DataFrame): Boolean encoded basket dataframe
+            cache (FrequentItemsetCache, optional): Reuse itemsets mined at a
+                lower or equal support for the same basket
         """
         self.basket_bool = basket_bool
+        self.cache = cache
         self.frequent_itemsets = None
+        self.itemset_mode = "all"
+        self.use_colnames = True
+        self.must_contain = frozenset()
         self.rules = None
+        self.sampling_report = None
 
     def mine_frequent_itemsets(
         self,
         min_support: float = 0.01,
         max_len: int = None,
         use_colnames: bool = True,
+        mode: str = "all",
+        must_contain=None,
+        must_not_contain=None,
     ) -> pd.DataFrame:
         """
         Mine frequent itemsets using the Apriori algorithm.
 
+        Args:
+            min_support (float): Minimum support
+            max_len (int): Maximum itemset length (not allowed with mode='closed')
+            use_colnames (bool): Return item names instead of column positions
+            mode (str): 'all' (Apriori), 'closed' (CHARM: only itemsets with no
+                superset of equal support) or 'maximal' (FP-Max: only itemsets
+                with no frequent superset). Closed/maximal pruning happens
+                during the search; generate_rules() expands them as needed.
+            must_contain (str | list): Keep only itemsets containing at least
+                one of these items; mining runs on the invoices that contain
+                them, so the rest of the basket is never searched
+            must_not_contain (str | list): Items removed before mining
+
         Returns:
             pd.DataFrame: DataFrame of frequent itemsets
         """
-        fi = apriori(
-            self.basket_bool,
-            min_support=min_support,
-            use_colnames=use_colnames,
-            max_len=max_len,
+        _check_itemset_mode(mode)
+        _check_pruned_support(self.basket_bool, min_support)
+
+        def mine(basket=self.basket_bool, support=min_support):
+            if mode == "closed":
+                return _mine_closed_itemsets(basket, support, max_len, use_colnames)
+            if mode == "maximal":
+                return _mine_maximal_itemsets(basket, support, max_len, use_colnames)
+            return apriori(
+                basket,
+                min_support=support,
+                use_colnames=use_colnames,
+                max_len=max_len,
+            )
+
+        if must_contain is not None or must_not_contain is not None:
+            # Kết quả có ràng buộc item không đưa vào cache
+            fi = _mine_with_item_constraints(
+                self.basket_bool, min_support, must_contain, must_not_contain, use_colnames, mine
+            )
+        else:
+            fi = _mine_with_cache(
+                self.cache, self.basket_bool, min_support, max_len, mode, use_colnames, mine
+            )
+
+        fi.sort_values(by="support", ascending=False, inplace=True)
+        self.frequent_itemsets = fi
+        self.itemset_mode = mode
+        self.use_colnames = use_colnames
+        self.must_contain = _item_set(must_contain)
+        if not use_colnames:
+            # Itemsets theo vị trí cột: ràng buộc cũng được đổi sang vị trí
+            self.must_contain = frozenset(
+                self.basket_bool.columns.get_indexer(list(self.must_contain)).tolist()
+            )
+        return self.frequent_itemsets
+
+    def mine_frequent_itemsets_sampled(
+        self,
+        min_support: float = 0.01,
+        sample_size=0.2,
+        max_len: int = None,
+        use_colnames: bool = True,
+        sample_support: float = None,
+        miss_probability: float = 0.01,
+        random_state: int = 0,
+    ) -> pd.DataFrame:
+        """
+        Approximate mining: mine a random sample, then verify on the full basket.
+
+        The sample is mined at a lowered support; the candidates and their
+        negative border are then counted exactly in one pass over the full
+        basket. Reported supports are exact and no infrequent itemset is
+        returned, but itemsets above a frequent border itemset may be
+        missing: they are listed in sampling_report['missed'].
+
+        Args:
+            min_support (float): Minimum support on the full basket
+            sample_size (int | float): Number of invoices in the sample, or a
+                fraction of the basket in (0, 1]
+            max_len (int): Maximum itemset length
+            use_colnames (bool): Return item names instead of column positions
+            sample_support (float): Support used on the sample (default: lowered
+                from min_support so that each frequent itemset is missed with
+                probability about miss_probability)
+            miss_probability (float): Target miss probability per itemset
+            random_state (int): Seed of the invoice sample
+
+        Returns:
+            pd.DataFrame: DataFrame of frequent itemsets
+        """
+        _check_pruned_support(self.basket_bool, min_support)
+
+        fi, report = _mine_sampled(
+            self.basket_bool, min_support, sample_size, max_len, use_colnames,
+            sample_support, miss_probability, random_state,
         )
+        if report["complete"]:
+            print(f"Mẫu {report['sample_size']:,} hoá đơn (support {report['sample_support']:.5f}): "
+                  f"{len(fi):,} itemsets, không có itemset nào bị bỏ sót")
+        else:
+            print(f"Mẫu {report['sample_size']:,} hoá đơn (support {report['sample_support']:.5f}): "
+                  f"{len(fi):,} itemsets; {len(report['missed']):,} itemset biên âm phổ biến thật "
+                  "-> tập cha của chúng có thể bị bỏ sót (xem sampling_report['missed'])")
 
         fi.sort_values(by="support", ascending=False, inplace=True)
         self.frequent_itemsets = fi
+        self.itemset_mode = "all"
+        self.use_colnames = use_colnames
+        self.must_contain = frozenset()
+        self.sampling_report = report
+        return self.frequent_itemsets
+
+    def expand_frequent_itemsets(self) -> pd.DataFrame:
+        """
+        Return all frequent itemsets with their supports.
+
+        Closed itemsets are expanded without rescanning the data; maximal
+        itemsets need one batch support count on the basket bitsets. With
+        must_contain, only itemsets containing a required item are returned.
+
+        Returns:
+            pd.DataFrame: Full frequent itemsets (support, itemsets)
+        """
+        if self.frequent_itemsets is None:
+            self.mine_frequent_itemsets()  # Tự động mine nếu chưa có
+
+        if self.itemset_mode == "closed":
+            # Tập con không chứa item bắt buộc có support tính trên basket con: bỏ
+            expanded = expand_closed_itemsets(self.frequent_itemsets)
+            return _filter_must_contain(expanded, self.must_contain)
+        if self.itemset_mode == "maximal":
+            expanded = expand_maximal_itemsets(
+                self.frequent_itemsets, self.basket_bool, use_colnames=self.use_colnames
+            )
+            return _filter_must_contain(expanded, self.must_contain)
         return self.frequent_itemsets
 
     def generate_rules(
@@ -352,19 +1763,154 @@ class AssociationRulesMiner:
         Returns:
             pd.DataFrame: DataFrame of association rules
         """
-        if self.frequent_itemsets is None:
-            self.mine_frequent_itemsets()  # Tự động mine nếu chưa có
+        # Luật cần support của mọi tập con, nên closed/maximal được khôi phục trước
+        frequent_itemsets = self.expand_frequent_itemsets()
+
+        if self.must_contain:
+            # Tập con không chứa item bắt buộc chưa được khai phá: đếm bằng bitset
+            supports = dict(zip(frequent_itemsets["itemsets"], frequent_itemsets["support"]))
+            needed = set()
+            for itemset in frequent_itemsets["itemsets"]:
+                _subsets_top_down(itemset, lambda subset: needed.add(subset) or True)
+            _add_missing_supports(supports, needed, self.basket_bool)
+            frequent_itemsets = pd.DataFrame({
+                "support": list(supports.values()),
+                "itemsets": list(supports.keys()),
+            })
 
         rules = association_rules(
-            self.frequent_itemsets,
+            frequent_itemsets,
             metric=metric,
             min_threshold=min_threshold,
         )
+        if self.must_contain:
+            union = [a | c for a, c in zip(rules["antecedents"], rules["consequents"])]
+            rules = rules[np.array([bool(u & self.must_contain) for u in union], dtype=bool)]
 
         rules = rules.sort_values(["lift", "confidence"], ascending=False)
         self.rules = rules
         return self.rules
 
+    def generate_rules_constrained(
+        self,
+        min_support: float = None,
+        min_confidence: float = None,
+        min_lift: float = None,
+        max_len_antecedents: int = None,
+        max_len_consequents: int = None,
+        must_contain=None,
+        must_not_contain=None,
+        consequent_items=None,
+        compact: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Generate only the rules that satisfy every constraint.
+
+        Equivalent to generate_rules() followed by filter_rules() with the same
+        arguments, but the constraints are pushed into rule generation, so
+        rejected rules are never materialized.
+
+        Args:
+            min_support (float): Minimum rule support
+            min_confidence (float): Minimum confidence
+            min_lift (float): Minimum lift
+            max_len_antecedents (int): Maximum number of antecedent items
+            max_len_consequents (int): Maximum number of consequent items
+            must_contain (str | list): Rules must contain at least one of these items
+            must_not_contain (str | list): Rules must not contain any of these items
+            consequent_items (str | list): Items allowed only in the consequent;
+                each itemset yields at most one rule (mine with
+                must_contain=consequent_items to prune the itemset search too)
+            compact (bool): Keep the rules as a CompactRuleTable (integer item
+                ids and typed metric arrays); add_readable_rule_str(),
+                filter_rules() and save_rules() accept it
+
+        Returns:
+            pd.DataFrame | CompactRuleTable: Association rules
+        """
+        rules = generate_rules_constrained(
+            self.expand_frequent_itemsets(),
+            min_support=min_support,
+            min_confidence=min_confidence,
+            min_lift=min_lift,
+            max_len_antecedents=max_len_antecedents,
+            max_len_consequents=max_len_consequents,
+            must_contain=must_contain,
+            must_not_contain=must_not_contain,
+            consequent_items=consequent_items,
+            # Itemset khai phá với must_contain thiếu support của tập con
+            basket=self.basket_bool if self.must_contain else None,
+            compact=compact,
+        )
+
+        rules = rules.sort_values(["lift", "confidence"], ascending=False)
+        self.rules = rules if compact else rules.reset_index(drop=True)
+        return self.rules
+
+    def iter_rules(self, batch_size: int = 100_000, **constraints):
+        """
+        Yield rules in fixed-size CompactRuleTable batches (bounded memory).
+
+        Args:
+            batch_size (int): Rules per batch
+            **constraints: Keyword arguments of generate_rules_constrained()
+
+        Yields:
+            CompactRuleTable: Batches sharing one item dictionary
+        """
+        return iter_rules(
+            self.expand_frequent_itemsets(),
+            batch_size=batch_size,
+            basket=self.basket_bool if self.must_contain else None,
+            **constraints,
+        )
+
+    def top_rules(self, n: int = 100, by: str = "lift", batch_size: int = 100_000,
+                  **constraints) -> "CompactRuleTable":
+        """
+        Keep only the n best rules by one metric, streaming over rule batches.
+
+        Args:
+            n (int): Number of rules to keep
+            by (str): Ranking metric ('lift', 'confidence', ...)
+            batch_size (int): Rules per batch
+            **constraints: Keyword arguments of generate_rules_constrained()
+
+        Returns:
+            CompactRuleTable: Top n rules sorted by the metric
+        """
+        self.rules = top_rules(
+            self.expand_frequent_itemsets(),
+            n=n,
+            by=by,
+            batch_size=batch_size,
+            basket=self.basket_bool if self.must_contain else None,
+            **constraints,
+        )
+        return self.rules
+
+    def stream_rules(self, output_path: str, batch_size: int = None, **constraints) -> int:
+        """
+        Write every rule to a Parquet file batch by batch (never all in memory).
+
+        Args:
+            output_path (str): .parquet path (read back with read_rules())
+            batch_size (int): Rules per batch / row group (default: RULES_PER_GROUP)
+            **constraints: Keyword arguments of generate_rules_constrained()
+
+        Returns:
+            int: Number of rules written
+        """
+        n_rules = write_rules_stream(
+            self.expand_frequent_itemsets(),
+            output_path,
+            batch_size=batch_size or RULES_PER_GROUP,
+            basket=self.basket_bool if self.must_contain else None,
+            **constraints,
+        )
+        print(f"Đã lưu {n_rules:,} luật vào: {output_path}")
+        return n_rules
+
     @staticmethod
     def _frozenset_to_str(fs: frozenset) -> str:
         return ", ".join(sorted(list(fs)))
@@ -379,6 +1925,8 @@ class AssociationRulesMiner:
         """
         if self.rules is None:
             self.generate_rules()  # Tự động generate rules nếu chưa có
+        if isinstance(self.rules, CompactRuleTable):
+            return self.rules  # Chuỗi được tạo khi cần (rule_strings(), to_frame())
 
         rules = self.rules.copy()
         rules["antecedents_str"] = rules["antecedents"].apply(self._frozenset_to_str)
@@ -401,6 +1949,14 @@ class AssociationRulesMiner:
         """
         if self.rules is None:
             self.generate_rules()  # Tự động generate rules nếu chưa có
+        if isinstance(self.rules, CompactRuleTable):
+            return self.rules.filter(
+                min_support=min_support,
+                min_confidence=min_confidence,
+                min_lift=min_lift,
+                max_len_antecedents=max_len_antecedents,
+                max_len_consequents=max_len_consequents,
+            )
 
         filtered = self.rules.copy()
 
@@ -424,17 +1980,29 @@ class AssociationRulesMiner:
 
     def save_rules(self, output_path: str, rules_df: pd.DataFrame = None):
         """
-        Save rules dataframe to CSV.
+        Save rules to Parquet or CSV (chosen by the file extension).
+
+        A .parquet path stores antecedents/consequents as list<string>
+        columns with typed metric columns (read back with read_rules());
+        any other path writes CSV as before.
 
         Args:
-            output_path (str): CSV path
-            rules_df (pd.DataFrame): Rules dataframe to save (if None, use self.rules)
+            output_path (str): .parquet or CSV path
+            rules_df (pd.DataFrame | CompactRuleTable): Rules to save (if None, use self.rules)
         """
         if rules_df is None:
             if self.rules is None:
                 self.generate_rules()  # Tự động generate rules nếu chưa có
             rules_df = self.rules
 
+        if output_path.endswith(".parquet"):
+            write_rules_parquet(rules_df, output_path)
+            print(f"Đã lưu luật vào: {output_path}")
+            return
+
+        if isinstance(rules_df, CompactRuleTable):
+            rules_df = rules_df.to_frame(readable=True)
+
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         rules_df.to_csv(output_path, index=False)
         print(f"Đã lưu luật vào: {output_path}")
@@ -519,12 +2087,12 @@ class DataVisualizer:
         # Top sản phẩm theo số lượng
         plt.figure(figsize=(12, 5))
         top_products = (
-            df.groupby("Description")["Quantity"]
+            df.groupby("Description", observed=True)["Quantity"]
             .sum()
             .sort_values(ascending=False)
             .head(top_n)
         )
-        sns.barplot(x=top_products.values, y=top_products.index)
+        sns.barplot(x=top_products.values, y=top_products.index.astype(str))
         plt.title(f"Top {top_n} sản phẩm theo số lượng bán")
         plt.xlabel("Số lượng bán")
         plt.tight_layout()
@@ -533,12 +2101,12 @@ class DataVisualizer:
         # Top sản phẩm theo doanh thu
         plt.figure(figsize=(12, 5))
         top_revenue_products = (
-            df.groupby("Description")["TotalPrice"]
+            df.groupby("Description", observed=True)["TotalPrice"]
             .sum()
             .sort_values(ascending=False)
             .head(top_n)
         )
-        sns.barplot(x=top_revenue_products.values, y=top_revenue_products.index)
+        sns.barplot(x=top_revenue_products.values, y=top_revenue_products.index.astype(str))
         plt.title(f"Top {top_n} sản phẩm theo doanh thu")
         plt.xlabel("Doanh thu (GBP)")
         plt.tight_layout()
@@ -553,7 +2121,7 @@ class DataVisualizer:
         """
         # Số giao dịch trên mỗi khách hàng
         plt.figure(figsize=(10, 5))
-        transactions_per_customer = df.groupby("CustomerID")["InvoiceNo"].nunique()
+        transactions_per_customer = df.groupby("CustomerID", observed=True)["InvoiceNo"].nunique()
         sns.histplot(transactions_per_customer, bins=30, kde=True)
         plt.title("Phân phối số giao dịch trên mỗi khách hàng")
         plt.xlabel("Số giao dịch")
@@ -563,7 +2131,7 @@ class DataVisualizer:
 
         # Chi tiêu trên mỗi khách hàng
         plt.figure(figsize=(10, 5))
-        spend_per_customer = df.groupby("CustomerID")["TotalPrice"].sum()
+        spend_per_customer = df.groupby("CustomerID", observed=True)["TotalPrice"].sum()
         spend_filter = spend_per_customer < spend_per_customer.quantile(0.99)
         sns.histplot(spend_per_customer[spend_filter], bins=30, kde=True)
         plt.title("Phân phối tổng chi tiêu trên mỗi khách hàng")
@@ -615,6 +2183,20 @@ class DataVisualizer:
             return ", ".join(sorted(map(str, itemset)))
         return str(itemset)
 
+    @staticmethod
+    def _rules_for_plot(rules_df, sort_by: str = None, top_n: int = None):
+        """
+        DataFrame (có rule_str) của các luật sẽ vẽ.
+
+        CompactRuleTable chỉ tạo chuỗi cho top_n luật theo sort_by; DataFrame
+        được trả về nguyên vẹn.
+        """
+        if not isinstance(rules_df, CompactRuleTable):
+            return rules_df
+        if sort_by in rules_df.metrics and top_n is not None:
+            rules_df = rules_df.top(top_n, sort_by)
+        return rules_df.to_frame(readable=True)
+
     def plot_top_frequent_itemsets(
         self,
         frequent_itemsets: pd.DataFrame,
@@ -697,11 +2279,13 @@ class DataVisualizer:
         Vẽ biểu đồ cột thể hiện top_n luật kết hợp theo một metric (lift/confidence/support).
 
         Args:
-            rules_df: DataFrame kết quả từ association_rules() và đã có cột 'rule_str'.
+            rules_df: DataFrame kết quả từ association_rules() và đã có cột 'rule_str'
+                (hoặc CompactRuleTable).
             top_n: số luật hiển thị.
             sort_by: cột dùng để sắp xếp ('lift', 'confidence', 'support', ...).
             title: tiêu đề chung của biểu đồ.
         """
+        rules_df = self._rules_for_plot(rules_df, sort_by, top_n)
         if "rule_str" not in rules_df.columns:
             raise ValueError("rules_df cần có cột 'rule_str' (gọi add_readable_rule_str() trước).")
         if sort_by not in rules_df.columns:
@@ -822,6 +2406,8 @@ class DataVisualizer:
         required_cols = {"antecedents", "consequents", metric}
         if not required_cols.issubset(set(rules_df.columns)):
             raise ValueError(f"rules_df cần có các cột: {required_cols}")
+        if isinstance(rules_df, CompactRuleTable):
+            rules_df = rules_df.filter(max_len_antecedents=1, max_len_consequents=1).to_frame()
 
         # Chỉ giữ các luật 1 sản phẩm → 1 sản phẩm
         single_rules = rules_df[
@@ -893,6 +2479,7 @@ class DataVisualizer:
         if rules_df is None or rules_df.empty:
             print("Không có luật nào sau khi lọc để vẽ scatter Plotly.")
             return
+        rules_df = self._rules_for_plot(rules_df)
 
         # Đảm bảo có rule_str (nếu chưa thì gợi ý)
         if "rule_str" not in rules_df.columns:
@@ -937,6 +2524,8 @@ class DataVisualizer:
         required_cols = {"antecedents", "consequents", "lift"}
         if not required_cols.issubset(rules_df.columns):
             raise ValueError(f"rules_df cần có các cột: {required_cols}")
+        # Lọc theo lift rồi lấy top theo lift cũng chính là lấy top theo lift rồi lọc
+        rules_df = self._rules_for_plot(rules_df, "lift", max_rules)
 
         # Lọc theo lift nếu có
         df = rules_df.copy()
@@ -1010,28 +2599,64 @@ class FPGrowthMiner:
     Lớp thực hiện thuật toán FP-Growth.
     FP-Growth nhanh hơn Apriori vì không phải sinh tập ứng viên.
     """
-    def __init__(self, basket_df):
+    def __init__(self, basket_df, cache=None):
+        """
+        Args:
+            basket_df (pd.DataFrame): Basket boolean
+            cache (FrequentItemsetCache): Cache itemsets dùng lại giữa các ngưỡng support
+        """
         self.basket_df = basket_df
+        self.cache = cache
         
-    def run(self, min_support=0.01, use_colnames=True):
+    def run(self, min_support=0.01, use_colnames=True, max_len=None, mode="all",
+            must_contain=None, must_not_contain=None):
         """
         Thực hiện khai phá frequent itemsets bằng FP-Growth.
         
         Args:
             min_support (float): Ngưỡng support tối thiểu
             use_colnames (bool): Có sử dụng tên cột không
+            max_len (int): Độ dài tối đa của itemset (None = không giới hạn)
+            mode (str): 'all', 'closed' (chỉ itemset không có superset cùng
+                support, tìm bằng CHARM) hoặc 'maximal' (chỉ itemset không có
+                superset phổ biến, tìm bằng FP-Max). Dùng
+                expand_closed_itemsets() / expand_maximal_itemsets() để lấy
+                lại support của mọi itemset khi sinh luật (truyền cùng
+                use_colnames cho expand_maximal_itemsets()).
+            must_contain (str | list): Chỉ giữ itemset chứa ít nhất một item
+                trong danh sách; chỉ các hoá đơn chứa chúng được khai phá
+            must_not_contain (str | list): Các item bị loại trước khi khai phá
             
         Returns:
             pd.DataFrame: Frequent itemsets
         """
-        # Sử dụng fpgrowth từ mlxtend
-        frequent_itemsets = fpgrowth(
-            self.basket_df, 
-            min_support=min_support, 
-            use_colnames=use_colnames
+        _check_itemset_mode(mode)
+        _check_pruned_support(self.basket_df, min_support)
+
+        def mine(basket=self.basket_df, support=min_support):
+            if mode == "closed":
+                return _mine_closed_itemsets(basket, support, max_len, use_colnames)
+            if mode == "maximal":
+                return _mine_maximal_itemsets(basket, support, max_len, use_colnames)
+
+            # Sử dụng fpgrowth từ mlxtend
+            frequent_itemsets = fpgrowth(
+                basket, 
+                min_support=support, 
+                use_colnames=use_colnames,
+                max_len=max_len,
+            )
+            frequent_itemsets.sort_values('support', ascending=False, inplace=True)
+            return frequent_itemsets
+
+        if must_contain is not None or must_not_contain is not None:
+            # Kết quả có ràng buộc item không đưa vào cache
+            return _mine_with_item_constraints(
+                self.basket_df, min_support, must_contain, must_not_contain, use_colnames, mine
+            )
+        return _mine_with_cache(
+            self.cache, self.basket_df, min_support, max_len, mode, use_colnames, mine
         )
-        frequent_itemsets.sort_values('support', ascending=False, inplace=True)
-        return frequent_itemsets
 
 
 # =========================================================
@@ -1048,12 +2673,12 @@ class WeightedAssociationMiner:
         Tính toán các metrics có trọng số cho luật kết hợp.
         
         Args:
-            rules_df (pd.DataFrame): Dataframe chứa luật kết hợp
-            basket_df (pd.DataFrame): Basket boolean
+            rules_df (pd.DataFrame | CompactRuleTable): Luật kết hợp
+            basket_df (pd.DataFrame | BitsetBasket): Basket boolean (index = InvoiceNo)
             df_raw (pd.DataFrame): Dữ liệu gốc
             
         Returns:
-            pd.DataFrame: Rules với các cột weighted metrics
+            pd.DataFrame | CompactRuleTable: Rules với các cột weighted metrics
         """
         # 1. Tính doanh thu cho mỗi hóa đơn (Trọng số)
         df_raw['TotalValue'] = df_raw['Quantity'] * df_raw['UnitPrice']
@@ -1061,43 +2686,3696 @@ class WeightedAssociationMiner:
         total_market_revenue = invoice_weights.sum()
         
         # 2. Vector trọng số khớp với danh sách hóa đơn
-        # Reset index để đảm bảo mapping đúng
-        basket_df_reset = basket_df.reset_index()
-        weights_vector = basket_df_reset['InvoiceNo'].map(invoice_weights).fillna(0).values
-        
-        # 3. Tính Weighted Support cho từng luật bằng Numpy
-        def calculate_ws(itemset):
-            cols = list(itemset)
-            mask = basket_df_reset[cols].all(axis=1).values
-            if mask.any():
-                return np.sum(weights_vector[mask]) / total_market_revenue
-            else:
-                return 0.0
-
-        # Tính toán thêm cột weighted_support
-        # rules_df['weighted_support'] = rules_df['antecedents'].union(rules_df['consequents']).apply(calculate_ws)
-        # Hợp nhất antecedents và consequents cho từng dòng trước khi tính toán
-        rules_df['weighted_support'] = rules_df.apply(
-            lambda row: calculate_ws(row['antecedents'].union(row['consequents'])), 
-            axis=1
-)
-        
+        # Basket dạng bitset (mỗi item một bitset) dùng chung cho mọi luật
+        bitset = BitsetBasket.from_basket(basket_df)
+        weights_vector = (
+            pd.Series(np.asarray(bitset.index)).map(invoice_weights).fillna(0).values
+        )
+
+        # 3. Tính Weighted Support cho từng luật: AND bitset rồi cộng trọng số
+        if isinstance(rules_df, CompactRuleTable):
+            # Luật dạng id: đổi id của bảng luật sang vị trí bitset, không tạo chuỗi
+            rows = bitset.items.get_indexer(rules_df.items)
+            used = np.union1d(rules_df.ant_indices, rules_df.cons_indices)
+            if (rows[used] < 0).any():
+                missing = [rules_df.items[i] for i in used[rows[used] < 0]]
+                raise KeyError(f"Item không có trong basket: {missing}")
+            antecedents = [tuple(sorted(rows[a])) for a in rules_df.iter_antecedent_ids()]
+            itemsets = [
+                tuple(sorted(a + tuple(rows[c])))
+                for a, c in zip(antecedents, rules_df.iter_consequent_ids())
+            ]
+            unique_sets = list(set(antecedents) | set(itemsets))
+            sums = dict(zip(unique_sets, bitset.batch_weighted_sums_ids(unique_sets, weights_vector)))
+        else:
+            antecedents = [frozenset(a) for a in rules_df['antecedents']]
+            itemsets = [a | frozenset(c) for a, c in zip(antecedents, rules_df['consequents'])]
+            unique_sets = list(set(antecedents) | set(itemsets))
+            sums = dict(zip(unique_sets, bitset.batch_weighted_sums(unique_sets, weights_vector)))
+
+        itemset_sums = np.array([sums[i] for i in itemsets], dtype=np.float64)
+        antecedent_sums = np.array([sums[a] for a in antecedents], dtype=np.float64)
+
+        rules_df['weighted_support'] = itemset_sums / total_market_revenue
+
         # 4. Tính Weighted Confidence
-        def calculate_wc(row):
-            antecedent_support = np.sum(weights_vector[basket_df_reset[list(row['antecedents'])].all(axis=1).values])
-            if antecedent_support > 0:
-                itemset_support = np.sum(weights_vector[basket_df_reset[list(row['antecedents'].union(row['consequents']))].all(axis=1).values])
-                return itemset_support / antecedent_support
-            else:
-                return 0.0
-                
-        rules_df['weighted_confidence'] = rules_df.apply(calculate_wc, axis=1)
-        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rules_df['weighted_confidence'] = np.where(
+                antecedent_sums > 0, itemset_sums / antecedent_sums, 0.0
+            )
+
         # 5. Tính Weighted Lift
         # Tránh chia cho 0
-        rules_df['weighted_lift'] = rules_df.apply(
-            lambda row: row['weighted_confidence'] / row['weighted_support'] if row['weighted_support'] > 0 else 0,
-            axis=1
-        )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rules_df['weighted_lift'] = np.where(
+                rules_df['weighted_support'] > 0,
+                rules_df['weighted_confidence'] / rules_df['weighted_support'],
+                0,
+            )
         
-        return rules_df
\ No newline at end of file
+        return rules_df
+
+
+# =========================================================
+# 7. MULTI-COUNTRY PIPELINE
+# =========================================================
+
+# Metric của generate_rules() tương ứng với ràng buộc của generate_rules_constrained()
+_METRIC_CONSTRAINTS = {"support": "min_support", "confidence": "min_confidence", "lift": "min_lift"}
+
+
+def _run_country_pipeline(country: str, df_country: pd.DataFrame, output_dir: str, params: dict) -> dict:
+    """
+    Build baskets and mine rules for one country (runs inside a worker process).
+
+    Args:
+        country (str): Country name
+        df_country (pd.DataFrame): Cleaned transactions of this country
+        output_dir (str): Results directory of this country
+        params (dict): Mining parameters from MultiCountryPipeline
+
+    Returns:
+        dict: Summary row for this country
+    """
+    start = time.time()
+    summary = {
+        "Country": country,
+        "n_transactions": len(df_country),
+        "n_invoices": int(df_country["InvoiceNo"].nunique()),
+        "n_items": int(df_country["Description"].nunique()),
+        "n_itemsets": 0,
+        "n_rules": 0,
+        "status": "ok",
+        "output_dir": output_dir,
+    }
+
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        df_country.to_csv(f"{output_dir}/cleaned_data.csv", index=False)
+
+        basket_maker = BasketPreparer(df_country)
+        basket_maker.encode_basket(threshold=params["threshold"])
+        basket_maker.save_basket_bool(f"{output_dir}/basket_bool.parquet")
+
+        miner = AssociationRulesMiner(basket_maker.basket_bool)
+        frequent_itemsets = miner.mine_frequent_itemsets(
+            min_support=params["min_support"], max_len=params["max_len"]
+        )
+        summary["n_itemsets"] = len(frequent_itemsets)
+
+        constraint = _METRIC_CONSTRAINTS.get(params["metric"])
+        if len(frequent_itemsets) > 0 and constraint is not None:
+            # Ngưỡng metric và bộ lọc được áp dụng ngay khi sinh luật
+            constraints = dict(params["filter"])
+            constraints[constraint] = max(constraints.get(constraint) or 0, params["min_threshold"])
+            miner.generate_rules_constrained(**constraints)
+            rules = miner.add_readable_rule_str()
+        elif len(frequent_itemsets) > 0:
+            miner.generate_rules(metric=params["metric"], min_threshold=params["min_threshold"])
+            miner.add_readable_rule_str()
+            rules = miner.filter_rules(**params["filter"])
+        else:
+            rules = pd.DataFrame(columns=list(RULE_COLUMNS))
+
+        summary["n_rules"] = len(rules)
+        miner.save_rules(f"{output_dir}/rules.parquet", rules_df=rules)
+    except Exception as e:
+        summary["status"] = f"error: {e}"
+
+    summary["seconds"] = time.time() - start
+    return summary
+
+
+class MultiCountryPipeline:
+    """
+    Run the cleaning → basket → Apriori pipeline for many countries at once.
+
+    The raw file is read and cleaned once, partitioned by Country, and each
+    partition is processed in a process pool. Every country gets its own
+    results directory and a combined summary is written at the top level.
+    """
+
+    def __init__(
+        self,
+        data_path: str,
+        output_dir: str = "experiments/countries",
+        countries: list = None,
+        min_support: float = 0.02,
+        max_len: int = 3,
+        metric: str = "lift",
+        min_threshold: float = 1.0,
+        threshold: int = 1,
+        filter_params: dict = None,
+        min_invoices: int = 50,
+        max_workers: int = None,
+    ):
+        """
+        Initialize the pipeline.
+
+        Args:
+            data_path (str): Path to the raw data file
+            output_dir (str): Root directory for per-country results
+            countries (list, optional): Countries to process (default: all)
+            min_support (float): Apriori min_support
+            max_len (int): Maximum itemset length
+            metric (str): Metric used by generate_rules()
+            min_threshold (float): Threshold for metric
+            threshold (int): Quantity threshold for encode_basket()
+            filter_params (dict, optional): Keyword arguments for filter_rules()
+            min_invoices (int): Countries with fewer invoices are skipped
+            max_workers (int, optional): Process pool size (default: CPU count)
+        """
+        self.data_path = data_path
+        self.output_dir = output_dir
+        self.countries = countries
+        self.params = dict(
+            min_support=min_support,
+            max_len=max_len,
+            metric=metric,
+            min_threshold=min_threshold,
+            threshold=threshold,
+            filter=filter_params or {},
+        )
+        self.min_invoices = min_invoices
+        self.max_workers = max_workers
+        self.partitions = None
+        self.summary = None
+
+    @staticmethod
+    def _country_dirname(country: str) -> str:
+        """Directory-safe name for a country."""
+        return re.sub(r"[^0-9A-Za-z]+", "_", str(country)).strip("_")
+
+    def partition(self) -> dict:
+        """
+        Read and clean the raw data once, then split it by Country.
+
+        Returns:
+            dict: {country: cleaned dataframe}
+        """
+        cleaner = DataCleaner(self.data_path, country=None)
+        cleaner.load_data()
+        df_all = cleaner.clean_data()
+
+        if self.countries is not None:
+            df_all = df_all[df_all["Country"].isin(self.countries)]
+
+        self.partitions = {
+            country: df_country
+            for country, df_country in df_all.groupby("Country", observed=True, sort=True)
+        }
+        print(f"Số country: {len(self.partitions)}")
+        return self.partitions
+
+    def run(self) -> pd.DataFrame:
+        """
+        Process every country partition in a process pool.
+
+        Returns:
+            pd.DataFrame: Combined summary (one row per country)
+        """
+        if self.partitions is None:
+            self.partition()
+
+        rows = []
+        futures = {}
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            for country, df_country in self.partitions.items():
+                country_dir = os.path.join(self.output_dir, self._country_dirname(country))
+                n_invoices = df_country["InvoiceNo"].nunique()
+                if n_invoices < self.min_invoices:
+                    rows.append({
+                        "Country": country,
+                        "n_transactions": len(df_country),
+                        "n_invoices": int(n_invoices),
+                        "status": "skipped",
+                    })
+                    continue
+
+                future = executor.submit(
+                    _run_country_pipeline, country, df_country, country_dir, self.params
+                )
+                futures[future] = country
+
+            for future in as_completed(futures):
+                row = future.result()
+                print(f"   • {row['Country']}: {row['n_rules']:,} luật ({row['status']})")
+                rows.append(row)
+
+        self.summary = pd.DataFrame(rows).sort_values("Country").reset_index(drop=True)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.summary.to_csv(f"{self.output_dir}/summary.csv", index=False)
+        with open(f"{self.output_dir}/summary.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {"parameters": self.params, "countries": self.summary.to_dict("records")},
+                f,
+                indent=2,
+                default=str,
+            )
+        print(f"Đã lưu tổng hợp: {self.output_dir}/summary.csv")
+        return self.summary
+
+
+# =========================================================
+# 8. BITSET BASKET (VERTICAL REPRESENTATION)
+# =========================================================
+
+# Số bit 1 của mỗi giá trị 16 bit (0..65535), dùng khi numpy chưa có bitwise_count
+_POPCOUNT_TABLE = np.unpackbits(
+    np.arange(1 << 16, dtype=np.uint16).view(np.uint8).reshape(-1, 2), axis=1
+).sum(axis=1).astype(np.uint8)
+
+
+def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+    """
+    Count set bits along the last axis of a uint64 bitset array.
+
+    Args:
+        bits (np.ndarray): uint64 array of shape (..., n_words)
+
+    Returns:
+        np.ndarray: int64 array of shape (...)
+    """
+    bits = np.ascontiguousarray(bits)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+    counts = _POPCOUNT_TABLE[bits.view(np.uint16)]
+    return counts.reshape(bits.shape[:-1] + (bits.shape[-1] * 4,)).sum(axis=-1, dtype=np.int64)
+
+
+class BitsetBasket:
+    """
+    Vertical basket representation: one packed uint64 bitset per item.
+
+    Bit t of item i is set when transaction t contains item i. Support of
+    an itemset is the popcount of the AND of its item bitsets, so support
+    counting, batch support and weighted sums never rescan the basket.
+    Miners and metric calculators can share one instance.
+    """
+
+    # Giới hạn bộ nhớ tạm (bytes) cho mỗi lô khi tính batch
+    BATCH_BYTES = 64 * 1024 ** 2
+
+    def __init__(self, bits: np.ndarray, items, n_transactions: int, index=None):
+        """
+        Initialize from packed bitsets.
+
+        Args:
+            bits (np.ndarray): uint64 array of shape (n_items, n_words)
+            items (list-like): Item names (one per bitset row)
+            n_transactions (int): Number of transactions
+            index (list-like, optional): Transaction labels (e.g. InvoiceNo)
+        """
+        self.bits = bits
+        self.items = pd.Index(items)
+        self.n_transactions = int(n_transactions)
+        self.index = index
+        self.n_words = bits.shape[1]
+        self._item_counts = None
+
+        # Bitset "tất cả giao dịch" (dùng cho itemset rỗng)
+        full = np.zeros(self.n_words * 64, dtype=bool)
+        full[: self.n_transactions] = True
+        self._full = self._pack_rows(full[np.newaxis, :])[0]
+
+    @staticmethod
+    def _pack_rows(bool_rows: np.ndarray) -> np.ndarray:
+        """Pack a (rows, n_bits) boolean array into (rows, n_words) uint64 bitsets."""
+        packed = np.packbits(bool_rows, axis=1, bitorder="little")
+        pad = (-packed.shape[1]) % 8
+        if pad:
+            packed = np.pad(packed, ((0, 0), (0, pad)))
+        return np.ascontiguousarray(packed).view(np.uint64)
+
+    @classmethod
+    def from_matrix(cls, matrix, items, index=None) -> "BitsetBasket":
+        """
+        Build bitsets from a (transactions x items) scipy sparse matrix.
+
+        Args:
+            matrix: scipy sparse matrix, nonzero = item present
+            items (list-like): Item names (one per column)
+            index (list-like, optional): Transaction labels
+
+        Returns:
+            BitsetBasket: Vertical representation
+        """
+        coo = sp.coo_matrix(matrix)
+        present = coo.data != 0
+        rows = coo.row[present].astype(np.int64)
+        cols = coo.col[present].astype(np.int64)
+
+        n_transactions, n_items = coo.shape
+        n_words = max(1, (n_transactions + 63) // 64)
+        bits = np.zeros((n_items, n_words), dtype=np.uint64)
+        np.bitwise_or.at(
+            bits,
+            (cols, rows >> 6),
+            np.left_shift(np.uint64(1), (rows & 63).astype(np.uint64)),
+        )
+        return cls(bits, items, n_transactions, index)
+
+    @classmethod
+    def from_basket(cls, basket_bool: pd.DataFrame) -> "BitsetBasket":
+        """
+        Build bitsets from a boolean basket dataframe (dense or sparse).
+
+        Args:
+            basket_bool (pd.DataFrame): Boolean encoded basket (invoice x item)
+
+        Returns:
+            BitsetBasket: Vertical representation
+        """
+        if isinstance(basket_bool, BitsetBasket):
+            return basket_bool
+
+        is_sparse = len(basket_bool.columns) > 0 and all(
+            isinstance(dtype, pd.SparseDtype) for dtype in basket_bool.dtypes
+        )
+        if is_sparse:
+            return cls.from_matrix(
+                basket_bool.sparse.to_coo(), basket_bool.columns, basket_bool.index
+            )
+
+        values = basket_bool.to_numpy(dtype=bool)
+        bits = cls._pack_rows(np.ascontiguousarray(values.T))
+        if bits.shape[1] == 0:
+            bits = np.zeros((values.shape[1], 1), dtype=np.uint64)
+        return cls(bits, basket_bool.columns, values.shape[0], basket_bool.index)
+
+    # ---------- item / itemset helpers ----------
+
+    def item_ids(self, itemset) -> np.ndarray:
+        """
+        Map item names to bitset row positions.
+
+        Args:
+            itemset (iterable): Item names
+
+        Returns:
+            np.ndarray: int64 positions (KeyError if an item is unknown)
+        """
+        itemset = list(itemset)
+        ids = self.items.get_indexer(itemset)
+        if (ids < 0).any():
+            missing = [item for item, i in zip(itemset, ids) if i < 0]
+            raise KeyError(f"Item không có trong basket: {missing}")
+        return ids.astype(np.int64)
+
+    def itemset_bits(self, itemset) -> np.ndarray:
+        """Return the bitset (AND of item bitsets) of an itemset."""
+        ids = self.item_ids(itemset)
+        if len(ids) == 0:
+            return self._full.copy()
+        return np.bitwise_and.reduce(self.bits[ids], axis=0)
+
+    def bits_to_mask(self, bits: np.ndarray) -> np.ndarray:
+        """Unpack bitsets (..., n_words) into boolean masks (..., n_transactions)."""
+        bits = np.ascontiguousarray(bits)
+        unpacked = np.unpackbits(
+            bits.view(np.uint8).reshape(bits.shape[:-1] + (-1,)), axis=-1, bitorder="little"
+        )
+        return unpacked[..., : self.n_transactions].astype(bool)
+
+    # ---------- support ----------
+
+    @property
+    def item_counts(self) -> np.ndarray:
+        """Number of transactions containing each item."""
+        if self._item_counts is None:
+            self._item_counts = _popcount_rows(self.bits)
+        return self._item_counts
+
+    def to_csr(self, ids=None) -> sp.csr_matrix:
+        """
+        Horizontal (transactions x items) CSR matrix of selected items.
+
+        Args:
+            ids (np.ndarray, optional): Bitset row positions (default: all items)
+
+        Returns:
+            sp.csr_matrix: int32 0/1 matrix, columns in the order of ids
+        """
+        ids = np.arange(len(self.items)) if ids is None else np.asarray(ids, dtype=np.int64)
+        rows, cols = [], []
+        step = max(1, self.BATCH_BYTES // max(1, self.n_transactions))
+        for start in range(0, len(ids), step):
+            item_pos, trans = np.nonzero(self.bits_to_mask(self.bits[ids[start:start + step]]))
+            rows.append(trans)
+            cols.append(item_pos + start)
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        return sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(self.n_transactions, len(ids)),
+        )
+
+    def take(self, rows) -> "BitsetBasket":
+        """
+        Bitsets restricted to a subset of transactions.
+
+        Args:
+            rows (np.ndarray): Transaction positions, in the order of the result
+
+        Returns:
+            BitsetBasket: Same items, len(rows) transactions
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        bits = np.zeros((len(self.items), max(1, (len(rows) + 63) // 64)), dtype=np.uint64)
+        step = max(1, self.BATCH_BYTES // max(1, self.n_transactions))
+        for start in range(0, len(self.items), step):
+            masks = self.bits_to_mask(self.bits[start:start + step])[:, rows]
+            bits[start:start + step] = self._pack_rows(masks)
+        index = None if self.index is None else pd.Index(self.index)[rows]
+        return BitsetBasket(bits, self.items, len(rows), index)
+
+    def pair_counts(self, ids=None) -> np.ndarray:
+        """
+        Co-occurrence counts of every pair of selected items (one sparse product).
+
+        Args:
+            ids (np.ndarray, optional): Bitset row positions (default: all items)
+
+        Returns:
+            np.ndarray: (k, k) int32 matrix; the diagonal holds item counts
+        """
+        matrix = self.to_csr(ids)
+        return (matrix.T @ matrix).toarray()
+
+    def item_supports(self) -> np.ndarray:
+        """Support of every single item."""
+        return self.item_counts / self.n_transactions
+
+    def support_count(self, itemset) -> int:
+        """Number of transactions containing every item of the itemset."""
+        return int(_popcount_rows(self.itemset_bits(itemset)))
+
+    def support(self, itemset) -> float:
+        """Support (fraction of transactions) of an itemset."""
+        return self.support_count(itemset) / self.n_transactions
+
+    def _batch_bits(self, id_lists):
+        """
+        Yield (positions, bitsets) for many itemsets, grouped by length.
+
+        Itemsets of equal length k are gathered into one (m, k, n_words)
+        array and AND-reduced at once; m is bounded by BATCH_BYTES.
+        """
+        by_len = {}
+        for pos, ids in enumerate(id_lists):
+            by_len.setdefault(len(ids), []).append(pos)
+
+        for k, positions in by_len.items():
+            positions = np.asarray(positions, dtype=np.int64)
+            if k == 0:
+                yield positions, np.broadcast_to(self._full, (len(positions), self.n_words))
+                continue
+            ids = np.array([id_lists[p] for p in positions], dtype=np.int64).reshape(-1, k)
+            step = max(1, self.BATCH_BYTES // (k * self.n_words * 8))
+            for start in range(0, len(positions), step):
+                block = self.bits[ids[start:start + step]]
+                yield positions[start:start + step], np.bitwise_and.reduce(block, axis=1)
+
+    def batch_support_counts(self, itemsets) -> np.ndarray:
+        """
+        Support counts of many itemsets at once.
+
+        Args:
+            itemsets (iterable): Itemsets (iterables of item names)
+
+        Returns:
+            np.ndarray: int64 counts, aligned with itemsets
+        """
+        id_lists = [self.item_ids(itemset) for itemset in itemsets]
+        return self.batch_support_counts_ids(id_lists)
+
+    def batch_support_counts_ids(self, id_lists) -> np.ndarray:
+        """Same as batch_support_counts() for itemsets given as bitset row positions."""
+        counts = np.zeros(len(id_lists), dtype=np.int64)
+        for positions, bits in self._batch_bits(id_lists):
+            counts[positions] = _popcount_rows(bits)
+        return counts
+
+    def batch_support(self, itemsets) -> np.ndarray:
+        """Supports of many itemsets at once (see batch_support_counts())."""
+        return self.batch_support_counts(itemsets) / self.n_transactions
+
+    # ---------- masks & weighted sums ----------
+
+    def mask(self, itemset) -> np.ndarray:
+        """Boolean mask of the transactions containing the itemset."""
+        return self.bits_to_mask(self.itemset_bits(itemset))
+
+    def weighted_sum(self, itemset, weights: np.ndarray) -> float:
+        """Sum of per-transaction weights over the transactions containing the itemset."""
+        return float(np.asarray(weights, dtype=np.float64)[self.mask(itemset)].sum())
+
+    def batch_weighted_sums(self, itemsets, weights: np.ndarray) -> np.ndarray:
+        """
+        Weighted sums of many itemsets at once.
+
+        Args:
+            itemsets (iterable): Itemsets (iterables of item names)
+            weights (np.ndarray): One weight per transaction
+
+        Returns:
+            np.ndarray: float64 sums, aligned with itemsets
+        """
+        return self.batch_weighted_sums_ids(
+            [self.item_ids(itemset) for itemset in itemsets], weights
+        )
+
+    def batch_weighted_sums_ids(self, id_lists, weights: np.ndarray) -> np.ndarray:
+        """Same as batch_weighted_sums() for itemsets given as bitset row positions."""
+        weights = np.asarray(weights, dtype=np.float64)
+        sums = np.zeros(len(id_lists), dtype=np.float64)
+        step = max(1, self.BATCH_BYTES // (8 * max(1, self.n_transactions)))
+        for positions, bits in self._batch_bits(id_lists):
+            for start in range(0, len(positions), step):
+                masks = self.bits_to_mask(bits[start:start + step])
+                sums[positions[start:start + step]] = masks @ weights
+        return sums
+
+    def item_weighted_sums(self, weights: np.ndarray) -> np.ndarray:
+        """Weighted sum of every single item (vectorized over item blocks)."""
+        weights = np.asarray(weights, dtype=np.float64)
+        sums = np.zeros(len(self.items), dtype=np.float64)
+        step = max(1, self.BATCH_BYTES // (8 * max(1, self.n_transactions)))
+        for start in range(0, len(self.items), step):
+            sums[start:start + step] = self.bits_to_mask(self.bits[start:start + step]) @ weights
+        return sums
+
+
+# =========================================================
+# 9. ECLAT MINER (VERTICAL, DIFFSETS)
+# =========================================================
+
+def _min_count(min_support: float, n_transactions: int) -> int:
+    """Smallest count c with c / n_transactions >= min_support (same test as mlxtend)."""
+    count = max(int(np.ceil(min_support * n_transactions)), 0)
+    while count > 0 and (count - 1) / n_transactions >= min_support:
+        count -= 1
+    while count / n_transactions < min_support:
+        count += 1
+    return count
+
+
+def _as_bitset(basket) -> "BitsetBasket":
+    """BitsetBasket của một basket (DataFrame, BitsetBasket hoặc CompactBasket)."""
+    if isinstance(basket, CompactBasket):
+        return basket.to_bitset()
+    return BitsetBasket.from_basket(basket)
+
+
+def _itemsets_frame(bitset, found_ids, found_counts, use_colnames) -> pd.DataFrame:
+    """Tạo DataFrame kết quả (support, itemsets) theo schema của mlxtend."""
+    items = bitset.items.tolist()
+    if use_colnames:
+        itemsets = [frozenset(items[i] for i in t) for t in found_ids]
+    else:
+        itemsets = [frozenset(t) for t in found_ids]
+
+    frequent_itemsets = pd.DataFrame({
+        "support": np.asarray(found_counts, dtype=np.float64) / bitset.n_transactions,
+        "itemsets": itemsets,
+    })
+    frequent_itemsets.sort_values("support", ascending=False, inplace=True)
+    return frequent_itemsets
+
+
+class EclatMiner:
+    """
+    Lớp khai phá frequent itemsets bằng Eclat dạng dọc (dEclat).
+
+    Mỗi item là một bitset giao dịch (BitsetBasket). Cấp 1 dùng tidset,
+    từ cấp 2 trở đi dùng diffset: d(PXY) = d(PY) \\ d(PX) và
+    sup(PXY) = sup(PX) - |d(PXY)|. Mọi phép giao/hiệu trong một lớp tiền tố
+    được vector hoá bằng numpy, nên có thể khai phá ở support rất thấp.
+    Kết quả có cùng schema với FPGrowthMiner.run() (cột support, itemsets).
+    """
+
+    def __init__(self, basket_df):
+        """
+        Args:
+            basket_df (pd.DataFrame | BitsetBasket | CompactBasket): Basket boolean
+        """
+        self.basket_df = basket_df
+        self._bitset = None
+
+    @property
+    def bitset(self) -> "BitsetBasket":
+        """Bitset dọc của basket (tạo một lần, dùng lại giữa các lần run)."""
+        if self._bitset is None:
+            self._bitset = _as_bitset(self.basket_df)
+        return self._bitset
+
+    def run(self, min_support=0.01, max_len=None, use_colnames=True):
+        """
+        Thực hiện khai phá frequent itemsets bằng dEclat.
+
+        Args:
+            min_support (float): Ngưỡng support tối thiểu
+            max_len (int): Độ dài tối đa của itemset (None = không giới hạn)
+            use_colnames (bool): Có sử dụng tên cột không
+
+        Returns:
+            pd.DataFrame: Frequent itemsets (cột support, itemsets)
+        """
+        _check_pruned_support(self.basket_df, min_support)
+
+        bitset = self.bitset
+        n = bitset.n_transactions
+        min_count = _min_count(min_support, n)
+
+        # Item phổ biến, sắp theo support tăng dần (giúp diffset nhỏ hơn)
+        counts = bitset.item_counts
+        ids = np.flatnonzero(counts >= min_count)
+        ids = ids[np.argsort(counts[ids], kind="stable")]
+
+        found_ids = [(int(i),) for i in ids]
+        found_counts = [int(counts[i]) for i in ids]
+
+        if max_len is None or max_len > 1:
+            self._extend_tidsets(
+                ids, bitset.bits[ids], counts[ids], min_count, max_len, found_ids, found_counts
+            )
+
+        return _itemsets_frame(bitset, found_ids, found_counts, use_colnames)
+
+    def _extend_tidsets(self, ids, tids, counts, min_count, max_len, found_ids, found_counts):
+        """
+        Cấp 2: từ tidset của các item sang diffset của các cặp.
+
+        Support của mọi cặp được đếm một lần bằng tích ma trận thưa, nên chỉ
+        tạo diffset cho các cặp phổ biến.
+        """
+        pairs = self.bitset.pair_counts(ids)
+        for a in range(len(ids) - 1):
+            cand = np.flatnonzero(pairs[a, a + 1:] >= min_count) + a + 1
+            if len(cand) == 0:
+                continue
+            # Chỉ giữ các word khác 0 của t(Xa): mọi diffset trong lớp đều nằm trong t(Xa)
+            words = np.flatnonzero(tids[a])
+            prefix_tids = tids[a, words]
+            diffs = prefix_tids & ~tids[np.ix_(cand, words)]  # d(XaXb) = t(Xa) \ t(Xb)
+            self._emit_class(
+                (int(ids[a]),), prefix_tids, ids[cand], diffs, pairs[a, cand].astype(np.int64),
+                min_count, max_len, found_ids, found_counts,
+            )
+
+    def _emit_class(self, prefix, prefix_tids, ids, diffs, counts, min_count, max_len,
+                    found_ids, found_counts):
+        """
+        Ghi nhận một lớp tiền tố (prefix + từng item) rồi mở rộng sâu hơn bằng diffset.
+
+        prefix_tids là t(prefix) và diffs là d(prefix + item), cả hai đã được
+        chiếu lên các word khác 0 của t(prefix).
+        """
+        for item, count in zip(ids, counts):
+            found_ids.append(prefix + (int(item),))
+            found_counts.append(int(count))
+
+        if max_len is not None and len(prefix) + 2 > max_len:
+            return
+
+        for a in range(len(ids) - 1):
+            child_diffs = diffs[a + 1:] & ~diffs[a]  # d(PXaXb) = d(PXb) \ d(PXa)
+            child_counts = counts[a] - _popcount_rows(child_diffs)
+            keep = child_counts >= min_count
+            if not keep.any():
+                continue
+
+            # t(PXa) = t(P) \ d(PXa); chiếu tiếp lên các word khác 0 của t(PXa)
+            child_tids = prefix_tids & ~diffs[a]
+            words = np.flatnonzero(child_tids)
+            self._emit_class(
+                prefix + (int(ids[a]),), child_tids[words], ids[a + 1:][keep],
+                child_diffs[np.ix_(keep, words)], child_counts[keep],
+                min_count, max_len, found_ids, found_counts,
+            )
+
+
+
+# =========================================================
+# 10. PARTITIONED MINER (SON, PROCESS POOL)
+# =========================================================
+
+def _mine_partition(part_id: int, matrix, min_support: float, max_len, algorithm: str) -> dict:
+    """
+    Khai phá itemset cục bộ của một phân vùng (chạy trong process con).
+
+    Args:
+        part_id (int): Số thứ tự phân vùng
+        matrix (sp.csr_matrix): Các giao dịch của phân vùng (giao dịch x item)
+        min_support (float): Ngưỡng support (tương đối, như ngưỡng toàn cục)
+        max_len (int): Độ dài tối đa của itemset
+        algorithm (str): 'fpgrowth', 'apriori' hoặc 'eclat'
+
+    Returns:
+        dict: Ứng viên (tuple vị trí cột) và thời gian chạy của phân vùng
+    """
+    start = time.time()
+    if algorithm == "eclat":
+        local_basket = BitsetBasket.from_matrix(matrix, range(matrix.shape[1]))
+        local = EclatMiner(local_basket).run(min_support, max_len=max_len)
+    else:
+        # Phân vùng đủ nhỏ để dùng DataFrame dày (nhanh hơn nhiều với mlxtend)
+        local_df = pd.DataFrame(matrix.toarray().astype(bool))
+        mine = fpgrowth if algorithm == "fpgrowth" else apriori
+        local = mine(local_df, min_support=min_support, use_colnames=False, max_len=max_len)
+
+    return {
+        "partition": part_id,
+        "candidates": [tuple(sorted(itemset)) for itemset in local["itemsets"]],
+        "n_transactions": matrix.shape[0],
+        "seconds": time.time() - start,
+    }
+
+
+class PartitionedMiner:
+    """
+    Lớp khai phá frequent itemsets song song theo phân vùng (thuật toán SON).
+
+    Các hoá đơn được chia thành các phân vùng liên tiếp; mỗi phân vùng được
+    khai phá cục bộ trong một process với cùng min_support tương đối. Một
+    itemset phổ biến toàn cục chắc chắn phổ biến trong ít nhất một phân vùng,
+    nên hợp các ứng viên cục bộ đủ để đếm lại support chính xác trong một lượt
+    kiểm tra toàn cục trên BitsetBasket. Kết quả giống hệt các miner tuần tự.
+    """
+
+    ALGORITHMS = ("fpgrowth", "apriori", "eclat")
+
+    def __init__(self, basket_df, n_workers=None, partition_size=None, algorithm="fpgrowth"):
+        """
+        Args:
+            basket_df (pd.DataFrame | BitsetBasket | CompactBasket): Basket boolean
+            n_workers (int): Số process (None = số CPU)
+            partition_size (int): Số hoá đơn mỗi phân vùng (None = chia đều cho n_workers)
+            algorithm (str): Miner cục bộ: 'fpgrowth', 'apriori' hoặc 'eclat'
+        """
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"algorithm phải thuộc {self.ALGORITHMS}, nhận được: {algorithm}")
+        if partition_size is not None and partition_size < 1:
+            raise ValueError("partition_size phải >= 1")
+
+        self.basket_df = basket_df
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.partition_size = partition_size
+        self.algorithm = algorithm
+        self.partition_stats = None
+        self.verify_seconds = None
+
+    def _partition_bounds(self, n_transactions: int) -> list:
+        """
+        Danh sách (start, stop) của các phân vùng liên tiếp.
+
+        Số phân vùng là ceil(n / partition_size) và các phân vùng có kích thước
+        gần bằng nhau, để không sinh ra một phân vùng cuối rất nhỏ (ngưỡng
+        cục bộ quá thấp sẽ làm bùng nổ số ứng viên).
+        """
+        if self.partition_size is None:
+            n_parts = self.n_workers
+        else:
+            n_parts = int(np.ceil(n_transactions / self.partition_size))
+        n_parts = max(1, min(n_parts, n_transactions))
+        edges = np.linspace(0, n_transactions, n_parts + 1).round().astype(int)
+        return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+    def run(self, min_support=0.01, max_len=None, use_colnames=True):
+        """
+        Khai phá song song rồi kiểm tra support toàn cục.
+
+        Args:
+            min_support (float): Ngưỡng support tối thiểu
+            max_len (int): Độ dài tối đa của itemset (None = không giới hạn)
+            use_colnames (bool): Có sử dụng tên cột không
+
+        Returns:
+            pd.DataFrame: Frequent itemsets (cột support, itemsets)
+        """
+        _check_pruned_support(self.basket_df, min_support)
+
+        bitset = _as_bitset(self.basket_df)
+        n = bitset.n_transactions
+        matrix = bitset.to_csr()
+        bounds = self._partition_bounds(n)
+
+        smallest = min((stop - start for start, stop in bounds), default=0)
+        if smallest and min_support * smallest < 2:
+            warnings.warn(
+                f"Phân vùng nhỏ nhất chỉ có {smallest} hoá đơn: với min_support={min_support} "
+                "gần như mọi itemset đều là ứng viên cục bộ. Nên tăng partition_size.",
+                stacklevel=2,
+            )
+
+        # ---------- Pha 1: ứng viên cục bộ ----------
+        results = []
+        with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = [
+                executor.submit(
+                    _mine_partition, part_id, matrix[start:stop], min_support, max_len, self.algorithm
+                )
+                for part_id, (start, stop) in enumerate(bounds)
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+
+        candidates = set()
+        for result in results:
+            candidates.update(result["candidates"])
+
+        self.partition_stats = pd.DataFrame([
+            {
+                "partition": result["partition"],
+                "start": bounds[result["partition"]][0],
+                "n_transactions": result["n_transactions"],
+                "n_candidates": len(result["candidates"]),
+                "seconds": result["seconds"],
+            }
+            for result in results
+        ]).sort_values("partition").reset_index(drop=True)
+
+        # ---------- Pha 2: đếm support toàn cục ----------
+        start = time.time()
+        candidates = sorted(candidates, key=lambda ids: (len(ids), ids))
+        counts = bitset.batch_support_counts_ids(candidates)
+        keep = counts >= _min_count(min_support, n)
+        self.verify_seconds = time.time() - start
+
+        for row in self.partition_stats.itertuples():
+            print(f"   • Phân vùng {row.partition}: {row.n_transactions:,} hoá đơn, "
+                  f"{row.n_candidates:,} ứng viên, {row.seconds:.2f}s")
+        print(f"   • Kiểm tra toàn cục: {len(candidates):,} ứng viên → "
+              f"{int(keep.sum()):,} itemset, {self.verify_seconds:.2f}s")
+
+        found = [ids for ids, ok in zip(candidates, keep) if ok]
+        return _itemsets_frame(bitset, found, counts[keep], use_colnames)
+
+
+# =========================================================
+# 11. CLOSED / MAXIMAL ITEMSETS
+# =========================================================
+
+ITEMSET_MODES = ("all", "closed", "maximal")
+
+
+def _check_itemset_mode(mode: str):
+    """Kiểm tra tham số mode của các miner."""
+    if mode not in ITEMSET_MODES:
+        raise ValueError(f"mode phải thuộc {ITEMSET_MODES}, nhận được: {mode}")
+
+
+class _ClosedItemsetSearch:
+    """
+    Tìm closed itemsets bằng CHARM trên BitsetBasket.
+
+    Duyệt cây itemset theo chiều sâu giống Eclat nhưng cắt tỉa ngay khi tìm
+    bằng bốn tính chất của CHARM:
+
+    - t(Xi) = t(Xj): gộp Xj vào Xi và bỏ nhánh Xj
+    - t(Xi) ⊂ t(Xj): gộp Xj vào bao đóng của Xi (giữ nhánh Xj)
+    - t(Xi) ⊃ t(Xj): bỏ nhánh Xj, thêm Xi ∪ Xj làm nút con
+    - còn lại: thêm Xi ∪ Xj làm nút con
+
+    Một itemset chỉ được ghi nhận khi không có closed itemset nào đã tìm thấy
+    chứa nó với cùng support (tra theo (support, dấu vân tay tidset)).
+    """
+
+    def __init__(self, bitset: "BitsetBasket", min_count: int):
+        self.bitset = bitset
+        self.min_count = min_count
+        # Hệ số ngẫu nhiên (lẻ) theo vị trí word: dấu vân tay tidset không phụ
+        # thuộc vào phép chiếu lên các word khác 0
+        rng = np.random.default_rng(0)
+        self._weights = rng.integers(1, 2 ** 63, size=bitset.n_words, dtype=np.uint64) | np.uint64(1)
+        self._closed = {}
+        self.found_ids = []
+        self.found_counts = []
+
+    def run(self):
+        """Trả về (found_ids, found_counts) của các closed itemset."""
+        counts = self.bitset.item_counts
+        ids = np.flatnonzero(counts >= self.min_count)
+        ids = ids[np.argsort(counts[ids], kind="stable")]
+        if len(ids) == 0:
+            return self.found_ids, self.found_counts
+
+        # Cấp 1 dùng tích ma trận thưa để biết support của mọi cặp
+        pairs = self.bitset.pair_counts(ids)
+        self._extend(
+            [(int(i),) for i in ids],
+            self.bitset.bits[ids],
+            counts[ids].astype(np.int64),
+            np.arange(self.bitset.n_words),
+            pairs,
+        )
+        return self.found_ids, self.found_counts
+
+    def _extend(self, itemsets, tids, counts, words, pairs=None):
+        """
+        Xử lý một lớp tiền tố.
+
+        Args:
+            itemsets (list): Itemset (tuple id) của từng nút
+            tids (np.ndarray): Tidset của từng nút, chiếu lên các word trong words
+            counts (np.ndarray): Support count của từng nút
+            words (np.ndarray): Vị trí word gốc của các cột trong tids
+            pairs (np.ndarray, optional): Support count của mọi cặp nút (cấp 1)
+        """
+        removed = np.zeros(len(itemsets), dtype=bool)
+        for i in range(len(itemsets)):
+            if removed[i]:
+                continue
+
+            rest = np.flatnonzero(~removed[i + 1:]) + i + 1
+            if pairs is not None:
+                rest_counts = pairs[i, rest].astype(np.int64)
+                inter = None
+            else:
+                inter = tids[i] & tids[rest]
+                rest_counts = _popcount_rows(inter)
+
+            frequent = rest_counts >= self.min_count
+            same_i = rest_counts == counts[i]
+            same_j = rest_counts == counts[rest]
+
+            # t(Xi) ⊆ t(Xj): Xj thuộc bao đóng của Xi (và của mọi nút con)
+            extra = set()
+            for j in rest[frequent & same_i]:
+                extra.update(itemsets[j])
+            # t(Xj) ⊆ t(Xi): nhánh Xj bị Xi ∪ Xj bao trùm
+            removed[rest[frequent & same_j]] = True
+
+            closure = tuple(sorted(set(itemsets[i]) | extra))
+            grow = frequent & ~same_i
+            if grow.any():
+                child_rows = rest[grow]
+                if inter is None:
+                    child_tids = tids[i] & tids[child_rows]
+                else:
+                    child_tids = inter[grow]
+                # Mọi tidset con nằm trong t(Xi): chiếu lên các word khác 0 của t(Xi)
+                nz = np.flatnonzero(tids[i])
+                child_itemsets = [
+                    tuple(sorted(set(closure) | set(itemsets[j]))) for j in child_rows
+                ]
+                child_counts = rest_counts[grow]
+                order = np.argsort(child_counts, kind="stable")
+                self._extend(
+                    [child_itemsets[k] for k in order],
+                    child_tids[np.ix_(order, nz)],
+                    child_counts[order],
+                    words[nz],
+                    None,
+                )
+
+            self._add_closed(closure, int(counts[i]), tids[i], words)
+
+    def _add_closed(self, itemset, count, tid_bits, words):
+        """Ghi nhận itemset nếu chưa bị một closed itemset cùng support bao trùm."""
+        fingerprint = int(np.bitwise_xor.reduce(tid_bits * self._weights[words]))
+        bucket = self._closed.setdefault((count, fingerprint), [])
+        candidate = frozenset(itemset)
+        # Cùng support và là tập con => cùng tidset, nên phép thử này là chính xác
+        if any(candidate <= other for other in bucket):
+            return
+        bucket.append(candidate)
+        self.found_ids.append(itemset)
+        self.found_counts.append(count)
+
+
+def _mine_closed_itemsets(basket, min_support, max_len=None, use_colnames=True) -> pd.DataFrame:
+    """
+    Closed frequent itemsets của basket (CHARM trên BitsetBasket).
+
+    Bao đóng của một itemset ngắn có thể dài tuỳ ý, nên cắt theo max_len khi
+    tìm sẽ làm sai support lúc khôi phục; max_len được áp dụng ở
+    expand_closed_itemsets() thay vì ở đây.
+    """
+    if max_len is not None:
+        raise ValueError(
+            "mode='closed' không hỗ trợ max_len; hãy truyền max_len cho expand_closed_itemsets()"
+        )
+    bitset = _as_bitset(basket)
+    search = _ClosedItemsetSearch(bitset, _min_count(min_support, bitset.n_transactions))
+    found_ids, found_counts = search.run()
+    return _itemsets_frame(bitset, found_ids, found_counts, use_colnames)
+
+
+def _mine_maximal_itemsets(basket_df, min_support, max_len=None, use_colnames=True) -> pd.DataFrame:
+    """Maximal frequent itemsets của basket (FP-Max của mlxtend)."""
+    frequent_itemsets = fpmax(
+        basket_df,
+        min_support=min_support,
+        use_colnames=use_colnames,
+        max_len=max_len,
+    )
+    frequent_itemsets.sort_values("support", ascending=False, inplace=True)
+    return frequent_itemsets
+
+
+def _subsets_top_down(itemset, visit):
+    """
+    Duyệt các tập con khác rỗng của itemset từ lớn tới nhỏ.
+
+    visit(subset) trả về False để không đi xuống các tập con của subset.
+    """
+    level = {frozenset(itemset)}
+    seen = set()
+    while level:
+        next_level = set()
+        for subset in level:
+            if subset in seen:
+                continue
+            seen.add(subset)
+            if visit(subset) and len(subset) > 1:
+                next_level.update(subset - {item} for item in subset)
+        level = next_level
+
+
+def expand_closed_itemsets(closed_itemsets: pd.DataFrame, max_len=None) -> pd.DataFrame:
+    """
+    Khôi phục toàn bộ frequent itemsets (kèm support) từ closed itemsets.
+
+    support(X) = max support của các closed itemset chứa X, nên không cần
+    quét lại dữ liệu. Closed itemset được duyệt theo support giảm dần; một tập
+    con đã có support thì mọi tập con của nó cũng đã có, nên được bỏ qua.
+
+    Args:
+        closed_itemsets (pd.DataFrame): Kết quả mode='closed' (cột support, itemsets)
+        max_len (int): Chỉ giữ itemset có tối đa max_len item (None = tất cả)
+
+    Returns:
+        pd.DataFrame: Frequent itemsets đầy đủ (cột support, itemsets)
+    """
+    supports = {}
+    ordered = closed_itemsets.sort_values("support", ascending=False, kind="stable")
+    for support, itemset in zip(ordered["support"], ordered["itemsets"]):
+
+        def visit(subset, support=support):
+            if len(subset) > (max_len or len(subset)):
+                return True  # quá dài: không lưu nhưng vẫn đi xuống
+            if subset in supports:
+                return False
+            supports[subset] = support
+            return True
+
+        _subsets_top_down(itemset, visit)
+
+    frequent_itemsets = pd.DataFrame({
+        "support": np.fromiter(supports.values(), dtype=np.float64, count=len(supports)),
+        "itemsets": list(supports.keys()),
+    })
+    frequent_itemsets.sort_values("support", ascending=False, inplace=True)
+    return frequent_itemsets.reset_index(drop=True)
+
+
+def expand_maximal_itemsets(
+    maximal_itemsets: pd.DataFrame, basket, max_len=None, use_colnames: bool = True
+) -> pd.DataFrame:
+    """
+    Khôi phục toàn bộ frequent itemsets từ maximal itemsets.
+
+    Mọi tập con của maximal itemset đều phổ biến nhưng support của chúng
+    không suy ra được, nên được đếm lại một lượt bằng BitsetBasket.
+
+    Args:
+        maximal_itemsets (pd.DataFrame): Kết quả mode='maximal'
+        basket (pd.DataFrame | BitsetBasket | CompactBasket): Basket đã dùng để khai phá
+        max_len (int): Chỉ giữ itemset có tối đa max_len item (None = tất cả)
+        use_colnames (bool): Itemsets theo tên item (False = vị trí cột của
+            basket, như khi khai phá với use_colnames=False)
+
+    Returns:
+        pd.DataFrame: Frequent itemsets đầy đủ (cột support, itemsets)
+    """
+    subsets = set()
+    for itemset in maximal_itemsets["itemsets"]:
+
+        def visit(subset):
+            if len(subset) > (max_len or len(subset)):
+                return True
+            if subset in subsets:
+                return False
+            subsets.add(subset)
+            return True
+
+        _subsets_top_down(itemset, visit)
+
+    bitset = _as_bitset(basket)
+    subsets = list(subsets)
+    if use_colnames:
+        counts = bitset.batch_support_counts(subsets)
+    else:
+        # Vị trí cột của basket trùng với vị trí hàng của bitset
+        counts = bitset.batch_support_counts_ids([sorted(subset) for subset in subsets])
+    frequent_itemsets = pd.DataFrame({
+        "support": counts / bitset.n_transactions,
+        "itemsets": subsets,
+    })
+    frequent_itemsets.sort_values("support", ascending=False, inplace=True)
+    return frequent_itemsets.reset_index(drop=True)
+
+
+# =========================================================
+# 12. TOP-K RULE MINER
+# =========================================================
+
+class TopKRuleMiner:
+    """
+    Lớp tìm K luật tốt nhất theo lift hoặc confidence, không cần min_support.
+
+    Không gian tìm kiếm là các antecedent X (duyệt theo chiều sâu trên cơ sở
+    dữ liệu chiếu: ma trận CSR các hoá đơn chứa X). Tại mỗi nút, một tích
+    thưa M_X^T M_X cho support của mọi X ∪ {z, y}, nên mọi luật X∪z → y của
+    các nút con được đánh giá cùng lúc.
+
+    Ngưỡng nội bộ là giá trị metric của luật thứ K trong heap và tăng dần khi
+    tìm thấy luật tốt hơn. Với X' ⊇ X, conf(X' → y) ≤ min(1, sup(X ∪ y) / min_count)
+    và lift(X' → y) ≤ conf_max * N / sup(y); các consequent không thể vượt
+    ngưỡng bị loại khỏi cả nhánh con.
+    """
+
+    METRICS = ("lift", "confidence")
+
+    def __init__(self, basket_df):
+        """
+        Args:
+            basket_df (pd.DataFrame | BitsetBasket | CompactBasket): Basket boolean
+        """
+        self.basket_df = basket_df
+        self.rules = None
+        self.min_metric = None
+        self.n_nodes = 0
+
+    def run(self, k=100, metric="lift", min_count=10, max_antecedent_len=2, min_confidence=None):
+        """
+        Tìm K luật X → y (consequent một item) tốt nhất.
+
+        Args:
+            k (int): Số luật cần lấy
+            metric (str): 'lift' hoặc 'confidence'
+            min_count (int): Số hoá đơn tối thiểu chứa cả X và y
+            max_antecedent_len (int): Độ dài tối đa của antecedent
+            min_confidence (float): Confidence tối thiểu (None = không lọc)
+
+        Returns:
+            pd.DataFrame: Luật theo schema của association_rules, sắp xếp theo metric giảm dần
+        """
+        if metric not in self.METRICS:
+            raise ValueError(f"metric phải thuộc {self.METRICS}, nhận được: {metric}")
+        if k < 1 or min_count < 1 or max_antecedent_len < 1:
+            raise ValueError("k, min_count và max_antecedent_len phải >= 1")
+
+        bitset = _as_bitset(self.basket_df)
+        self._n = bitset.n_transactions
+        self._k = k
+        self._metric = metric
+        self._min_count = min_count
+        self._max_antecedent_len = max_antecedent_len
+        self._min_confidence = min_confidence
+        self._heap = []
+        self._seq = 0
+        self.n_nodes = 0
+
+        # Cột của ma trận = item đủ min_count, sắp theo support tăng dần
+        # (item hiếm cho lift cao, giúp ngưỡng tăng nhanh)
+        counts = bitset.item_counts
+        ids = np.flatnonzero(counts >= min_count)
+        ids = ids[np.argsort(counts[ids], kind="stable")]
+        self._ids = ids
+        self._counts = counts[ids].astype(np.int64)
+
+        if len(ids) > 0:
+            self._visit((), self._n, np.arange(len(ids)), self._counts, bitset.to_csr(ids))
+
+        self.rules = self._to_frame(bitset)
+        self.min_metric = self._threshold() if len(self._heap) == k else None
+        return self.rules
+
+    def _threshold(self) -> float:
+        """Metric của luật thứ K (âm vô cùng khi heap chưa đủ K luật)."""
+        return self._heap[0][0] if len(self._heap) == self._k else -np.inf
+
+    def _bound(self, v, cols) -> np.ndarray:
+        """Cận trên metric của X' → y với mọi X' ⊇ X (v = support count của X ∪ y)."""
+        conf_max = np.minimum(1.0, v / self._min_count)
+        if self._metric == "confidence":
+            return conf_max
+        return conf_max * self._n / self._counts[cols]
+
+    def _push(self, antecedent_of, count_x, cols, count_xy):
+        """
+        Đưa các luật antecedent_of(i) → cols[i] vào heap top-K.
+
+        Các mảng count_x / count_xy thẳng hàng với cols; luật được xét theo
+        metric giảm dần nên dừng ngay khi không còn vượt ngưỡng.
+        """
+        ok = count_xy >= self._min_count
+        confidence = count_xy / count_x
+        if self._min_confidence is not None:
+            ok &= confidence >= self._min_confidence
+        values = confidence if self._metric == "confidence" else confidence * self._n / self._counts[cols]
+
+        candidates = np.flatnonzero(ok & (values > self._threshold()))
+        for p in candidates[np.argsort(-values[candidates], kind="stable")]:
+            if values[p] <= self._threshold():
+                break
+            entry = (
+                float(values[p]), int(count_xy[p]), self._seq,
+                antecedent_of(p), int(cols[p]), int(count_x[p]),
+            )
+            self._seq += 1
+            if len(self._heap) < self._k:
+                heapq.heappush(self._heap, entry)
+            else:
+                heapq.heapreplace(self._heap, entry)
+
+    def _visit(self, antecedent, count_x, cols, v, matrix):
+        """
+        Xử lý antecedent X.
+
+        Args:
+            antecedent (tuple): Vị trí cột của X (rỗng ở gốc)
+            count_x (int): Support count của X
+            cols (np.ndarray): Vị trí cột của các item còn xét (không thuộc X)
+            v (np.ndarray): Support count của X ∪ {item} cho từng cột trong cols
+            matrix (sp.csr_matrix): Hoá đơn chứa X x cols
+        """
+        self.n_nodes += 1
+        if antecedent:
+            self._push(lambda p: antecedent, np.full(len(cols), count_x), cols, v)
+        if len(antecedent) >= self._max_antecedent_len:
+            return
+
+        frequent = v >= self._min_count
+        useful = frequent & (self._bound(v, cols) > self._threshold())
+        last = antecedent[-1] if antecedent else -1
+        extend = frequent & (cols > last)
+        if not extend.any() or not useful.any():
+            return
+
+        keep = useful | extend
+        cols = cols[keep]
+        v = v[keep]
+        by_column = matrix[:, keep].tocsc()
+        leaf = len(antecedent) + 1 == self._max_antecedent_len
+
+        # gram[z, y] = support count của X ∪ {z, y}; mỗi phần tử khác 0 là một luật X∪z → y.
+        # Hàng chỉ cần các item mở rộng; ở tầng lá, cột chỉ cần các consequent còn hữu ích.
+        rows_idx = np.flatnonzero(extend[keep])
+        cols_idx = np.flatnonzero(useful[keep]) if leaf else np.arange(len(cols))
+        gram = (by_column[:, rows_idx].T @ by_column[:, cols_idx]).tocsr()
+        z = rows_idx[np.repeat(np.arange(len(rows_idx)), np.diff(gram.indptr))]
+        y = cols_idx[gram.indices]
+        entry_ok = (
+            (y != z)
+            & (gram.data >= self._min_count)
+            & (self._bound(gram.data, cols[y]) > self._threshold())
+        )
+
+        if leaf:
+            # Nút con là lá: chấm điểm mọi luật X∪z → y trong một lượt
+            self.n_nodes += len(np.unique(z[entry_ok]))
+            z, y = z[entry_ok], y[entry_ok]
+            antecedents = [antecedent + (int(c),) for c in cols]
+            self._push(
+                lambda p: antecedents[z[p]], v[z], cols[y], gram.data[entry_ok].astype(np.int64)
+            )
+            return
+
+        matrix = by_column.tocsr()
+        alive_rows = np.flatnonzero(np.bincount(z[entry_ok], minlength=len(cols)) > 0)
+        for p in alive_rows:
+            local = np.searchsorted(rows_idx, p)
+            row = np.zeros(len(cols), dtype=np.int64)
+            start, stop = gram.indptr[local], gram.indptr[local + 1]
+            row[gram.indices[start:stop]] = gram.data[start:stop]
+
+            child = np.ones(len(cols), dtype=bool)
+            child[p] = False
+            rows = by_column.indices[by_column.indptr[p]:by_column.indptr[p + 1]]
+            self._visit(
+                antecedent + (int(cols[p]),), int(v[p]), cols[child], row[child],
+                matrix[rows][:, child],
+            )
+
+    def _to_frame(self, bitset) -> pd.DataFrame:
+        """Tạo DataFrame luật theo schema của association_rules."""
+        items = bitset.items[self._ids].tolist()
+        entries = sorted(self._heap, reverse=True)
+        n = self._n
+        count_xy = np.array([e[1] for e in entries], dtype=np.float64)
+        count_x = np.array([e[5] for e in entries], dtype=np.float64)
+        count_y = self._counts[np.array([e[4] for e in entries], dtype=np.int64)].astype(np.float64)
+
+        support = count_xy / n
+        antecedent_support = count_x / n
+        consequent_support = count_y / n
+        confidence = count_xy / count_x
+        with np.errstate(divide="ignore"):
+            conviction = np.where(
+                confidence < 1, (1 - consequent_support) / (1 - confidence), np.inf
+            )
+
+        return pd.DataFrame({
+            "antecedents": [frozenset(items[i] for i in e[3]) for e in entries],
+            "consequents": [frozenset([items[e[4]]]) for e in entries],
+            "antecedent support": antecedent_support,
+            "consequent support": consequent_support,
+            "support": support,
+            "confidence": confidence,
+            "lift": confidence / consequent_support,
+            "leverage": support - antecedent_support * consequent_support,
+            "conviction": conviction,
+        })
+
+
+# =========================================================
+# 13. FREQUENT ITEMSET CACHE
+# =========================================================
+
+class FrequentItemsetCache:
+    """
+    Persistent cache of mined frequent itemsets, reused across support thresholds.
+
+    Entries are keyed by basket fingerprint, mode and max_len. Itemsets
+    frequent at a higher support are a subset of those at a lower one, so a
+    request at min_support >= a cached threshold is answered by filtering the
+    cached result; only lower thresholds need mining. For mode='all', an
+    entry also covers any shorter max_len. Maximal itemsets change with the
+    threshold and are only reused for the exact same request.
+
+    Results are stored as Parquet files next to an index.json. The cache is
+    bounded by max_entries and max_bytes, with least-recently-used eviction.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir: str = ".cache/itemsets", max_entries: int = 32,
+                 max_bytes: int = 512 * 1024 ** 2, max_memory_entries: int = 4):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir (str): Directory holding the cached results
+            max_entries (int): Maximum number of cached results on disk
+            max_bytes (int): Maximum total size of cached files on disk
+            max_memory_entries (int): Results also kept in memory (LRU)
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_memory_entries = max_memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._frames = {}
+        self._fingerprints = {}
+        self._entries = self._load_index()
+
+    # ---------- fingerprint ----------
+
+    def fingerprint(self, basket) -> str:
+        """
+        SHA-256 of the basket content (items and transaction bitsets).
+
+        Dense, sparse and compact forms of the same basket share one
+        fingerprint. The value is memoised per basket object, which is
+        therefore treated as immutable.
+        """
+        memo = self._fingerprints.get(id(basket))
+        if memo is not None and memo[0]() is basket:
+            return memo[1]
+
+        bitset = _as_bitset(basket)
+        digest = hashlib.sha256()
+        digest.update(str(bitset.n_transactions).encode("utf-8"))
+        digest.update("\n".join(map(str, bitset.items)).encode("utf-8"))
+        digest.update(np.ascontiguousarray(bitset.bits).tobytes())
+        fingerprint = digest.hexdigest()
+
+        try:
+            self._fingerprints[id(basket)] = (weakref.ref(basket), fingerprint)
+        except TypeError:
+            pass
+        return fingerprint
+
+    # ---------- index ----------
+
+    def _index_path(self) -> str:
+        return os.path.join(self.cache_dir, self.INDEX_FILE)
+
+    def _load_index(self) -> list:
+        """Read the entry list, dropping entries whose file has disappeared."""
+        if not os.path.exists(self._index_path()):
+            return []
+        with open(self._index_path(), encoding="utf-8") as f:
+            entries = json.load(f).get("entries", [])
+        return [
+            entry for entry in entries
+            if os.path.exists(os.path.join(self.cache_dir, entry["file"]))
+        ]
+
+    def _save_index(self):
+        """Write index.json atomically."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self._index_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self._entries}, f, indent=2)
+        os.replace(tmp_path, self._index_path())
+
+    @staticmethod
+    def _covers(entry: dict, min_support: float, max_len, mode: str) -> bool:
+        """Whether a cached entry can answer a request."""
+        if entry["mode"] != mode:
+            return False
+        if mode == "maximal":
+            return entry["min_support"] == min_support and entry["max_len"] == max_len
+        if entry["min_support"] > min_support:
+            return False
+        if entry["max_len"] is None:
+            return True
+        return max_len is not None and max_len <= entry["max_len"]
+
+    # ---------- get / put ----------
+
+    def get(self, fingerprint: str, min_support: float, max_len=None, mode: str = "all"):
+        """
+        Look up itemsets for a request.
+
+        Args:
+            fingerprint (str): Basket fingerprint (see fingerprint())
+            min_support (float): Requested minimum support
+            max_len (int): Requested maximum itemset length
+            mode (str): 'all', 'closed' or 'maximal'
+
+        Returns:
+            pd.DataFrame or None: Itemsets (support, itemsets), or None on a miss
+        """
+        candidates = [
+            entry for entry in self._entries
+            if entry["fingerprint"] == fingerprint and self._covers(entry, min_support, max_len, mode)
+        ]
+        if not candidates:
+            self.misses += 1
+            return None
+
+        # Kết quả nhỏ nhất còn bao được yêu cầu thì lọc nhanh nhất
+        entry = min(candidates, key=lambda e: e["n_itemsets"])
+        frame = self._read(entry)
+        entry["last_used"] = time.time()
+        self._save_index()
+        self.hits += 1
+
+        keep = frame["support"].to_numpy() >= min_support
+        if max_len is not None:
+            keep &= frame["itemsets"].map(len).to_numpy() <= max_len
+        result = frame[keep].reset_index(drop=True)
+        print(f"Đọc itemsets từ cache (min_support={entry['min_support']}): {len(result):,} itemsets")
+        return result
+
+    def put(self, fingerprint: str, min_support: float, itemsets: pd.DataFrame,
+            max_len=None, mode: str = "all"):
+        """
+        Store a mining result (itemsets must use item names).
+
+        Entries made redundant by the new one (same basket and mode, higher
+        or equal threshold, covered max_len) are dropped.
+        """
+        _check_itemset_mode(mode)
+        new_entry = {
+            "fingerprint": fingerprint,
+            "mode": mode,
+            "max_len": max_len,
+            "min_support": float(min_support),
+        }
+        kept = []
+        for entry in self._entries:
+            redundant = entry["fingerprint"] == fingerprint and self._covers(
+                new_entry, entry["min_support"], entry["max_len"], entry["mode"]
+            )
+            if redundant:
+                self._remove_file(entry)
+            else:
+                kept.append(entry)
+        self._entries = kept
+
+        key = hashlib.sha1(
+            json.dumps(new_entry, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+        file_name = f"{key}.parquet"
+        path = os.path.join(self.cache_dir, file_name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        frame = itemsets[["support", "itemsets"]].sort_values("support", ascending=False)
+        table = pa.table({
+            "support": pa.array(frame["support"].to_numpy(dtype=np.float64)),
+            "itemsets": pa.array([sorted(itemset, key=str) for itemset in frame["itemsets"]]),
+        })
+        pq.write_table(table, path)
+
+        new_entry.update(
+            file=file_name,
+            n_itemsets=len(frame),
+            bytes=os.path.getsize(path),
+            last_used=time.time(),
+        )
+        self._entries.append(new_entry)
+        self._remember(new_entry, frame.reset_index(drop=True))
+        self._evict()
+        self._save_index()
+
+    def clear(self):
+        """Remove every cached result."""
+        for entry in self._entries:
+            self._remove_file(entry)
+        self._entries = []
+        self._frames = {}
+        self._save_index()
+
+    # ---------- storage helpers ----------
+
+    def _read(self, entry: dict) -> pd.DataFrame:
+        """Load the result of an entry (memory first, then disk)."""
+        frame = self._frames.pop(entry["file"], None)
+        if frame is None:
+            table = pq.read_table(os.path.join(self.cache_dir, entry["file"]))
+            frame = pd.DataFrame({
+                "support": table.column("support").to_numpy(),
+                "itemsets": [frozenset(items) for items in table.column("itemsets").to_pylist()],
+            })
+        self._remember(entry, frame)
+        return frame
+
+    def _remember(self, entry: dict, frame: pd.DataFrame):
+        """Keep a result in the in-memory LRU."""
+        self._frames.pop(entry["file"], None)
+        self._frames[entry["file"]] = frame
+        while len(self._frames) > self.max_memory_entries:
+            self._frames.pop(next(iter(self._frames)))
+
+    def _remove_file(self, entry: dict):
+        """Delete the file (and in-memory copy) of an entry."""
+        self._frames.pop(entry["file"], None)
+        path = os.path.join(self.cache_dir, entry["file"])
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _evict(self):
+        """Drop least-recently-used entries until both bounds hold."""
+        self._entries.sort(key=lambda entry: entry["last_used"])
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or sum(entry["bytes"] for entry in self._entries) > self.max_bytes
+        ):
+            self._remove_file(self._entries.pop(0))
+
+
+def _mine_with_cache(cache, basket, min_support, max_len, mode, use_colnames, mine):
+    """
+    Run mine() through a FrequentItemsetCache (if any).
+
+    Only results with item names are cached, since column positions depend
+    on the basket layout.
+    """
+    if cache is None or not use_colnames:
+        return mine()
+
+    fingerprint = cache.fingerprint(basket)
+    itemsets = cache.get(fingerprint, min_support, max_len, mode)
+    if itemsets is None:
+        itemsets = mine()
+        cache.put(fingerprint, min_support, itemsets, max_len, mode)
+    return itemsets
+
+
+# =========================================================
+# 14. CONSTRAINED RULE GENERATION
+# =========================================================
+
+RULE_COLUMNS = (
+    "antecedents", "consequents", "antecedent support", "consequent support",
+    "support", "confidence", "lift", "representativity", "leverage",
+    "conviction", "zhangs_metric", "jaccard", "certainty", "kulczynski",
+)
+
+# Số luật tối đa mỗi row group khi ghi file luật Parquet
+RULES_PER_GROUP = 64_000
+
+
+def _rule_metrics(sA, sC, sAC) -> dict:
+    """
+    Các metric của mlxtend.association_rules (theo thứ tự cột) từ các mảng support.
+
+    Các metric được tính vector hoá một lần cho mọi luật đã qua ràng buộc.
+    """
+    sA = np.asarray(sA, dtype=np.float64)
+    sC = np.asarray(sC, dtype=np.float64)
+    sAC = np.asarray(sAC, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        confidence = sAC / sA
+        leverage = sAC - sA * sC
+        conviction = np.where(confidence < 1.0, (1.0 - sC) / (1.0 - confidence), np.inf)
+        zhang_denominator = np.maximum(sAC * (1 - sA), sA * (sC - sAC))
+        zhangs_metric = np.where(zhang_denominator == 0, 0.0, leverage / zhang_denominator)
+        certainty = np.where(sC == 1, 0.0, (confidence - sC) / (1 - sC))
+
+    return {
+        "antecedent support": sA,
+        "consequent support": sC,
+        "support": sAC,
+        "confidence": confidence,
+        "lift": confidence / sC,
+        "representativity": np.ones(len(sAC)),
+        "leverage": leverage,
+        "conviction": conviction,
+        "zhangs_metric": zhangs_metric,
+        "jaccard": sAC / (sA + sC - sAC),
+        "certainty": certainty,
+        "kulczynski": (confidence + sAC / sC) / 2,
+    }
+
+
+def _rules_frame(antecedents, consequents, sA, sC, sAC) -> pd.DataFrame:
+    """Dựng bảng luật cùng schema với mlxtend.association_rules."""
+    rules = pd.DataFrame({
+        "antecedents": pd.Series(antecedents, dtype=object),
+        "consequents": pd.Series(consequents, dtype=object),
+        **_rule_metrics(sA, sC, sAC),
+    })
+    return rules[list(RULE_COLUMNS)]
+
+
+def _join_consequents(consequents: list) -> list:
+    """
+    Sinh consequent dài hơn một item từ các consequent đã đạt (apriori-gen).
+
+    consequents là các tuple đã sắp xếp cùng độ dài k; ứng viên k+1 chỉ được
+    giữ khi mọi tập con k phần tử của nó đều đã đạt.
+    """
+    passed = set(consequents)
+    candidates = []
+    for i, left in enumerate(consequents):
+        for right in consequents[i + 1:]:
+            if left[:-1] != right[:-1]:
+                break
+            candidate = left + (right[-1],)
+            if all(candidate[:j] + candidate[j + 1:] in passed for j in range(len(candidate) - 2)):
+                candidates.append(candidate)
+    return candidates
+
+
+def generate_rules_constrained(frequent_itemsets: pd.DataFrame, compact: bool = False, **constraints):
+    """
+    Sinh luật kết hợp với mọi ràng buộc được áp dụng ngay trong lúc sinh.
+
+    Là iter_rules() với một batch duy nhất; xem iter_rules() cho các ràng buộc.
+
+    Args:
+        frequent_itemsets (pd.DataFrame): Frequent itemsets (cột support, itemsets)
+        compact (bool): Trả về CompactRuleTable (id item + mảng metric) thay vì DataFrame
+        **constraints: min_support, min_confidence, min_lift, max_len_antecedents,
+            max_len_consequents, must_contain, must_not_contain, consequent_items, basket
+
+    Returns:
+        pd.DataFrame | CompactRuleTable: Luật kết hợp (cùng cột với mlxtend.association_rules)
+    """
+    return next(iter_rules(frequent_itemsets, batch_size=None, compact=compact, **constraints))
+
+
+def iter_rules(
+    frequent_itemsets: pd.DataFrame,
+    batch_size: int = 100_000,
+    min_support: float = None,
+    min_confidence: float = None,
+    min_lift: float = None,
+    max_len_antecedents: int = None,
+    max_len_consequents: int = None,
+    must_contain=None,
+    must_not_contain=None,
+    consequent_items=None,
+    basket=None,
+    compact: bool = True,
+):
+    """
+    Sinh luật kết hợp theo từng batch cố định, với mọi ràng buộc áp dụng ngay khi sinh.
+
+    Chỉ một batch luật được giữ trong bộ nhớ: người dùng gộp top-N
+    (top_rules()) hoặc ghi thẳng ra file (write_rules_stream()).
+
+    Support của itemset được tra qua một dict băm frozenset → support. Với mỗi
+    itemset Z, consequent được mở rộng theo từng mức như ap-genrules: confidence
+    của Z\\Y → Y chỉ giảm khi Y lớn lên, nên consequent không đạt
+    min_confidence không bao giờ được mở rộng. Itemset quá dài so với
+    max_len_antecedents + max_len_consequents, dưới min_support hoặc vi phạm
+    ràng buộc item bị bỏ qua cả cụm, và luật bị loại thì không bao giờ được
+    tạo thành dòng.
+
+    Args:
+        frequent_itemsets (pd.DataFrame): Frequent itemsets (cột support, itemsets)
+        batch_size (int): Số luật mỗi batch (None = một batch chứa tất cả)
+        min_support (float): Support tối thiểu của luật
+        min_confidence (float): Confidence tối thiểu
+        min_lift (float): Lift tối thiểu
+        max_len_antecedents (int): Số item tối đa của antecedent
+        max_len_consequents (int): Số item tối đa của consequent
+        must_contain (item | list): Luật phải chứa ít nhất một item trong danh sách
+        must_not_contain (item | list): Luật không được chứa item nào trong danh sách
+        consequent_items (item | list): Item chỉ được nằm ở consequent; mỗi
+            itemset Z cho đúng một luật Z\\C → Z∩C
+        basket (pd.DataFrame | BitsetBasket | CompactBasket, optional): Dùng để
+            đếm support của các tập con thiếu trong frequent_itemsets (vd. khi
+            itemsets được khai phá với must_contain); None = báo lỗi nếu thiếu
+        compact (bool): Batch là CompactRuleTable (mọi batch dùng chung từ điển
+            item) thay vì DataFrame
+
+    Yields:
+        CompactRuleTable | pd.DataFrame: Batch luật (luôn có ít nhất một batch, có thể rỗng)
+    """
+    must_contain = _item_set(must_contain)
+    must_not_contain = _item_set(must_not_contain)
+    consequent_items = _item_set(consequent_items)
+
+    supports = dict(zip(map(frozenset, frequent_itemsets["itemsets"]), frequent_itemsets["support"]))
+    max_len = max(map(len, supports), default=0)
+    max_ant = max_len_antecedents or max_len
+    max_cons = max_len_consequents or max_len
+
+    candidates = []
+    for itemset, support in supports.items():
+        size = len(itemset)
+        if size < 2 or size > max_ant + max_cons:
+            continue
+        if min_support is not None and support < min_support:
+            continue
+        if must_contain and not itemset & must_contain:
+            continue
+        if itemset & must_not_contain:
+            continue
+        if consequent_items and not 0 < len(itemset & consequent_items) < size:
+            continue
+        candidates.append((itemset, support))
+
+    if basket is not None:
+        needed = set()
+        for itemset, _ in candidates:
+            if consequent_items:
+                needed.update((itemset - consequent_items, itemset & consequent_items))
+            else:
+                _subsets_top_down(itemset, lambda subset: needed.add(subset) or True)
+        _add_missing_supports(supports, needed, basket)
+
+    if compact:
+        items = sorted(set().union(*supports)) if supports else []
+        item_ids = {item: i for i, item in enumerate(items)}
+        # Antecedent/consequent luôn là khoá của supports: mã hoá mỗi itemset một lần
+        encoded = {itemset: [item_ids[item] for item in itemset] for itemset in supports}
+
+    def batch():
+        if compact:
+            return CompactRuleTable.from_id_lists(
+                [encoded[antecedent] for antecedent in antecedents],
+                [encoded[consequent] for consequent in consequents],
+                _rule_metrics(sA, sC, sAC),
+                items,
+            )
+        return _rules_frame(antecedents, consequents, sA, sC, sAC)
+
+    n_batches = 0
+    antecedents, consequents, sA, sC, sAC = [], [], [], [], []
+    for itemset, support in candidates:
+        size = len(itemset)
+        # Mức 1: consequent một item (hoặc đúng Z∩C khi có consequent_items)
+        if consequent_items:
+            level = [tuple(sorted(itemset & consequent_items))]
+        else:
+            level = [(item,) for item in sorted(itemset)]
+        while level and len(level[0]) <= min(max_cons, size - 1):
+            passed = []
+            for consequent in level:
+                consequent_set = frozenset(consequent)
+                antecedent = itemset - consequent_set
+                antecedent_support = supports.get(antecedent)
+                if antecedent_support is None:
+                    raise ValueError(
+                        f"Thiếu support của {set(antecedent)}: frequent_itemsets phải "
+                        "chứa mọi tập con (dùng expand_closed_itemsets/expand_maximal_itemsets "
+                        "hoặc truyền basket)"
+                    )
+                confidence = support / antecedent_support
+                if min_confidence is not None and confidence < min_confidence:
+                    continue
+                passed.append(consequent)
+                if len(antecedent) > max_ant:
+                    continue
+                consequent_support = supports[consequent_set]
+                if min_lift is not None and confidence / consequent_support < min_lift:
+                    continue
+                antecedents.append(antecedent)
+                consequents.append(consequent_set)
+                sA.append(antecedent_support)
+                sC.append(consequent_support)
+                sAC.append(support)
+                if batch_size is not None and len(sAC) >= batch_size:
+                    yield batch()
+                    n_batches += 1
+                    antecedents, consequents, sA, sC, sAC = [], [], [], [], []
+            level = [] if consequent_items else _join_consequents(passed)
+
+    if sAC or n_batches == 0:
+        yield batch()
+
+
+def top_rules(frequent_itemsets: pd.DataFrame, n: int = 100, by: str = "lift",
+              batch_size: int = 100_000, **constraints) -> "CompactRuleTable":
+    """
+    n luật tốt nhất theo một metric với bộ nhớ giới hạn.
+
+    Mỗi batch của iter_rules() được gộp với top-n hiện tại rồi cắt lại còn n
+    (argpartition), nên bộ nhớ chỉ là n + batch_size luật.
+
+    Args:
+        frequent_itemsets (pd.DataFrame): Frequent itemsets (cột support, itemsets)
+        n (int): Số luật giữ lại
+        by (str): Metric xếp hạng (vd. 'lift', 'confidence')
+        batch_size (int): Số luật mỗi batch
+        **constraints: Ràng buộc của iter_rules()
+
+    Returns:
+        CompactRuleTable: Top n luật, sắp xếp giảm dần theo by
+    """
+    best = None
+    for rules in iter_rules(frequent_itemsets, batch_size=batch_size, compact=True, **constraints):
+        merged = rules if best is None else CompactRuleTable.concat([best, rules])
+        best = merged.top(n, by)
+    return best
+
+
+def write_rules_stream(frequent_itemsets: pd.DataFrame, output_path: str,
+                       batch_size: int = RULES_PER_GROUP, **constraints) -> int:
+    """
+    Ghi mọi luật ra file Parquet theo từng batch (mỗi batch một row group).
+
+    Các luật không được sắp xếp toàn cục; read_rules() vẫn đẩy được ngưỡng
+    metric xuống scan nhờ thống kê của từng row group.
+
+    Args:
+        frequent_itemsets (pd.DataFrame): Frequent itemsets (cột support, itemsets)
+        output_path (str): File .parquet
+        batch_size (int): Số luật mỗi batch / row group
+        **constraints: Ràng buộc của iter_rules()
+
+    Returns:
+        int: Số luật đã ghi
+    """
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    n_rules = 0
+    writer = None
+    try:
+        for rules in iter_rules(frequent_itemsets, batch_size=batch_size, compact=True, **constraints):
+            table = rules_to_arrow(rules)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table, row_group_size=batch_size)
+            n_rules += len(rules)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rules
+
+
+# =========================================================
+# 15. ITEM CONSTRAINTS
+# =========================================================
+
+def _item_set(items) -> frozenset:
+    """Chuẩn hoá tham số ràng buộc item (None, một item hoặc list item) thành frozenset."""
+    if items is None:
+        return frozenset()
+    if isinstance(items, str):
+        return frozenset([items])
+    return frozenset(items)
+
+
+def _empty_itemsets() -> pd.DataFrame:
+    """Bảng frequent itemsets rỗng theo schema của mlxtend."""
+    return pd.DataFrame({
+        "support": np.array([], dtype=np.float64),
+        "itemsets": pd.Series([], dtype=object),
+    })
+
+
+def _mine_with_item_constraints(basket_df, min_support, must_contain, must_not_contain,
+                                use_colnames, mine) -> pd.DataFrame:
+    """
+    Khai phá trên basket đã thu hẹp theo ràng buộc item.
+
+    must_not_contain bỏ các cột đó trước khi khai phá. must_contain chỉ giữ
+    các hoá đơn chứa ít nhất một item bắt buộc: itemset chứa item đó có cùng
+    số đếm trên basket con, nên mine() chạy trên basket con với min_support
+    quy đổi theo số hoá đơn còn lại, rồi support được quy đổi ngược về toàn
+    bộ basket và các itemset không chứa item bắt buộc bị bỏ.
+
+    Args:
+        basket_df (pd.DataFrame): Basket boolean đầy đủ
+        min_support (float): Ngưỡng support trên toàn bộ basket
+        must_contain (item | list): Itemset phải chứa ít nhất một item trong danh sách
+        must_not_contain (item | list): Itemset không được chứa item nào trong danh sách
+        use_colnames (bool): Itemsets theo tên item (False = vị trí cột của basket_df)
+        mine (callable): mine(basket, min_support) -> frequent itemsets
+
+    Returns:
+        pd.DataFrame: Frequent itemsets thoả ràng buộc (support trên toàn bộ basket)
+    """
+    must_contain = _item_set(must_contain)
+    must_not_contain = _item_set(must_not_contain)
+    columns = basket_df.columns
+    unknown = (must_contain | must_not_contain) - set(columns)
+    if unknown:
+        raise ValueError(f"Item không có trong basket: {sorted(map(str, unknown))}")
+    if must_contain & must_not_contain:
+        raise ValueError(
+            f"Item vừa bắt buộc vừa bị loại: {sorted(map(str, must_contain & must_not_contain))}"
+        )
+
+    n_transactions = len(basket_df)
+    keep = ~columns.isin(list(must_not_contain))
+    positions = np.flatnonzero(keep)
+    basket = basket_df.loc[:, keep] if must_not_contain else basket_df
+    if must_contain:
+        rows = basket_df[list(must_contain)].to_numpy(dtype=bool).any(axis=1)
+        basket = basket[rows]
+    n_kept = len(basket)
+
+    if n_kept == 0 or min_support * n_transactions > n_kept:
+        return _empty_itemsets()
+    # Hạ nhẹ ngưỡng để sai số làm tròn không làm mất itemset ở biên
+    local_support = min_support * n_transactions / n_kept * (1 - 1e-9)
+    frequent_itemsets = mine(basket, local_support)
+    if len(frequent_itemsets) == 0:
+        return _empty_itemsets()
+
+    itemsets = frequent_itemsets["itemsets"]
+    if not use_colnames:
+        itemsets = itemsets.apply(lambda itemset: frozenset(int(positions[i]) for i in itemset))
+        must_contain = frozenset(columns.get_indexer(list(must_contain)).tolist())
+
+    counts = np.rint(frequent_itemsets["support"].to_numpy() * n_kept)
+    support = counts / n_transactions
+    keep = support >= min_support
+    if must_contain:
+        keep &= np.fromiter((bool(itemset & must_contain) for itemset in itemsets),
+                            dtype=bool, count=len(itemsets))
+
+    result = pd.DataFrame({"support": support[keep], "itemsets": itemsets[keep].tolist()})
+    result.sort_values("support", ascending=False, inplace=True)
+    return result.reset_index(drop=True)
+
+
+def _filter_must_contain(frequent_itemsets: pd.DataFrame, must_contain) -> pd.DataFrame:
+    """Chỉ giữ itemset chứa ít nhất một item trong must_contain (rỗng = giữ tất cả)."""
+    if not must_contain:
+        return frequent_itemsets
+    mask = [bool(itemset & must_contain) for itemset in frequent_itemsets["itemsets"]]
+    return frequent_itemsets[np.asarray(mask, dtype=bool)].reset_index(drop=True)
+
+
+def _add_missing_supports(supports: dict, needed, basket):
+    """
+    Đếm support của các itemset trong needed còn thiếu trong supports (một lượt bitset).
+
+    Itemset theo tên item của basket, hoặc theo vị trí cột nếu không khớp tên.
+    """
+    missing = [itemset for itemset in needed if itemset not in supports]
+    if not missing:
+        return
+    bitset = _as_bitset(basket)
+    if set().union(*missing) <= set(bitset.items):
+        values = bitset.batch_support(missing)
+    else:
+        id_lists = [sorted(itemset) for itemset in missing]
+        values = bitset.batch_support_counts_ids(id_lists) / bitset.n_transactions
+    supports.update(zip(missing, values))
+
+
+# =========================================================
+# 16. COMPACT RULE TABLE
+# =========================================================
+
+def _offsets(lengths) -> np.ndarray:
+    """CSR row pointers (length n + 1) from per-row lengths."""
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    return indptr
+
+
+def _take_rows(indptr: np.ndarray, indices: np.ndarray, positions: np.ndarray):
+    """Gather CSR rows (vectorized): returns (indptr, indices) of the selected rows."""
+    starts = indptr[positions]
+    lengths = indptr[positions + 1] - starts
+    new_indptr = _offsets(lengths)
+    # Vị trí của từng phần tử: start của dòng + thứ tự trong dòng
+    gather = np.repeat(starts - new_indptr[:-1], lengths) + np.arange(new_indptr[-1])
+    return new_indptr, indices[gather]
+
+
+class CompactRuleTable:
+    """
+    Association rules as integer item ids plus typed metric arrays.
+
+    Rule r has antecedent ids ant_indices[ant_indptr[r]:ant_indptr[r + 1]]
+    and consequent ids cons_indices[cons_indptr[r]:cons_indptr[r + 1]]
+    (int32, CSR-style); every metric is one float64 array. Item names live
+    only in the item dictionary, and readable strings are built on demand
+    for the rules being displayed or exported.
+
+    Metrics are read with table["lift"], so code that only needs metric
+    columns (scatter plots, weighted metrics) accepts the table directly.
+    """
+
+    def __init__(self, ant_indptr, ant_indices, cons_indptr, cons_indices, metrics: dict, items):
+        """
+        Initialize from CSR arrays.
+
+        Args:
+            ant_indptr (np.ndarray): Antecedent row pointers, length n_rules + 1
+            ant_indices (np.ndarray): Antecedent item ids
+            cons_indptr (np.ndarray): Consequent row pointers, length n_rules + 1
+            cons_indices (np.ndarray): Consequent item ids
+            metrics (dict): {metric name: array of length n_rules}
+            items (list-like): Item dictionary (id -> item name)
+        """
+        self.ant_indptr = np.asarray(ant_indptr, dtype=np.int64)
+        self.ant_indices = np.asarray(ant_indices, dtype=np.int32)
+        self.cons_indptr = np.asarray(cons_indptr, dtype=np.int64)
+        self.cons_indices = np.asarray(cons_indices, dtype=np.int32)
+        self.metrics = {name: np.asarray(values, dtype=np.float64) for name, values in metrics.items()}
+        self.items = pd.Index(items)
+
+    def __len__(self) -> int:
+        return len(self.ant_indptr) - 1
+
+    @property
+    def n_rules(self) -> int:
+        return len(self)
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    @property
+    def columns(self) -> list:
+        """Column names of to_frame() (without the readable string columns)."""
+        return ["antecedents", "consequents", *self.metrics]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the id and metric arrays."""
+        arrays = [self.ant_indptr, self.ant_indices, self.cons_indptr, self.cons_indices]
+        return sum(a.nbytes for a in arrays) + sum(a.nbytes for a in self.metrics.values())
+
+    def __getitem__(self, metric: str) -> np.ndarray:
+        if metric not in self.metrics:
+            raise KeyError(f"CompactRuleTable không có metric '{metric}'")
+        return self.metrics[metric]
+
+    def __setitem__(self, metric: str, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) != len(self):
+            raise ValueError(f"Metric '{metric}' cần {len(self)} giá trị, nhận {len(values)}")
+        self.metrics[metric] = values
+
+    # ---------- build ----------
+
+    @classmethod
+    def from_id_lists(cls, antecedents, consequents, metrics: dict, items) -> "CompactRuleTable":
+        """
+        Build from per-rule lists of item ids.
+
+        Args:
+            antecedents (list): Item ids of each antecedent
+            consequents (list): Item ids of each consequent
+            metrics (dict): {metric name: array aligned with the rules}
+            items (list-like): Item dictionary (id -> item name)
+
+        Returns:
+            CompactRuleTable
+        """
+        def pack(id_lists):
+            lengths = np.fromiter(map(len, id_lists), dtype=np.int64, count=len(id_lists))
+            indices = np.fromiter(
+                (i for ids in id_lists for i in sorted(ids)), dtype=np.int32, count=int(lengths.sum())
+            )
+            return _offsets(lengths), indices
+
+        ant_indptr, ant_indices = pack(antecedents)
+        cons_indptr, cons_indices = pack(consequents)
+        return cls(ant_indptr, ant_indices, cons_indptr, cons_indices, metrics, items)
+
+    @classmethod
+    def from_rules(cls, rules_df: pd.DataFrame, items=None) -> "CompactRuleTable":
+        """
+        Encode a rules dataframe (antecedents/consequents as frozensets).
+
+        Args:
+            rules_df (pd.DataFrame): Output of association_rules() / generate_rules()
+            items (list-like, optional): Item dictionary (default: items of the rules, sorted)
+
+        Returns:
+            CompactRuleTable: Every metric column becomes a float64 array
+                (readable *_str columns are dropped)
+        """
+        if items is None:
+            items = sorted(set().union(*rules_df["antecedents"], *rules_df["consequents"]))
+        item_ids = {item: i for i, item in enumerate(items)}
+        metrics = {
+            name: rules_df[name].to_numpy(dtype=np.float64)
+            for name in rules_df.columns
+            if name not in ("antecedents", "consequents") and not name.endswith("_str")
+        }
+        return cls.from_id_lists(
+            [[item_ids[item] for item in antecedent] for antecedent in rules_df["antecedents"]],
+            [[item_ids[item] for item in consequent] for consequent in rules_df["consequents"]],
+            metrics,
+            items,
+        )
+
+    @classmethod
+    def concat(cls, tables: list) -> "CompactRuleTable":
+        """
+        Concatenate tables that share one item dictionary (e.g. batches of iter_rules()).
+
+        Args:
+            tables (list): CompactRuleTable objects with identical items
+
+        Returns:
+            CompactRuleTable
+        """
+        items = tables[0].items
+        if any(not table.items.equals(items) for table in tables[1:]):
+            raise ValueError("Chỉ nối được các CompactRuleTable có cùng từ điển item")
+
+        def stack(indptrs, indices):
+            shifts = np.cumsum([0] + [indptr[-1] for indptr in indptrs[:-1]])
+            indptr = np.concatenate(
+                [indptrs[0][:1]] + [indptr[1:] + shift for indptr, shift in zip(indptrs, shifts)]
+            )
+            return indptr, np.concatenate(indices)
+
+        ant_indptr, ant_indices = stack([t.ant_indptr for t in tables], [t.ant_indices for t in tables])
+        cons_indptr, cons_indices = stack([t.cons_indptr for t in tables], [t.cons_indices for t in tables])
+        metrics = {
+            name: np.concatenate([table.metrics[name] for table in tables])
+            for name in tables[0].metrics
+        }
+        return cls(ant_indptr, ant_indices, cons_indptr, cons_indices, metrics, items)
+
+    # ---------- select ----------
+
+    def antecedent_lengths(self) -> np.ndarray:
+        return np.diff(self.ant_indptr)
+
+    def consequent_lengths(self) -> np.ndarray:
+        return np.diff(self.cons_indptr)
+
+    def iter_antecedent_ids(self):
+        """Yield the item id array of every antecedent."""
+        for start, end in zip(self.ant_indptr[:-1], self.ant_indptr[1:]):
+            yield self.ant_indices[start:end]
+
+    def iter_consequent_ids(self):
+        """Yield the item id array of every consequent."""
+        for start, end in zip(self.cons_indptr[:-1], self.cons_indptr[1:]):
+            yield self.cons_indices[start:end]
+
+    def take(self, positions) -> "CompactRuleTable":
+        """Rules at the given positions (or boolean mask), in that order."""
+        positions = np.asarray(positions)
+        if positions.dtype == bool:
+            positions = np.flatnonzero(positions)
+        positions = positions.astype(np.int64)
+        ant_indptr, ant_indices = _take_rows(self.ant_indptr, self.ant_indices, positions)
+        cons_indptr, cons_indices = _take_rows(self.cons_indptr, self.cons_indices, positions)
+        metrics = {name: values[positions] for name, values in self.metrics.items()}
+        return CompactRuleTable(ant_indptr, ant_indices, cons_indptr, cons_indices, metrics, self.items)
+
+    def filter(
+        self,
+        min_support: float = None,
+        min_confidence: float = None,
+        min_lift: float = None,
+        max_len_antecedents: int = None,
+        max_len_consequents: int = None,
+    ) -> "CompactRuleTable":
+        """Same filters as AssociationRulesMiner.filter_rules(), on the typed arrays."""
+        mask = np.ones(len(self), dtype=bool)
+        if min_support is not None:
+            mask &= self.metrics["support"] >= min_support
+        if min_confidence is not None:
+            mask &= self.metrics["confidence"] >= min_confidence
+        if min_lift is not None:
+            mask &= self.metrics["lift"] >= min_lift
+        if max_len_antecedents is not None:
+            mask &= self.antecedent_lengths() <= max_len_antecedents
+        if max_len_consequents is not None:
+            mask &= self.consequent_lengths() <= max_len_consequents
+        return self.take(mask)
+
+    def sort_values(self, by, ascending: bool = False) -> "CompactRuleTable":
+        """Rules sorted by one metric or a list of metrics (stable)."""
+        keys = [by] if isinstance(by, str) else list(by)
+        sign = 1 if ascending else -1
+        return self.take(np.lexsort([sign * self[key] for key in reversed(keys)]))
+
+    def head(self, n: int = 5) -> "CompactRuleTable":
+        return self.take(np.arange(min(n, len(self))))
+
+    def top(self, n: int, by: str = "lift") -> "CompactRuleTable":
+        """The n rules with the highest metric, sorted descending (argpartition, no full sort)."""
+        values = self[by]
+        if n < len(self):
+            positions = np.argpartition(-values, n - 1)[:n]
+        else:
+            positions = np.arange(len(self))
+        return self.take(positions[np.argsort(-values[positions], kind="stable")])
+
+    # ---------- readable output ----------
+
+    def _strings(self, indptr: np.ndarray, indices: np.ndarray) -> list:
+        """Sorted item names of each row joined with ', ' (like _frozenset_to_str)."""
+        names = self.items.astype(str).to_numpy()
+        return [
+            ", ".join(sorted(names[indices[start:end]]))
+            for start, end in zip(indptr[:-1], indptr[1:])
+        ]
+
+    def antecedent_strings(self) -> list:
+        return self._strings(self.ant_indptr, self.ant_indices)
+
+    def consequent_strings(self) -> list:
+        return self._strings(self.cons_indptr, self.cons_indices)
+
+    def rule_strings(self) -> list:
+        return [
+            f"{a} → {c}" for a, c in zip(self.antecedent_strings(), self.consequent_strings())
+        ]
+
+    def to_frame(self, readable: bool = False) -> pd.DataFrame:
+        """
+        Rules dataframe in the association_rules() schema.
+
+        Args:
+            readable (bool): Also add antecedents_str, consequents_str and rule_str
+
+        Returns:
+            pd.DataFrame: One row per rule
+        """
+        items = self.items.to_numpy()
+
+        def frozensets(indptr, indices):
+            return pd.Series(
+                [frozenset(items[indices[start:end]].tolist())
+                 for start, end in zip(indptr[:-1], indptr[1:])],
+                dtype=object,
+            )
+
+        rules = pd.DataFrame({
+            "antecedents": frozensets(self.ant_indptr, self.ant_indices),
+            "consequents": frozensets(self.cons_indptr, self.cons_indices),
+            **self.metrics,
+        })
+        if readable:
+            rules["antecedents_str"] = self.antecedent_strings()
+            rules["consequents_str"] = self.consequent_strings()
+            rules["rule_str"] = rules["antecedents_str"] + " → " + rules["consequents_str"]
+        return rules
+
+
+# =========================================================
+# 17. RULE STORE (INDEXED QUERIES)
+# =========================================================
+
+class RuleStore:
+    """
+    Read-only indexes over a rule table for repeated interactive filtering.
+
+    Every indexed column (support, confidence, lift and the antecedent /
+    consequent lengths) keeps an argsort order plus its sorted values, so a
+    range predicate is one searchsorted giving a view of rule ids. An
+    inverted index maps each item id to the sorted ids of the rules whose
+    antecedent (or consequent) contains it.
+
+    A query starts from its most selective predicate (smallest id range or
+    posting list) and checks the other predicates only on those ids, so it
+    never copies the whole table; only when even that predicate keeps a
+    large share of the rules are the others checked by sequential column
+    scans. Ids stay in index order until the end, so count() never sorts.
+    Queries return rule ids; use rules() or frame() to materialize just
+    those rows.
+    """
+
+    INDEXED = ("support", "confidence", "lift")
+    # Điều kiện hẹp nhất vẫn giữ hơn 1/SCAN_SHARE số luật: quét cột thay vì gather
+    SCAN_SHARE = 16
+
+    def __init__(self, rules):
+        """
+        Build the indexes.
+
+        Args:
+            rules (CompactRuleTable | pd.DataFrame): Rules to index
+        """
+        if not isinstance(rules, CompactRuleTable):
+            rules = CompactRuleTable.from_rules(rules)
+        self.table = rules
+
+        columns = {name: rules[name] for name in self.INDEXED}
+        columns["antecedent_len"] = rules.antecedent_lengths()
+        columns["consequent_len"] = rules.consequent_lengths()
+        self._columns = columns
+        self._index = {}
+        for name, values in columns.items():
+            order = np.argsort(values, kind="stable")
+            order.flags.writeable = False  # _range() trả về view của mảng này
+            self._index[name] = (order, values[order])
+
+        self._postings = {
+            "antecedents": self._inverted_index(rules.ant_indptr, rules.ant_indices),
+            "consequents": self._inverted_index(rules.cons_indptr, rules.cons_indices),
+        }
+        self._item_ids = {item: i for i, item in enumerate(rules.items)}
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def _inverted_index(self, indptr: np.ndarray, indices: np.ndarray):
+        """(item_indptr, rule_ids): rule ids of item i are rule_ids[item_indptr[i]:item_indptr[i + 1]]."""
+        rule_of = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+        order = np.argsort(indices, kind="stable")  # ổn định: id luật tăng dần trong mỗi item
+        counts = np.bincount(indices, minlength=len(self.table.items))
+        rule_ids = rule_of[order]
+        rule_ids.flags.writeable = False  # query() có thể trả về view của mảng này
+        return _offsets(counts), rule_ids
+
+    def _posting(self, side: str, item) -> np.ndarray:
+        """Sorted ids of the rules whose side contains item."""
+        if item not in self._item_ids:
+            return np.zeros(0, dtype=np.int64)
+        i = self._item_ids[item]
+        item_indptr, rule_ids = self._postings[side]
+        return rule_ids[item_indptr[i]:item_indptr[i + 1]]
+
+    def _item_postings(self, side: str, items) -> list:
+        """Posting lists for every requested item; side 'any' unions both sides."""
+        postings = []
+        for item in _item_set(items):
+            if side == "any":
+                postings.append(np.union1d(
+                    self._posting("antecedents", item), self._posting("consequents", item)
+                ))
+            else:
+                postings.append(self._posting(side, item))
+        return postings
+
+    def _range(self, name: str, low, high):
+        """Rule ids (view, in index order) with low <= column <= high."""
+        order, values = self._index[name]
+        start = 0 if low is None else np.searchsorted(values, low, side="left")
+        end = len(values) if high is None else np.searchsorted(values, high, side="right")
+        return order[start:end]
+
+    def _predicates(
+        self,
+        min_support: float = None,
+        max_support: float = None,
+        min_confidence: float = None,
+        max_confidence: float = None,
+        min_lift: float = None,
+        max_lift: float = None,
+        max_len_antecedents: int = None,
+        max_len_consequents: int = None,
+        contains=None,
+        antecedent_contains=None,
+        consequent_contains=None,
+    ):
+        """(ranges, postings) of a query: active (column, low, high) triples and posting lists."""
+        ranges = [
+            (name, low, high)
+            for name, low, high in (
+                ("support", min_support, max_support),
+                ("confidence", min_confidence, max_confidence),
+                ("lift", min_lift, max_lift),
+                ("antecedent_len", None, max_len_antecedents),
+                ("consequent_len", None, max_len_consequents),
+            )
+            if low is not None or high is not None
+        ]
+        postings = (
+            self._item_postings("any", contains)
+            + self._item_postings("antecedents", antecedent_contains)
+            + self._item_postings("consequents", consequent_contains)
+        )
+        return ranges, postings
+
+    def _match(self, ranges: list, postings: list, sort: bool):
+        """
+        Evaluate a query.
+
+        Returns (ids, mask): ids (mask None; in increasing order if sort,
+        otherwise possibly in the order of the most selective index), or a
+        boolean mask over all rules (ids None) when even
+        the most selective predicate keeps a large share of the table and
+        other predicates remain: sequential column scans are then cheaper
+        than gathering the column values of every candidate id.
+        """
+        n = len(self.table)
+        # Chọn điều kiện hẹp nhất làm tập ứng viên
+        candidates = [("range", r, self._range(*r)) for r in ranges]
+        candidates += [("posting", None, p) for p in postings]
+        if not candidates:
+            return np.arange(n, dtype=np.int64), None
+        best = min(range(len(candidates)), key=lambda k: len(candidates[k][2]))
+        ids = candidates[best][2]
+
+        if len(candidates) > 1 and len(ids) * self.SCAN_SHARE >= n:
+            mask = np.ones(n, dtype=bool)
+            for name, low, high in ranges:
+                column = self._columns[name]
+                if low is not None:
+                    mask &= column >= low
+                if high is not None:
+                    mask &= column <= high
+            for values in postings:
+                member = np.zeros(n, dtype=bool)
+                member[values] = True
+                mask &= member
+            return None, mask
+
+        for k, (kind, predicate, values) in enumerate(candidates):
+            if k == best or len(ids) == 0:
+                continue
+            if kind == "range":
+                name, low, high = predicate
+                column = self._columns[name][ids]
+                keep = np.ones(len(ids), dtype=bool)
+                if low is not None:
+                    keep &= column >= low
+                if high is not None:
+                    keep &= column <= high
+            else:
+                # Posting list đã sắp xếp: kiểm tra thành viên bằng searchsorted
+                positions = np.minimum(np.searchsorted(values, ids), max(len(values) - 1, 0))
+                keep = values[positions] == ids if len(values) else np.zeros(len(ids), dtype=bool)
+            ids = ids[keep]
+        # Posting list đã sắp xếp theo id; dải của index thì chưa
+        if sort and candidates[best][0] == "range":
+            ids = np.sort(ids)
+        return ids, None
+
+    def query(
+        self,
+        min_support: float = None,
+        max_support: float = None,
+        min_confidence: float = None,
+        max_confidence: float = None,
+        min_lift: float = None,
+        max_lift: float = None,
+        max_len_antecedents: int = None,
+        max_len_consequents: int = None,
+        contains=None,
+        antecedent_contains=None,
+        consequent_contains=None,
+        sort: bool = True,
+    ) -> np.ndarray:
+        """
+        Ids of the rules matching every predicate (bounds are inclusive).
+
+        Args:
+            min_support / max_support (float): Support range
+            min_confidence / max_confidence (float): Confidence range
+            min_lift / max_lift (float): Lift range
+            max_len_antecedents (int): Maximum number of antecedent items
+            max_len_consequents (int): Maximum number of consequent items
+            contains (str | list): Rules containing all these items (either side)
+            antecedent_contains (str | list): Antecedent contains all these items
+            consequent_contains (str | list): Consequent contains all these items
+            sort (bool): Return ids in increasing order; False may keep the
+                order of the most selective index (a read-only view when that
+                predicate is the only one), which skips the sort
+
+        Returns:
+            np.ndarray: int64 rule ids (positions in self.table)
+        """
+        ranges, postings = self._predicates(
+            min_support=min_support,
+            max_support=max_support,
+            min_confidence=min_confidence,
+            max_confidence=max_confidence,
+            min_lift=min_lift,
+            max_lift=max_lift,
+            max_len_antecedents=max_len_antecedents,
+            max_len_consequents=max_len_consequents,
+            contains=contains,
+            antecedent_contains=antecedent_contains,
+            consequent_contains=consequent_contains,
+        )
+        ids, mask = self._match(ranges, postings, sort)
+        return ids if mask is None else np.flatnonzero(mask)
+
+    def count(self, **predicates) -> int:
+        """Number of rules matching query(**predicates) (ids are never sorted)."""
+        ids, mask = self._match(*self._predicates(**predicates), sort=False)
+        return len(ids) if mask is None else int(np.count_nonzero(mask))
+
+    def rules(self, ids) -> "CompactRuleTable":
+        """CompactRuleTable of the given rule ids."""
+        return self.table.take(ids)
+
+    def frame(self, ids, readable: bool = True) -> pd.DataFrame:
+        """Rules dataframe (with readable strings) of the given rule ids."""
+        return self.table.take(ids).to_frame(readable=readable)
+
+    def filter(
+        self,
+        min_support: float = None,
+        min_confidence: float = None,
+        min_lift: float = None,
+        max_len_antecedents: int = None,
+        max_len_consequents: int = None,
+    ) -> "CompactRuleTable":
+        """
+        Indexed equivalent of CompactRuleTable.filter() (what filter_rules()
+        returns for compact rules): same predicates, rules kept in table order.
+
+        Returns a CompactRuleTable, not a DataFrame; use frame(query(...))
+        for a DataFrame like filter_rules() gives on DataFrame rules.
+        """
+        return self.rules(self.query(
+            min_support=min_support,
+            min_confidence=min_confidence,
+            min_lift=min_lift,
+            max_len_antecedents=max_len_antecedents,
+            max_len_consequents=max_len_consequents,
+        ))
+
+
+# =========================================================
+# 18. COLUMNAR RULE FILES (PARQUET)
+# =========================================================
+
+def _list_column(indptr: np.ndarray, indices: np.ndarray, items: pa.Array) -> pa.ListArray:
+    """Arrow list column of item names from CSR offsets and item ids."""
+    return pa.ListArray.from_arrays(
+        pa.array(indptr, type=pa.int64()).cast(pa.int32()),
+        items.take(pa.array(indices, type=pa.int32())),
+    )
+
+
+def rules_to_arrow(rules) -> pa.Table:
+    """
+    Arrow table of a rule set: antecedents/consequents as list<string>
+    columns (items sorted), every metric as a float64 column.
+
+    Args:
+        rules (CompactRuleTable | pd.DataFrame): Rules (frozenset columns for DataFrame)
+
+    Returns:
+        pa.Table: Columnar rules
+    """
+    if not isinstance(rules, CompactRuleTable):
+        rules = CompactRuleTable.from_rules(rules)
+    items = pa.array(rules.items.to_numpy())
+    columns = {
+        "antecedents": _list_column(rules.ant_indptr, rules.ant_indices, items),
+        "consequents": _list_column(rules.cons_indptr, rules.cons_indices, items),
+    }
+    columns.update({name: pa.array(values) for name, values in rules.metrics.items()})
+    return pa.table(columns)
+
+
+def write_rules_parquet(rules, output_path: str, rows_per_group: int = RULES_PER_GROUP):
+    """
+    Write rules to Parquet (list<string> item columns, typed metric columns).
+
+    Rows keep the order of the rules (e.g. sorted by lift), so row-group
+    statistics let read_rules() skip groups on metric thresholds.
+
+    Args:
+        rules (CompactRuleTable | pd.DataFrame): Rules to write
+        output_path (str): .parquet path
+        rows_per_group (int): Maximum rules per row group
+    """
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    pq.write_table(rules_to_arrow(rules), output_path, row_group_size=rows_per_group)
+
+
+def _frozensets(column) -> pd.Series:
+    """frozenset per row of an Arrow list column."""
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    offsets = column.offsets.to_numpy()
+    offsets = offsets - offsets[0]
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    return pd.Series(
+        [frozenset(values[start:end].tolist()) for start, end in zip(offsets[:-1], offsets[1:])],
+        dtype=object,
+    )
+
+
+def _arrow_to_compact(table: pa.Table) -> "CompactRuleTable":
+    """CompactRuleTable from an Arrow table with both list columns."""
+    antecedents = table.column("antecedents").combine_chunks()
+    consequents = table.column("consequents").combine_chunks()
+    # Một từ điển item chung cho cả hai phía
+    encoded = pa.concat_arrays([antecedents.flatten(), consequents.flatten()]).dictionary_encode()
+    indices = encoded.indices.to_numpy(zero_copy_only=False)
+    n_ant = len(antecedents.flatten())
+    metrics = {
+        name: table.column(name).to_numpy()
+        for name in table.column_names
+        if name not in ("antecedents", "consequents")
+    }
+    return CompactRuleTable(
+        antecedents.offsets.to_numpy() - antecedents.offsets[0].as_py(),
+        indices[:n_ant],
+        consequents.offsets.to_numpy() - consequents.offsets[0].as_py(),
+        indices[n_ant:],
+        metrics,
+        encoded.dictionary.to_pylist(),
+    )
+
+
+def read_rules(
+    path: str,
+    columns=None,
+    min_support: float = None,
+    min_confidence: float = None,
+    min_lift: float = None,
+    rows=None,
+    readable: bool = False,
+    compact: bool = False,
+):
+    """
+    Lazily read a rule file written by write_rules_parquet().
+
+    Only the requested columns are read, metric thresholds are pushed down
+    to the Parquet scan (skipping row groups by their statistics), and rows
+    stops the scan once the requested slice of matching rules is complete.
+    rows follows Python slicing on the matching rules: negative bounds and
+    steps other than 1 are resolved against the number of matching rules,
+    which costs one extra counting pass over the filtered scan.
+
+    Args:
+        path (str): .parquet rule file
+        columns (list, optional): Columns to read (default: all)
+        min_support (float, optional): Keep support >= min_support
+        min_confidence (float, optional): Keep confidence >= min_confidence
+        min_lift (float, optional): Keep lift >= min_lift
+        rows (slice | int, optional): Slice of the matching rules (int n = rows[:n])
+        readable (bool): Add antecedents_str, consequents_str and rule_str
+        compact (bool): Return a CompactRuleTable (needs both item columns)
+
+    Returns:
+        pd.DataFrame | CompactRuleTable: Selected rules (frozenset item columns)
+    """
+    dataset = ds.dataset(path, format="parquet")
+
+    conditions = []
+    if min_support is not None:
+        conditions.append(ds.field("support") >= min_support)
+    if min_confidence is not None:
+        conditions.append(ds.field("confidence") >= min_confidence)
+    if min_lift is not None:
+        conditions.append(ds.field("lift") >= min_lift)
+
+    row_filter = None
+    for condition in conditions:
+        row_filter = condition if row_filter is None else row_filter & condition
+
+    if columns is None:
+        columns = dataset.schema.names
+    columns = list(columns)
+
+    if rows is None:
+        table = dataset.to_table(columns=columns, filter=row_filter)
+    else:
+        if isinstance(rows, int):
+            rows = slice(0, rows)
+        start, stop = rows.start or 0, rows.stop
+        positions = None
+        if rows.step not in (None, 1) or start < 0 or (stop is not None and stop < 0):
+            # Biên âm / bước khác 1: quy về vị trí trên các luật thoả điều kiện
+            positions = range(dataset.count_rows(filter=row_filter))[rows]
+            start = min(positions, default=0)
+            stop = max(positions, default=-1) + 1
+        if stop is not None:
+            stop = max(stop, start)  # rows[5:2] rỗng như slicing của Python
+        batches, seen = [], 0
+        scanner = dataset.scanner(columns=columns, filter=row_filter)
+        for batch in scanner.to_batches():
+            if stop is not None and seen >= stop:
+                break  # Đủ số luật: không đọc tiếp các row group còn lại
+            end = seen + batch.num_rows
+            if end > start:
+                lo = max(start - seen, 0)
+                hi = batch.num_rows if stop is None else min(stop - seen, batch.num_rows)
+                batches.append(batch.slice(lo, hi - lo))
+            seen = end
+        table = pa.Table.from_batches(batches, schema=scanner.projected_schema)
+        if positions is not None:
+            table = table.take(pa.array(np.asarray(positions, dtype=np.int64) - start))
+
+    if compact:
+        if not {"antecedents", "consequents"} <= set(columns):
+            raise ValueError("compact=True cần đọc cả cột antecedents và consequents")
+        return _arrow_to_compact(table)
+
+    list_columns = [name for name in ("antecedents", "consequents") if name in columns]
+    rules = table.drop(list_columns).to_pandas()
+    for name in list_columns:
+        rules[name] = _frozensets(table.column(name))
+    rules = rules[columns]
+
+    if readable:
+        for name in list_columns:
+            rules[f"{name}_str"] = rules[name].apply(AssociationRulesMiner._frozenset_to_str)
+        if len(list_columns) == 2:
+            rules["rule_str"] = rules["antecedents_str"] + " → " + rules["consequents_str"]
+    return rules
+
+
+# =========================================================
+# 19. MINING PLANNER (COST ESTIMATE & ALGORITHM CHOICE)
+# =========================================================
+
+class MiningPlanner:
+    """
+    Estimate the cost of a mining run and pick the algorithm before mining.
+
+    The estimate only needs item counts and pairwise co-occurrence counts of
+    the frequent items (one sparse product on the BitsetBasket):
+
+    - levels 1 and 2 are exact (F1, F2), and so are the Apriori candidate
+      counts C2 = F1 choose 2 and C3 (mlxtend joins every frequent pair with
+      every later item of level 2, without subset pruning);
+    - F3 is the number of triangles of the frequent-pair graph times the
+      frequent fraction of a random sample of those triangles;
+    - deeper levels decay geometrically: F(k+1) = F(k) * r(k) with
+      r(k+1) = r(k) * LEVEL_DECAY.
+
+    Memory and time per algorithm follow the way each implementation works
+    (dense n x candidates x k gather per Apriori level, mlxtend FP-Growth over
+    the whole basket, bitset diffsets for Eclat); the constants were
+    calibrated on the UK basket with mlxtend 0.23 and are meant as orders of
+    magnitude, not exact figures.
+    """
+
+    ALGORITHMS = ("apriori", "fpgrowth", "eclat")
+
+    # Tỉ lệ giảm của hệ số tăng trưởng giữa hai cấp liên tiếp (k >= 3)
+    LEVEL_DECAY = 0.5
+    # Số tam giác lấy mẫu để ước lượng F3
+    TRIANGLE_SAMPLE = 2000
+
+    # Hằng số hiệu chỉnh (mlxtend 0.23, basket UK 18k hoá đơn x 4k sản phẩm)
+    APRIORI_OPS_PER_SECOND = 6e8  # phần tử bool gom/AND mỗi giây
+    FPGROWTH_OPS_PER_SECOND = 1.7e7  # n x F1^2 mỗi giây
+    FPGROWTH_BYTES_PER_CELL = 18  # basket dạng dense (bytes mỗi ô n x m)
+    FPGROWTH_BYTES_PER_NONZERO = 64  # basket dạng sparse
+    ECLAT_OPS_PER_SECOND = 2e8  # word uint64 mỗi giây
+    ECLAT_SECONDS_PER_ITEMSET = 1e-4  # chi phí Python của mỗi itemset kết quả
+    ITEMSET_BYTES = 400  # một dòng kết quả (frozenset + support)
+
+    def __init__(self, basket_df, max_memory_mb=2048, max_seconds=600, on_exceed="warn",
+                 random_state=0):
+        """
+        Args:
+            basket_df (pd.DataFrame | BitsetBasket | CompactBasket): Basket boolean
+            max_memory_mb (float): Memory budget of one mining run (None = no limit)
+            max_seconds (float): Time budget of one mining run (None = no limit)
+            on_exceed (str): 'warn' or 'raise' when the chosen plan exceeds a budget
+            random_state (int): Seed of the triangle sample
+        """
+        if on_exceed not in ("warn", "raise"):
+            raise ValueError(f"on_exceed phải là 'warn' hoặc 'raise', nhận được: {on_exceed}")
+
+        self.basket_df = basket_df
+        self.max_memory_mb = max_memory_mb
+        self.max_seconds = max_seconds
+        self.on_exceed = on_exceed
+        self.random_state = random_state
+        self.last_plan = None
+        self._bitset = None
+
+    @property
+    def bitset(self) -> "BitsetBasket":
+        """Bitset dọc của basket (tạo một lần, dùng lại giữa các lần plan)."""
+        if self._bitset is None:
+            self._bitset = _as_bitset(self.basket_df)
+        return self._bitset
+
+    @property
+    def is_frame(self) -> bool:
+        """Apriori và FP-Growth (mlxtend) chỉ chạy được trên DataFrame."""
+        return isinstance(self.basket_df, pd.DataFrame)
+
+    @property
+    def is_sparse(self) -> bool:
+        """Basket là DataFrame thưa (SparseDtype)."""
+        return self.is_frame and len(self.basket_df.columns) > 0 and all(
+            isinstance(dtype, pd.SparseDtype) for dtype in self.basket_df.dtypes
+        )
+
+    # ---------- level estimates ----------
+
+    def _sample_triangles(self, adjacency: sp.csr_matrix, paths: sp.csr_matrix) -> np.ndarray:
+        """
+        Uniform sample of triangles of the frequent-pair graph.
+
+        An edge (a, b) is drawn with probability proportional to its number
+        of common neighbours, then one common neighbour uniformly: every
+        triangle is reached through its three edges with equal probability.
+        """
+        edges = sp.triu(paths.multiply(adjacency), k=1).tocoo()
+        rng = np.random.default_rng(self.random_state)
+        picks = rng.choice(len(edges.data), size=self.TRIANGLE_SAMPLE,
+                           p=edges.data / edges.data.sum())
+
+        triangles = np.empty((self.TRIANGLE_SAMPLE, 3), dtype=np.int64)
+        for t, e in enumerate(picks):
+            a, b = edges.row[e], edges.col[e]
+            common = np.intersect1d(
+                adjacency.indices[adjacency.indptr[a]:adjacency.indptr[a + 1]],
+                adjacency.indices[adjacency.indptr[b]:adjacency.indptr[b + 1]],
+                assume_unique=True,
+            )
+            triangles[t] = (a, b, rng.choice(common))
+        return triangles
+
+    def _level_counts(self, min_support: float, max_len=None) -> dict:
+        """
+        Estimate frequent itemsets per level and Apriori/Eclat candidates.
+
+        Returns:
+            dict: min_count, frequent (F1, F2, ...), apriori_candidates
+            (C1, C2, ...), eclat_candidates (per level) and the totals used
+            by the cost model
+        """
+        bitset = self.bitset
+        n = bitset.n_transactions
+        min_count = _min_count(min_support, n)
+        max_len = max_len or np.inf
+
+        counts = bitset.item_counts
+        ids = np.flatnonzero(counts >= min_count)
+        f1 = len(ids)
+        frequent = [f1]
+        apriori_candidates = [len(counts)]
+        eclat_candidates = [0]
+        result = {
+            "min_count": min_count,
+            "frequent": frequent,
+            "apriori_candidates": apriori_candidates,
+            "eclat_candidates": eclat_candidates,
+            "frequent_nnz": int(counts[ids].sum()),
+            "pair_nnz_ops": 0,
+        }
+        if f1 < 2 or max_len < 2:
+            return result
+
+        pairs = bitset.pair_counts(ids)
+        # Chi phí tích ma trận thưa: mỗi hoá đơn đóng góp (số item phổ biến)^2
+        row_lengths = np.diff(bitset.to_csr(ids).indptr)
+        result["pair_nnz_ops"] = int((row_lengths.astype(np.int64) ** 2).sum())
+
+        upper = np.triu(pairs >= min_count, k=1)
+        f2 = int(upper.sum())
+        frequent.append(f2)
+        apriori_candidates.append(f1 * (f1 - 1) // 2)
+        eclat_candidates.append(f1 * (f1 - 1) // 2)
+        if f2 == 0 or max_len < 3:
+            return result
+
+        # C3 của mlxtend: mỗi cặp phổ biến (a, b) ghép với mọi item > b xuất hiện ở cấp 2
+        rows, cols = np.nonzero(upper)
+        level2_items = np.unique(np.concatenate([rows, cols]))
+        c3 = int((len(level2_items) - np.searchsorted(level2_items, cols, side="right")).sum())
+        apriori_candidates.append(c3)
+
+        # Eclat: mỗi lớp tiền tố a ghép từng cặp item phổ biến cùng a (sắp theo support tăng dần)
+        rank = np.empty(f1, dtype=np.int64)
+        rank[np.argsort(counts[ids], kind="stable")] = np.arange(f1)
+        first = np.where(rank[rows] < rank[cols], rows, cols)
+        out_degree = np.bincount(first, minlength=f1).astype(np.int64)
+        wedges = int((out_degree * (out_degree - 1) // 2).sum())
+        eclat_candidates.append(wedges)
+
+        adjacency = sp.csr_matrix(upper | upper.T, dtype=np.int64)
+        paths = adjacency @ adjacency
+        n_triangles = int(paths.multiply(adjacency).sum()) // 6
+        if n_triangles == 0:
+            return result
+
+        if n_triangles <= self.TRIANGLE_SAMPLE:
+            i, j = np.nonzero(upper)
+            mask = paths[i, j].A1 > 0
+            triangles = [
+                (a, b, c) for a, b in zip(i[mask], j[mask])
+                for c in np.flatnonzero(upper[b] & upper[a])
+            ]
+            triangles = np.array(triangles, dtype=np.int64).reshape(-1, 3)
+        else:
+            triangles = self._sample_triangles(adjacency, paths)
+        frequent_fraction = float(
+            (bitset.batch_support_counts_ids(ids[triangles]) >= min_count).mean()
+        )
+        f3 = n_triangles * frequent_fraction
+        frequent.append(f3)
+
+        # Cấp >= 4: tăng trưởng giảm dần theo LEVEL_DECAY
+        growth = f3 / f2
+        apriori_join = c3 / f2
+        eclat_join = wedges / f2
+        k = 3
+        while k < max_len and frequent[-1] >= 1:
+            growth *= self.LEVEL_DECAY
+            apriori_candidates.append(frequent[-1] * apriori_join)
+            eclat_candidates.append(frequent[-1] * eclat_join)
+            frequent.append(frequent[-1] * growth)
+            k += 1
+        return result
+
+    # ---------- cost model ----------
+
+    def _costs(self, levels: dict, n_items: int) -> pd.DataFrame:
+        """Memory (MB) and time (seconds) of every algorithm for the estimated levels."""
+        bitset = self.bitset
+        n = bitset.n_transactions
+        frequent = levels["frequent"]
+        f1 = frequent[0]
+        output = sum(frequent) * self.ITEMSET_BYTES
+
+        # Apriori (mlxtend): mỗi cấp gom X[:, combin] kích thước n x C_k x k (+ mask n x C_k)
+        level_bytes = [
+            n * c * (k + 1 if not self.is_sparse else 2) + c * k * 8
+            for k, c in enumerate(levels["apriori_candidates"][1:], start=2)
+        ]
+        basket_bytes = n * n_items if not self.is_sparse else levels["frequent_nnz"] * 16
+        apriori_bytes = basket_bytes + max(level_bytes, default=0) + output
+        apriori_ops = n * n_items + sum(
+            n * c * k for k, c in enumerate(levels["apriori_candidates"][1:], start=2)
+        )
+
+        # FP-Growth (mlxtend): dựng cây trên cả basket, chi phí tăng theo n x F1^2
+        if self.is_sparse:
+            fp_bytes = levels["frequent_nnz"] * self.FPGROWTH_BYTES_PER_NONZERO + output
+        else:
+            fp_bytes = n * n_items * self.FPGROWTH_BYTES_PER_CELL + output
+        fp_seconds = (n * n_items + n * f1 ** 2) / self.FPGROWTH_OPS_PER_SECOND
+
+        # Eclat: bitset của mọi item, ma trận cặp F1 x F1, diffset theo độ sâu
+        depth = len(frequent)
+        eclat_bytes = (
+            len(bitset.items) * bitset.n_words * 8
+            + f1 ** 2 * 8
+            + f1 * bitset.n_words * 8 * depth
+            + output
+        )
+        eclat_ops = levels["pair_nnz_ops"] + bitset.n_words * sum(levels["eclat_candidates"][2:])
+        eclat_seconds = (
+            eclat_ops / self.ECLAT_OPS_PER_SECOND
+            + sum(frequent) * self.ECLAT_SECONDS_PER_ITEMSET
+        )
+
+        costs = pd.DataFrame({
+            "candidates": [
+                sum(levels["apriori_candidates"]),
+                sum(levels["apriori_candidates"][:2]),
+                sum(levels["eclat_candidates"]) + f1,
+            ],
+            "memory_mb": [apriori_bytes, fp_bytes, eclat_bytes],
+            "seconds": [apriori_ops / self.APRIORI_OPS_PER_SECOND, fp_seconds, eclat_seconds],
+        }, index=pd.Index(self.ALGORITHMS, name="algorithm"))
+        costs["memory_mb"] /= 1024 ** 2
+        costs["candidates"] = costs["candidates"].round().astype(np.int64)
+
+        within = pd.Series(True, index=costs.index)
+        if self.max_memory_mb is not None:
+            within &= costs["memory_mb"] <= self.max_memory_mb
+        if self.max_seconds is not None:
+            within &= costs["seconds"] <= self.max_seconds
+        costs["within_budget"] = within
+        return costs
+
+    def plan(self, min_support: float = 0.01, max_len: int = None, algorithms=None) -> dict:
+        """
+        Estimate the run and choose the algorithm, without mining.
+
+        Among the allowed algorithms, the fastest one within the budget is
+        chosen; when none fits, the one with the smallest memory estimate
+        is chosen and the budget breach is warned about or raised
+        (MemoryError / TimeoutError) according to on_exceed.
+
+        Args:
+            min_support (float): Minimum support
+            max_len (int): Maximum itemset length (None = no limit)
+            algorithms (list): Algorithms to choose from (default: all that
+                can run on the basket; Apriori/FP-Growth need a DataFrame)
+
+        Returns:
+            dict: algorithm, estimates (DataFrame per algorithm with
+            candidates, memory_mb, seconds, within_budget), frequent (estimated
+            itemsets per level), n_itemsets, min_count, density
+        """
+        if not 0 < min_support <= 1:
+            raise ValueError(f"min_support phải thuộc (0, 1], nhận được: {min_support}")
+        if algorithms is None:
+            algorithms = self.ALGORITHMS if self.is_frame else ("eclat",)
+        algorithms = list(algorithms)
+        unknown = set(algorithms) - set(self.ALGORITHMS)
+        if unknown:
+            raise ValueError(f"algorithm phải thuộc {self.ALGORITHMS}, nhận được: {sorted(unknown)}")
+        if not self.is_frame and set(algorithms) - {"eclat"}:
+            raise ValueError("Apriori/FP-Growth cần basket dạng DataFrame")
+
+        bitset = self.bitset
+        n_items = len(bitset.items)
+        levels = self._level_counts(min_support, max_len)
+        estimates = self._costs(levels, n_items)
+
+        allowed = estimates.loc[algorithms]
+        fitting = allowed[allowed["within_budget"]]
+        if len(fitting):
+            algorithm = fitting["seconds"].idxmin()
+        else:
+            algorithm = allowed["memory_mb"].idxmin()
+
+        frequent = [int(round(f)) for f in levels["frequent"]]
+        while len(frequent) > 1 and frequent[-1] == 0:
+            frequent.pop()
+        self.last_plan = {
+            "algorithm": algorithm,
+            "estimates": estimates,
+            "frequent": frequent,
+            "n_itemsets": sum(frequent),
+            "min_support": min_support,
+            "min_count": levels["min_count"],
+            "density": float(bitset.item_counts.sum()) / max(1, bitset.n_transactions * n_items),
+        }
+
+        chosen = estimates.loc[algorithm]
+        print(f"Kế hoạch khai phá (min_support={min_support}): {algorithm} — "
+              f"~{self.last_plan['n_itemsets']:,} itemsets, "
+              f"~{chosen['memory_mb']:,.0f} MB, ~{chosen['seconds']:,.1f} s")
+        self._check_budget(algorithm, chosen)
+        return self.last_plan
+
+    def _check_budget(self, algorithm: str, estimate: pd.Series):
+        """Warn about or refuse a plan whose estimate exceeds the budget."""
+        problems = []
+        if self.max_memory_mb is not None and estimate["memory_mb"] > self.max_memory_mb:
+            problems.append((MemoryError, f"bộ nhớ ~{estimate['memory_mb']:,.0f} MB "
+                                          f"> {self.max_memory_mb:,} MB"))
+        if self.max_seconds is not None and estimate["seconds"] > self.max_seconds:
+            problems.append((TimeoutError, f"thời gian ~{estimate['seconds']:,.0f} s "
+                                           f"> {self.max_seconds:,} s"))
+        if not problems:
+            return
+
+        message = (f"Ước lượng cho {algorithm} vượt ngân sách: "
+                   + "; ".join(text for _, text in problems)
+                   + ". Nên tăng min_support, giới hạn max_len hoặc lọc bớt item.")
+        if self.on_exceed == "raise":
+            raise problems[0][0](message)
+        warnings.warn(message, stacklevel=3)
+
+    def mine(self, min_support: float = 0.01, max_len: int = None, use_colnames: bool = True,
+             algorithms=None) -> pd.DataFrame:
+        """
+        Plan the run, then mine with the chosen algorithm.
+
+        Args:
+            min_support (float): Minimum support
+            max_len (int): Maximum itemset length (None = no limit)
+            use_colnames (bool): Return item names instead of column positions
+            algorithms (list): Algorithms to choose from (see plan())
+
+        Returns:
+            pd.DataFrame: Frequent itemsets (support, itemsets), same schema
+            whichever algorithm runs
+        """
+        algorithm = self.plan(min_support, max_len, algorithms)["algorithm"]
+        if algorithm == "eclat":
+            miner = EclatMiner(self.basket_df)
+            miner._bitset = self.bitset
+            return miner.run(min_support=min_support, max_len=max_len, use_colnames=use_colnames)
+        if algorithm == "fpgrowth":
+            return FPGrowthMiner(self.basket_df).run(
+                min_support=min_support, max_len=max_len, use_colnames=use_colnames
+            )
+        return apriori(
+            self.basket_df, min_support=min_support, max_len=max_len, use_colnames=use_colnames
+        )
+
+
+# =========================================================
+# 20. SAMPLING-BASED MINING (TOIVONEN)
+# =========================================================
+
+def _sample_rows(n_transactions: int, sample_size, random_state) -> np.ndarray:
+    """
+    Chọn ngẫu nhiên (không lặp) các hoá đơn của mẫu, theo thứ tự tăng dần.
+
+    sample_size là số hoá đơn (int) hoặc tỉ lệ trong (0, 1] (float).
+    """
+    if isinstance(sample_size, float):
+        if not 0 < sample_size <= 1:
+            raise ValueError(f"sample_size dạng tỉ lệ phải thuộc (0, 1], nhận được: {sample_size}")
+        sample_size = int(round(sample_size * n_transactions))
+    if sample_size < 1:
+        raise ValueError("sample_size phải >= 1 hoá đơn")
+    sample_size = min(int(sample_size), n_transactions)
+    rng = np.random.default_rng(random_state)
+    return np.sort(rng.choice(n_transactions, size=sample_size, replace=False))
+
+
+def _lowered_support(min_support: float, n_sample: int, miss_probability: float) -> float:
+    """
+    Ngưỡng support hạ thấp cho mẫu.
+
+    Support trên mẫu của một itemset có support thật min_support xấp xỉ
+    phân phối chuẩn N(p, p(1-p)/n); hạ ngưỡng z độ lệch chuẩn để mỗi itemset
+    phổ biến bị bỏ sót với xác suất khoảng miss_probability. Không hạ quá
+    một nửa min_support để mẫu nhỏ không làm bùng nổ số ứng viên.
+    """
+    z = stats.norm.ppf(1 - miss_probability)
+    lowered = min_support - z * np.sqrt(min_support * (1 - min_support) / n_sample)
+    return float(max(lowered, min_support / 2))
+
+
+def _negative_border(candidates: set, max_len=None) -> list:
+    """
+    Biên âm (từ cấp 3) của một họ itemset đóng xuống (downward closed).
+
+    Itemset thuộc biên âm khi không nằm trong candidates nhưng mọi tập con
+    bỏ đi một phần tử đều nằm trong đó. Ứng viên cấp k được ghép từ hai
+    itemset cấp k-1 cùng tiền tố (như apriori-gen); itemset là tuple id tăng dần.
+    """
+    by_len = {}
+    for itemset in candidates:
+        by_len.setdefault(len(itemset), []).append(itemset)
+
+    border = []
+    k = 3
+    while by_len.get(k - 1) and (max_len is None or k <= max_len):
+        groups = {}
+        for itemset in sorted(by_len[k - 1]):
+            groups.setdefault(itemset[:-1], []).append(itemset[-1])
+        for prefix, lasts in groups.items():
+            for i, a in enumerate(lasts):
+                for b in lasts[i + 1:]:
+                    itemset = prefix + (a, b)
+                    if itemset in candidates:
+                        continue
+                    # Hai tập con prefix+(a,) và prefix+(b,) đã có; kiểm tra các tập con còn lại
+                    if all(itemset[:j] + itemset[j + 1:] in candidates for j in range(k - 2)):
+                        border.append(itemset)
+        k += 1
+    return border
+
+
+def _prefix_support_counts(bitset, itemsets: list) -> np.ndarray:
+    """
+    Đếm support của nhiều itemset (tuple id tăng dần) theo nhóm tiền tố chung.
+
+    Bitset của tiền tố được tính một lần cho cả nhóm và chỉ giữ các word
+    khác 0, nên mỗi itemset chỉ tốn một phép AND trên phần còn lại.
+    """
+    counts = np.zeros(len(itemsets), dtype=np.int64)
+    groups = {}
+    for pos, itemset in enumerate(itemsets):
+        groups.setdefault(itemset[:-1], []).append(pos)
+
+    for prefix, positions in groups.items():
+        prefix_bits = np.bitwise_and.reduce(bitset.bits[list(prefix)], axis=0)
+        words = np.flatnonzero(prefix_bits)
+        lasts = [itemsets[pos][-1] for pos in positions]
+        counts[positions] = _popcount_rows(prefix_bits[words] & bitset.bits[np.ix_(lasts, words)])
+    return counts
+
+
+def _mine_sampled(basket_df, min_support: float, sample_size, max_len, use_colnames: bool,
+                  sample_support=None, miss_probability: float = 0.01, random_state=0):
+    """
+    Khai phá xấp xỉ trên mẫu rồi kiểm tra chính xác trên toàn bộ basket.
+
+    1. Khai phá mẫu ngẫu nhiên ở ngưỡng hạ thấp (EclatMiner) -> ứng viên C.
+    2. Một lượt đếm chính xác trên BitsetBasket của toàn bộ basket: cấp 1 từ
+       item_counts, cấp 2 cho mọi cặp item phổ biến trong mẫu (một tích ma
+       trận thưa), cấp >= 3 cho C và biên âm của C.
+    3. Giữ các itemset đạt min_support. Itemset thuộc biên âm mà phổ biến
+       thật cho biết các tập cha của nó có thể bị bỏ sót.
+
+    Support trong kết quả luôn chính xác; chỉ có thể thiếu itemset.
+
+    Returns:
+        tuple: (frequent_itemsets, report). report gồm sample_size,
+        sample_support, n_candidates, n_border, missed (DataFrame các
+        itemset biên âm phổ biến thật) và complete (True = kết quả đầy đủ)
+    """
+    bitset = _as_bitset(basket_df)
+    n = bitset.n_transactions
+    min_count = _min_count(min_support, n)
+
+    rows = _sample_rows(n, sample_size, random_state)
+    if sample_support is None:
+        sample_support = _lowered_support(min_support, len(rows), miss_probability)
+    if not 0 < sample_support <= min_support:
+        raise ValueError(
+            f"sample_support phải thuộc (0, min_support], nhận được: {sample_support}"
+        )
+
+    # ---------- Pha 1: khai phá mẫu ----------
+    sample = bitset.take(rows)
+    sample_fi = EclatMiner(sample).run(
+        min_support=sample_support, max_len=max_len, use_colnames=False
+    )
+    candidates = {tuple(sorted(itemset)) for itemset in sample_fi["itemsets"]}
+
+    # ---------- Pha 2: đếm chính xác trên toàn bộ basket ----------
+    counts = bitset.item_counts
+    sample_items = np.array(sorted(i for (i, *rest) in candidates if not rest), dtype=np.int64)
+    found_ids, found_counts, missed_ids, missed_counts = [], [], [], []
+
+    # Cấp 1: item không phổ biến trong mẫu thuộc biên âm
+    for i in np.flatnonzero(counts >= min_count):
+        found_ids.append((int(i),))
+        found_counts.append(int(counts[i]))
+        if (int(i),) not in candidates:
+            missed_ids.append((int(i),))
+            missed_counts.append(int(counts[i]))
+    n_border = len(counts) - len(sample_items)
+
+    # Cấp 2: mọi cặp item phổ biến trong mẫu (cặp chưa là ứng viên thuộc biên âm)
+    if (max_len is None or max_len >= 2) and len(sample_items) > 1:
+        pairs = bitset.pair_counts(sample_items)
+        a, b = np.nonzero(np.triu(pairs >= min_count, k=1))
+        n_border += len(sample_items) * (len(sample_items) - 1) // 2 - sum(
+            len(itemset) == 2 for itemset in candidates
+        )
+        for i, j in zip(a, b):
+            itemset = (int(sample_items[i]), int(sample_items[j]))
+            found_ids.append(itemset)
+            found_counts.append(int(pairs[i, j]))
+            if itemset not in candidates:
+                missed_ids.append(itemset)
+                missed_counts.append(int(pairs[i, j]))
+
+    # Cấp >= 3: ứng viên và biên âm, đếm theo tiền tố chung trong một lượt
+    deep = [itemset for itemset in candidates if len(itemset) >= 3]
+    border = _negative_border(candidates, max_len)
+    n_border += len(border)
+    deep_counts = _prefix_support_counts(bitset, deep + border)
+    for pos, (itemset, count) in enumerate(zip(deep + border, deep_counts)):
+        if count >= min_count:
+            found_ids.append(itemset)
+            found_counts.append(int(count))
+            if pos >= len(deep):
+                missed_ids.append(itemset)
+                missed_counts.append(int(count))
+
+    frequent_itemsets = _itemsets_frame(bitset, found_ids, found_counts, use_colnames)
+    report = {
+        "sample_size": len(rows),
+        "sample_support": sample_support,
+        "n_candidates": len(candidates),
+        "n_border": n_border,
+        "missed": _itemsets_frame(bitset, missed_ids, missed_counts, use_colnames),
+        "complete": not missed_ids,
+    }
+    return frequent_itemsets, report
+
+
+# =========================================================
+# 21. INCREMENTAL MINING (NEGATIVE BORDER)
+# =========================================================
+
+class IncrementalRuleMiner:
+    """
+    Lớp duy trì frequent itemsets và luật khi basket được nối thêm hoá đơn.
+
+    Trạng thái gồm số lần xuất hiện (count) của họ L các itemset có support
+    >= border_support (mặc định BORDER_RATIO * min_support, tức các itemset
+    "gần phổ biến") cùng biên âm của L: các itemset chưa thuộc L nhưng mọi
+    tập con đều thuộc L. Cấp 1 là count của mọi item, cấp 2 là ma trận count
+    các cặp item thuộc L, cấp >= 3 là dict tuple id -> count.
+
+    Khi append(), chỉ phần hoá đơn mới được quét để cộng thêm count. Lịch sử
+    chỉ được quét lại cho các itemset mới vào biên âm, tức khi một itemset
+    của biên âm vượt ngưỡng border_support (Thomas et al., 1997). Support,
+    confidence và lift của luật được tính lại từ các count đã duy trì.
+    """
+
+    # border_support mặc định = BORDER_RATIO * min_support
+    BORDER_RATIO = 0.8
+    # Gộp các đoạn lịch sử khi vượt quá số đoạn này (quét lại nhanh hơn)
+    MAX_SEGMENTS = 16
+    # Đoạn có tối đa chừng này word (64 hoá đơn/word) được đếm vector hoá toàn bộ
+    SMALL_SEGMENT_WORDS = 16
+    # Tối đa chừng này item mới vào L thì đếm cặp bằng bitset thay vì tích ma trận thưa
+    BITSET_PAIR_ROWS = 32
+
+    def __init__(self, basket_df=None, min_support=0.01, border_support=None, max_len=None):
+        """
+        Args:
+            basket_df (pd.DataFrame | BitsetBasket | CompactBasket): Basket ban đầu
+                (None = bắt đầu rỗng, dữ liệu đến từ append())
+            min_support (float): Ngưỡng support của kết quả
+            border_support (float): Ngưỡng của họ itemset được theo dõi
+                (<= min_support; càng thấp thì càng ít lần quét lại lịch sử)
+            max_len (int): Độ dài tối đa của itemset (None = không giới hạn)
+        """
+        if border_support is None:
+            border_support = self.BORDER_RATIO * min_support
+        if not 0 < border_support <= min_support <= 1:
+            raise ValueError(
+                "Cần 0 < border_support <= min_support <= 1, nhận được: "
+                f"border_support={border_support}, min_support={min_support}"
+            )
+
+        self.min_support = min_support
+        self.border_support = border_support
+        self.max_len = max_len
+        self.n_transactions = 0
+        self.items = []
+        self._item_ids = {}
+        self.item_counts = np.zeros(0, dtype=np.int64)
+        self.pair_ids = np.zeros(0, dtype=np.int64)  # item thuộc L (hàng/cột của pair_counts)
+        self.pair_counts = np.zeros((0, 0), dtype=np.int64)
+        self._pair_pos = {}  # id item -> hàng của pair_counts
+        self.deep_counts = {}  # itemset cấp >= 3 (tuple id tăng dần) -> count
+        self.segments = []  # (BitsetBasket, id toàn cục của các item trong đoạn)
+        self.last_update = None
+        self._tracked = frozenset()
+
+        if basket_df is not None:
+            self.append(basket_df)
+
+    # ---------- history ----------
+
+    def _register_items(self, items) -> np.ndarray:
+        """Id toàn cục của các item (item mới được thêm vào cuối)."""
+        for item in items:
+            if item not in self._item_ids:
+                self._item_ids[item] = len(self.items)
+                self.items.append(item)
+        grow = len(self.items) - len(self.item_counts)
+        if grow:
+            self.item_counts = np.concatenate([self.item_counts, np.zeros(grow, dtype=np.int64)])
+        return np.array([self._item_ids[item] for item in items], dtype=np.int64)
+
+    @staticmethod
+    def _local_ids(global_ids: np.ndarray, n_items: int) -> np.ndarray:
+        """Bảng tra id toàn cục -> vị trí trong đoạn (-1 = item không có trong đoạn)."""
+        local = np.full(n_items, -1, dtype=np.int64)
+        local[global_ids] = np.arange(len(global_ids))
+        return local
+
+    def _segment_counts(self, segment, global_ids, itemsets: list) -> np.ndarray:
+        """
+        Count của các itemset (tuple id toàn cục) trong một đoạn.
+
+        Itemset chứa item không xuất hiện trong đoạn có count 0 và không cần
+        đếm; đoạn nhỏ (một lần append) được đếm bằng một lượt bitset vector
+        hoá, đoạn lớn được đếm theo nhóm tiền tố chung.
+        """
+        counts = np.zeros(len(itemsets), dtype=np.int64)
+        local = self._local_ids(global_ids, len(self.items))
+        local[global_ids[segment.item_counts == 0]] = -1
+
+        by_len = {}
+        for pos, itemset in enumerate(itemsets):
+            by_len.setdefault(len(itemset), []).append(pos)
+        for positions in by_len.values():
+            positions = np.asarray(positions, dtype=np.int64)
+            ids = local[np.array([itemsets[pos] for pos in positions], dtype=np.int64)]
+            present = (ids >= 0).all(axis=1)
+            if not present.any():
+                continue
+            if segment.n_words <= self.SMALL_SEGMENT_WORDS:
+                counts[positions[present]] = segment.batch_support_counts_ids(ids[present])
+            else:
+                counts[positions[present]] = _prefix_support_counts(
+                    segment, [tuple(row) for row in ids[present].tolist()]
+                )
+        return counts
+
+    def _segment_pair_counts(self, segment, global_ids, rows: np.ndarray,
+                             cols: np.ndarray) -> np.ndarray:
+        """Ma trận count các cặp (rows x cols, id toàn cục) trong một đoạn."""
+        local = self._local_ids(global_ids, len(self.items))
+
+        if len(rows) <= self.BITSET_PAIR_ROWS and cols is not rows:
+            # Ít hàng: AND bitset của từng item với các cột, chỉ trên word khác 0 của item
+            counts = np.zeros((len(rows), len(cols)), dtype=np.int64)
+            local_cols = local[cols]
+            present = np.flatnonzero(local_cols >= 0)
+            for i, row in enumerate(local[rows]):
+                if row < 0:
+                    continue
+                words = np.flatnonzero(segment.bits[row])
+                counts[i, present] = _popcount_rows(
+                    segment.bits[row, words] & segment.bits[np.ix_(local_cols[present], words)]
+                )
+            return counts
+
+        def columns(ids):
+            # Cột của item không có trong đoạn là cột 0
+            present = np.flatnonzero(local[ids] >= 0)
+            block = segment.to_csr(local[ids[present]]).astype(np.int64)
+            select = sp.csr_matrix(
+                (np.ones(len(present), dtype=np.int64), (np.arange(len(present)), present)),
+                shape=(len(present), len(ids)),
+            )
+            return block @ select
+
+        left = columns(rows)
+        right = left if cols is rows else columns(cols)
+        return np.asarray((left.T @ right).toarray(), dtype=np.int64)
+
+    def _merge_segments(self):
+        """Gộp các đoạn sau đoạn đầu (basket ban đầu) thành một BitsetBasket theo id toàn cục."""
+        blocks = []
+        for segment, global_ids in self.segments[1:]:
+            coo = segment.to_csr().tocoo()
+            blocks.append(sp.csr_matrix(
+                (coo.data, (coo.row, global_ids[coo.col])),
+                shape=(segment.n_transactions, len(self.items)),
+            ))
+        merged = BitsetBasket.from_matrix(sp.vstack(blocks).tocsr(), self.items)
+        self.segments = self.segments[:1] + [(merged, np.arange(len(self.items), dtype=np.int64))]
+
+    # ---------- update ----------
+
+    def append(self, basket_df) -> dict:
+        """
+        Nối thêm hoá đơn mới và cập nhật count, biên âm và kết quả.
+
+        Chỉ các hoá đơn mới được quét cho các itemset đang theo dõi; lịch sử
+        chỉ được quét lại cho các itemset vừa vào biên âm.
+
+        Args:
+            basket_df (pd.DataFrame | BitsetBasket | CompactBasket): Basket boolean
+                của các hoá đơn mới (cột là item, có thể có item chưa từng gặp)
+
+        Returns:
+            dict: Thống kê lần cập nhật (new_invoices, promoted, demoted,
+            rescanned_itemsets, n_frequent, seconds)
+        """
+        start = time.time()
+        delta = _as_bitset(basket_df)
+        global_ids = self._register_items(list(delta.items))
+
+        # ---------- Cộng count trên phần dữ liệu mới ----------
+        self.item_counts[global_ids] += delta.item_counts
+        if len(self.pair_ids):
+            self.pair_counts += self._segment_pair_counts(
+                delta, global_ids, self.pair_ids, self.pair_ids
+            )
+        if self.deep_counts:
+            itemsets = list(self.deep_counts)
+            for itemset, count in zip(itemsets, self._segment_counts(delta, global_ids, itemsets)):
+                self.deep_counts[itemset] += int(count)
+
+        self.segments.append((delta, global_ids))
+        self.n_transactions += delta.n_transactions
+        if len(self.segments) > self.MAX_SEGMENTS:
+            self._merge_segments()
+            self._prune_border()
+
+        old_tracked = self._tracked
+        rescanned = self._refresh()
+
+        self.last_update = {
+            "new_invoices": delta.n_transactions,
+            "promoted": len(self._tracked - old_tracked),
+            "demoted": len(old_tracked - self._tracked),
+            "rescanned_itemsets": rescanned,
+            "n_frequent": len(self.frequent_itemsets),
+            "seconds": time.time() - start,
+        }
+        print(f"Đã thêm {delta.n_transactions:,} hoá đơn: "
+              f"{self.last_update['n_frequent']:,} itemsets phổ biến, "
+              f"{rescanned:,} itemset phải đếm lại trên lịch sử")
+        return self.last_update
+
+    def _history_counts(self, itemsets: list) -> np.ndarray:
+        """Count của các itemset chưa theo dõi trên toàn bộ lịch sử."""
+        counts = np.zeros(len(itemsets), dtype=np.int64)
+        for segment, global_ids in self.segments:
+            counts += self._segment_counts(segment, global_ids, itemsets)
+        return counts
+
+    def _refresh(self) -> int:
+        """
+        Tính lại họ L và biên âm theo các count hiện tại.
+
+        Item mới vào L cần count cặp với mọi item của L, và itemset mới vào
+        biên âm cấp >= 3 cần count trên lịch sử; lặp tới khi L không đổi.
+
+        Returns:
+            int: Số itemset đã đếm lại trên lịch sử
+        """
+        track_count = _min_count(self.border_support, self.n_transactions)
+        rescanned = 0
+        while True:
+            # Cấp 1 & 2: item mới vào L được thêm hàng/cột vào ma trận cặp
+            level1 = np.flatnonzero(self.item_counts >= track_count)
+            if self.max_len is None or self.max_len >= 2:
+                new_ids = np.setdiff1d(level1, self.pair_ids)
+                if len(new_ids):
+                    rescanned += self._add_pair_rows(new_ids)
+
+            tracked = {(int(i),) for i in level1}
+            in_level1 = np.isin(self.pair_ids, level1)
+            a, b = np.nonzero(np.triu(self.pair_counts >= track_count, k=1))
+            for i, j in zip(a, b):
+                if in_level1[i] and in_level1[j]:
+                    tracked.add(tuple(sorted((int(self.pair_ids[i]), int(self.pair_ids[j])))))
+            tracked.update(
+                itemset for itemset, count in self.deep_counts.items() if count >= track_count
+            )
+            promoted = tracked - self._tracked
+            self._tracked = frozenset(tracked)
+
+            # Cấp >= 3: chỉ các itemset mới vào biên âm phải đếm trên lịch sử
+            # (itemset chỉ rời L thì biên âm mới nằm trong các itemset đã có count)
+            untracked = self._new_border(promoted)
+            if not untracked:
+                return rescanned
+            counts = self._history_counts(untracked)
+            rescanned += len(untracked)
+            self.deep_counts.update(zip(untracked, counts.tolist()))
+            if not (counts >= track_count).any():
+                return rescanned
+            # Có itemset mới vượt ngưỡng: L đổi, mở rộng biên âm ở vòng sau
+
+    def _new_border(self, promoted) -> list:
+        """
+        Các itemset vào biên âm vì các itemset của promoted vừa vào L.
+
+        Itemset X của biên âm chưa có count phải chứa một tập con cấp |X|-1
+        vừa vào L, nên X = P ∪ {x} với P thuộc promoted và x kề mọi item của
+        P trong đồ thị các cặp thuộc L.
+        """
+        neighbours = {}
+        for itemset in self._tracked:
+            if len(itemset) == 2:
+                a, b = itemset
+                neighbours.setdefault(a, set()).add(b)
+                neighbours.setdefault(b, set()).add(a)
+
+        border = set()
+        for prefix in promoted:
+            if len(prefix) < 2 or (self.max_len is not None and len(prefix) >= self.max_len):
+                continue
+            for item in set.intersection(*(neighbours.get(i, set()) for i in prefix)):
+                itemset = tuple(sorted(prefix + (item,)))
+                if itemset in self.deep_counts or itemset in border:
+                    continue
+                if all(itemset[:j] + itemset[j + 1:] in self._tracked for j in range(len(itemset))):
+                    border.add(itemset)
+        return sorted(border)
+
+    def _prune_border(self):
+        """Bỏ count của các itemset không còn thuộc L hay biên âm của L."""
+        self.deep_counts = {
+            itemset: count for itemset, count in self.deep_counts.items()
+            if all(itemset[:j] + itemset[j + 1:] in self._tracked for j in range(len(itemset)))
+        }
+
+    def _add_pair_rows(self, new_ids: np.ndarray) -> int:
+        """Mở rộng ma trận cặp cho các item mới vào L (đếm trên lịch sử)."""
+        all_ids = np.concatenate([self.pair_ids, new_ids])
+        new_block = np.zeros((len(new_ids), len(all_ids)), dtype=np.int64)
+        for segment, global_ids in self.segments:
+            new_block += self._segment_pair_counts(segment, global_ids, new_ids, all_ids)
+
+        n_old = len(self.pair_ids)
+        counts = np.zeros((len(all_ids), len(all_ids)), dtype=np.int64)
+        counts[:n_old, :n_old] = self.pair_counts
+        counts[n_old:, :] = new_block
+        counts[:, n_old:] = new_block.T
+        self.pair_ids = all_ids
+        self.pair_counts = counts
+        self._pair_pos = {int(item): pos for pos, item in enumerate(all_ids)}
+        return len(new_ids) * n_old + len(new_ids) * (len(new_ids) - 1) // 2
+
+    # ---------- results ----------
+
+    @property
+    def frequent_itemsets(self) -> pd.DataFrame:
+        """Frequent itemsets (cột support, itemsets) tại min_support, từ các count đã duy trì."""
+        min_count = _min_count(self.min_support, max(1, self.n_transactions))
+        found = [itemset for itemset in self._tracked if self._count(itemset) >= min_count]
+        counts = np.array([self._count(itemset) for itemset in found], dtype=np.float64)
+        frequent_itemsets = pd.DataFrame({
+            "support": counts / max(1, self.n_transactions),
+            "itemsets": [frozenset(self.items[i] for i in itemset) for itemset in found],
+        })
+        frequent_itemsets.sort_values("support", ascending=False, inplace=True)
+        return frequent_itemsets.reset_index(drop=True)
+
+    def _count(self, itemset: tuple) -> int:
+        """Count đã duy trì của một itemset đang theo dõi."""
+        if len(itemset) == 1:
+            return int(self.item_counts[itemset[0]])
+        if len(itemset) == 2:
+            return int(self.pair_counts[self._pair_pos[itemset[0]], self._pair_pos[itemset[1]]])
+        return self.deep_counts[itemset]
+
+    def generate_rules(self, min_confidence: float = 0.0, compact: bool = False,
+                       **constraints):
+        """
+        Sinh luật từ các count đã duy trì (không quét lại dữ liệu).
+
+        Args:
+            min_confidence (float): Confidence tối thiểu
+            compact (bool): Trả về CompactRuleTable thay vì DataFrame
+            **constraints: Các ràng buộc khác của generate_rules_constrained()
+                (min_lift, max_len_antecedents, must_contain, ...)
+
+        Returns:
+            pd.DataFrame | CompactRuleTable: Luật kết hợp (sắp theo lift, confidence)
+        """
+        rules = generate_rules_constrained(
+            self.frequent_itemsets, compact=compact, min_confidence=min_confidence, **constraints
+        )
+        rules = rules.sort_values(["lift", "confidence"], ascending=False)
+        return rules if compact else rules.reset_index(drop=True)